@@ -6,12 +6,14 @@
 Defines helper inline calculations.
 """
 
+import contextlib
+
 from multipledispatch import dispatch
 
 from aiida import orm
 from aiida.engine import calcfunction
 
-__all__ = ('merge_nested_dict', 'slice_bands_inline')
+__all__ = ('merge_nested_dict', 'slice_bands_inline', 'subsample_bands_inline')
 
 
 @calcfunction
@@ -25,6 +27,31 @@ def slice_bands_inline(bands, slice_idx):
     return result
 
 
+@calcfunction
+def subsample_bands_inline(bands, stride):
+    """
+    Subsamples the given BandsData such that only every ``stride``-th
+    k-point remains. Labels of the removed k-points are discarded.
+    """
+    stride_value = stride.value
+    kpoints = bands.get_kpoints()
+    weights = None
+    with contextlib.suppress(AttributeError):
+        weights = bands.get_kpoints(also_weights=True)[1][::stride_value]
+    labels = [(idx // stride_value, label)
+              for idx, label in (bands.labels or [])
+              if idx % stride_value == 0]
+
+    result = orm.BandsData()
+    with contextlib.suppress(AttributeError):
+        result.set_cell(bands.cell, pbc=bands.pbc)
+    result.set_kpoints(kpoints[::stride_value], weights=weights, labels=labels)
+    result.set_bands(
+        bands.get_bands()[..., ::stride_value, :], units=bands.units
+    )
+    return result
+
+
 @calcfunction
 def merge_nested_dict(dict_primary, dict_secondary):
     """
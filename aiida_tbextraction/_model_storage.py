@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines helper functions for the compact storage of tight-binding models.
+
+Compact models are written in the usual TBmodels HDF5 format, but all
+numeric arrays are stored as chunked, compressed datasets. Since the
+compression is handled by HDF5 itself, the files are still loaded with
+``tbmodels.io.load``. Models are deduplicated by a hash of their HDF5
+content (instead of the file bytes, which depend on the storage layout),
+such that identical models are represented by the same node.
+"""
+
+import os
+import hashlib
+import tempfile
+
+import h5py
+import numpy as np
+
+from aiida import orm
+from aiida.engine import workfunction
+
+__all__ = (
+    'write_model', 'get_model_hash', 'deduplicate_model',
+    'deduplicate_model_inline'
+)
+
+#: Extra in which the content hash of a tight-binding model is stored.
+MODEL_HASH_EXTRA = 'tbextraction_model_hash'
+
+#: Level of the gzip compression used for compact models.
+COMPRESSION_LEVEL = 4
+
+
+def write_model(model, path, compress=False):
+    """
+    Write a tight-binding model to a file in HDF5 format, optionally
+    compressing all numeric arrays.
+    """
+    if not compress:
+        model.to_hdf5_file(path)
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        uncompressed_path = os.path.join(folder, 'model_uncompressed.hdf5')
+        model.to_hdf5_file(uncompressed_path)
+        with h5py.File(uncompressed_path, 'r') as source:
+            with h5py.File(path, 'w') as target:
+                _copy_compressed(source, target)
+
+
+def get_model_hash(handle):
+    """
+    Calculate a hash of the content (groups, datasets and attributes) of
+    an HDF5 file, given as path or binary file handle. The hash does not
+    depend on the storage layout or compression of the file.
+    """
+    content_hash = hashlib.sha256()
+    with h5py.File(handle, 'r') as hdf5_file:
+        _update_hash(content_hash, hdf5_file)
+    return content_hash.hexdigest()
+
+
+def deduplicate_model(tb_model):
+    """
+    Returns the oldest stored tight-binding model with the same content as
+    the given (stored) model. The content hash is stored as an extra on the
+    given model, such that it is found by later calls. If an older model
+    exists, it is returned through ``deduplicate_model_inline``, which
+    records in the provenance that it replaces the given model.
+    """
+    model_hash = tb_model.get_extra(MODEL_HASH_EXTRA, None)
+    if model_hash is None:
+        with tb_model.open(mode='rb') as handle:
+            model_hash = get_model_hash(handle)
+        tb_model.set_extra(MODEL_HASH_EXTRA, model_hash)
+    query = orm.QueryBuilder()
+    query.append(
+        orm.SinglefileData,
+        filters={'extras.{}'.format(MODEL_HASH_EXTRA): model_hash},
+        project='*'
+    )
+    query.order_by({orm.SinglefileData: {'ctime': 'asc'}})
+    query.limit(1)
+    existing_model = query.first()[0]
+    if existing_model.uuid == tb_model.uuid:
+        return tb_model
+    return deduplicate_model_inline(
+        tb_model=tb_model, existing_model=existing_model
+    )
+
+
+@workfunction
+def deduplicate_model_inline(tb_model, existing_model):
+    """
+    Returns the existing tight-binding model, which has the same content
+    as the given model. Both models are linked as inputs, such that the
+    provenance shows which model is replaced.
+    """
+    if tb_model.get_extra(MODEL_HASH_EXTRA
+                          ) != existing_model.get_extra(MODEL_HASH_EXTRA):
+        raise ValueError(
+            'The existing model does not have the same content as the '
+            'given model.'
+        )
+    return existing_model
+
+
+def _copy_compressed(source, target):
+    """
+    Recursively copy the content of an HDF5 group, compressing the
+    numeric arrays.
+    """
+    for key, value in source.attrs.items():
+        target.attrs[key] = value
+    for name, item in source.items():
+        if isinstance(item, h5py.Group):
+            _copy_compressed(item, target.create_group(name))
+            continue
+        if item.ndim > 0 and item.dtype.kind in 'biufc':
+            dataset = target.create_dataset(
+                name,
+                data=item[()],
+                dtype=item.dtype,
+                chunks=True,
+                shuffle=True,
+                compression='gzip',
+                compression_opts=COMPRESSION_LEVEL
+            )
+        else:
+            dataset = target.create_dataset(
+                name, data=item[()], dtype=item.dtype
+            )
+        for key, value in item.attrs.items():
+            dataset.attrs[key] = value
+
+
+def _update_hash(content_hash, item):
+    """
+    Recursively add the content of an HDF5 group or dataset to the hash.
+    """
+    for key in sorted(item.attrs.keys()):
+        content_hash.update(key.encode())
+        content_hash.update(_to_bytes(item.attrs[key]))
+    if isinstance(item, h5py.Group):
+        for name in sorted(item.keys()):
+            content_hash.update(name.encode())
+            _update_hash(content_hash, item[name])
+    else:
+        content_hash.update(_to_bytes(item[()]))
+
+
+def _to_bytes(value):
+    """
+    Convert the value of an HDF5 dataset or attribute to bytes. Object
+    arrays (e.g. variable-length strings) are converted through their
+    representation, since their raw buffer contains only pointers.
+    """
+    data = np.asarray(value)
+    if data.dtype.kind == 'O':
+        return repr(data.tolist()).encode()
+    return str((data.dtype.str, data.shape)).encode() + data.tobytes()
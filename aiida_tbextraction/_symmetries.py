@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines helper functions to pre-process the symmetries used in the
+symmetrization of tight-binding models.
+
+The pre-processed symmetries are a flat list of symmetry groups which all
+contain the full group. Symmetry operations which are given only as
+generators are expanded into the cyclic group they generate, such that
+the symmetrization does not have to construct the powers of each
+operation again. The result is equivalent to the original symmetries, and
+is stored in the same ``symmetry_representation`` HDF5 format.
+"""
+
+import os
+import tempfile
+import functools
+
+import symmetry_representation as sr
+
+from aiida import orm
+from aiida.engine import calcfunction
+
+__all__ = (
+    'preprocess_symmetries_inline', 'get_preprocessed_symmetries',
+    'load_symmetries'
+)
+
+#: Version of the pre-processing. Changing it invalidates existing results.
+PREPROCESSING_VERSION = 1
+
+SOURCE_HASH_EXTRA = 'tbextraction_symmetries_source_hash'
+
+
+@calcfunction
+def preprocess_symmetries_inline(symmetries):
+    """
+    Converts the given symmetries into a list of full symmetry groups.
+    """
+    with symmetries.open(mode='rb') as in_file:
+        groups = _expand_groups(sr.io.load(in_file))
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, 'symmetries.hdf5')
+        sr.io.save(groups, output_path)
+        return orm.SinglefileData(file=output_path)
+
+
+def get_preprocessed_symmetries(symmetries):
+    """
+    Get the pre-processed version of the given symmetries. An existing
+    result with the same source file hash is re-used if possible.
+    """
+    if SOURCE_HASH_EXTRA in symmetries.extras:
+        return symmetries
+    source_hash = '{}:{}'.format(PREPROCESSING_VERSION, symmetries.get_hash())
+    query = orm.QueryBuilder()
+    query.append(
+        orm.SinglefileData,
+        filters={'extras.{}'.format(SOURCE_HASH_EXTRA): source_hash},
+        project='*'
+    )
+    query.order_by({orm.SinglefileData: {'ctime': 'desc'}})
+    query.limit(1)
+    result = query.first()
+    if result is not None:
+        return result[0]
+    preprocessed = preprocess_symmetries_inline(symmetries=symmetries)
+    preprocessed.set_extra(SOURCE_HASH_EXTRA, source_hash)
+    return preprocessed
+
+
+def load_symmetries(symmetries):
+    """
+    Load the symmetries from a stored ``SinglefileData`` node. The loaded
+    symmetries are kept in memory, such that repeated calls in the same
+    process do not read the file again.
+    """
+    return _load_symmetries_cached(symmetries.uuid)
+
+
+@functools.lru_cache(maxsize=16)
+def _load_symmetries_cached(uuid):
+    with orm.load_node(uuid).open(mode='rb') as in_file:
+        return sr.io.load(in_file)
+
+
+def _expand_groups(symmetries):
+    """
+    Expand a symmetry group, a single symmetry operation, or a (nested) list
+    of these into a flat list of full symmetry groups. This follows the
+    conventions of the TBmodels 'symmetrize' command.
+    """
+    if isinstance(symmetries, sr.SymmetryGroup):
+        if symmetries.full_group:
+            return [symmetries]
+        return [_cyclic_group(sym) for sym in symmetries.symmetries]
+    if isinstance(symmetries, sr.SymmetryOperation):
+        return [_cyclic_group(symmetries)]
+    return [group for sym in symmetries for group in _expand_groups(sym)]
+
+
+def _cyclic_group(symmetry):
+    """
+    Returns the cyclic group generated by the given symmetry operation.
+    """
+    powers = [symmetry]
+    for _ in range(1, symmetry.get_order()):
+        powers.append(powers[-1] @ symmetry)
+    return sr.SymmetryGroup(symmetries=powers, full_group=True)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines helper functions to restart a Wannier90 calculation from the
+converged gauge of a previous calculation.
+
+The Wannier90 checkpoint cannot be used directly for a different energy
+window, because it contains the disentangled subspace of the previous
+window. Instead, the total gauge transformation ``U_opt(k) U(k)`` of the
+previous calculation is written to the ``.amn`` file, and used as initial
+projections for the disentanglement and Wannierisation.
+"""
+
+import io
+import struct
+
+import numpy as np
+
+from aiida import orm
+from aiida.engine import calcfunction
+
+__all__ = (
+    'read_checkpoint_gauge', 'write_amn', 'create_restart_input_folder_inline'
+)
+
+#: Prefix of the Wannier90 input and output files.
+SEEDNAME = 'aiida'
+
+CHECKPOINT_FILE_NAME = SEEDNAME + '.chk'
+AMN_FILE_NAME = SEEDNAME + '.amn'
+
+
+@calcfunction
+def create_restart_input_folder_inline(input_folder, checkpoint_folder):
+    """
+    Create a copy of the given Wannier90 input folder, where the ``.amn``
+    file is replaced by the gauge of the checkpoint file in the given
+    (retrieved) folder. The resulting folder contains all input files, such
+    that it can be used without a remote input folder.
+    """
+    with checkpoint_folder.open(CHECKPOINT_FILE_NAME, mode='rb') as chk_file:
+        gauge = read_checkpoint_gauge(chk_file)
+    result = orm.FolderData()
+    for filename in input_folder.list_object_names():
+        if filename == AMN_FILE_NAME:
+            continue
+        with input_folder.open(filename, mode='rb') as in_file:
+            result.put_object_from_filelike(in_file, filename, mode='wb')
+    amn_content = io.StringIO()
+    write_amn(amn_content, gauge)
+    amn_content.seek(0)
+    result.put_object_from_filelike(amn_content, AMN_FILE_NAME)
+    return result
+
+
+def read_checkpoint_gauge(handle):
+    """
+    Read the total gauge transformation from an unformatted Wannier90
+    checkpoint file.
+
+    Returns
+    -------
+    gauge : array
+        Complex array of shape ``(num_kpts, num_bands, num_wann)``, which
+        contains the matrix ``U_opt(k) U(k)`` at each k-point. Rows of bands
+        outside the outer energy window are zero.
+    """
+    records = _read_records(handle)
+    next(records)  # header
+    num_bands = _read_int(next(records))
+    next(records)  # number of excluded bands
+    next(records)  # excluded bands
+    next(records)  # real lattice
+    next(records)  # reciprocal lattice
+    num_kpts = _read_int(next(records))
+    next(records)  # Monkhorst-Pack grid
+    next(records)  # k-points
+    next(records)  # number of nearest neighbours
+    num_wann = _read_int(next(records))
+    next(records)  # checkpoint position
+    have_disentangled = bool(_read_int(next(records)))
+    if have_disentangled:
+        next(records)  # Omega invariant
+        lwindow = np.frombuffer(next(records), dtype='<i4').reshape(
+            (num_kpts, num_bands)
+        ).astype(bool)
+        ndimwin = np.frombuffer(next(records), dtype='<i4')
+        u_matrix_opt = np.frombuffer(next(records), dtype='<c16').reshape(
+            (num_kpts, num_wann, num_bands)
+        ).transpose(0, 2, 1)
+    u_matrix = np.frombuffer(next(records), dtype='<c16').reshape(
+        (num_kpts, num_wann, num_wann)
+    ).transpose(0, 2, 1)
+
+    if not have_disentangled:
+        return np.array(u_matrix)
+    gauge = np.zeros((num_kpts, num_bands, num_wann), dtype=complex)
+    for k_idx in range(num_kpts):
+        num_win = ndimwin[k_idx]
+        gauge[k_idx, lwindow[k_idx]] = np.dot(
+            u_matrix_opt[k_idx, :num_win], u_matrix[k_idx]
+        )
+    return gauge
+
+
+def write_amn(handle, gauge):
+    """
+    Write the gauge transformation, of shape
+    ``(num_kpts, num_bands, num_wann)``, to a text handle in the format of
+    the Wannier90 ``.amn`` file.
+    """
+    num_kpts, num_bands, num_wann = gauge.shape
+    handle.write(
+        'Created from the Wannier90 checkpoint by aiida-tbextraction\n'
+    )
+    handle.write('{} {} {}\n'.format(num_bands, num_kpts, num_wann))
+    # The band index runs fastest, followed by the Wannier function and
+    # the k-point index.
+    indices = np.indices((num_kpts, num_wann, num_bands)).reshape(3, -1) + 1
+    k_idx, n_idx, m_idx = indices
+    values = gauge.transpose(0, 2, 1).reshape(-1)
+    np.savetxt(
+        handle,
+        np.column_stack([m_idx, n_idx, k_idx, values.real, values.imag]),
+        fmt='%5d%5d%5d%18.12f%18.12f'
+    )
+
+
+def _read_records(handle):
+    """
+    Iterate over the records of a Fortran unformatted sequential file.
+    """
+    while True:
+        marker = handle.read(4)
+        if not marker:
+            return
+        length, = struct.unpack('<i', marker)
+        data = handle.read(length)
+        handle.read(4)
+        yield data
+
+
+def _read_int(record):
+    return struct.unpack('<i', record[:4])[0]
@@ -6,19 +6,56 @@
 Defines a workflow for calculating a tight-binding model for a given Wannier90 input and symmetries.
 """
 
+import os
+import gzip
+import shutil
+import tempfile
 from collections import ChainMap
 
+import numpy as np
+import tbmodels
+import symmetry_representation as sr
+from bands_inspect.eigenvals import EigenvalsData
+
 from aiida import orm
-from aiida.engine import WorkChain, if_, ToContext
+from aiida.engine import WorkChain, if_, ToContext, calcfunction
 
 from aiida_tools import check_workchain_step
+from aiida_bands_inspect.convert import to_bands_inspect
 from aiida_tbmodels.workflows.parse import ParseWorkChain
 from aiida_tbmodels.calculations.slice import SliceCalculation
 from aiida_tbmodels.calculations.symmetrize import SymmetrizeCalculation
 from aiida_wannier90.calculations import Wannier90Calculation
 
+from ._symmetries import get_preprocessed_symmetries, load_symmetries
+from ._model_storage import write_model, deduplicate_model
+from ._wannier_restart import SEEDNAME, create_restart_input_folder_inline
+
 __all__ = ('TightBindingCalculation', )
 
+# Wannier90 files which are read by TBmodels, and are compressed on the
+# remote computer if 'compress_output' is set. Only the compressed files are
+# retrieved in this case.
+_COMPRESSED_FILE_NAMES = [
+    SEEDNAME + suffix
+    for suffix in ['_hr.dat', '_wsvec.dat', '_centres.xyz', '.win']
+]
+_COMPRESS_COMMAND = (
+    'for filename in {}; do if [ -f "$filename" ]; then '
+    'gzip -f "$filename"; fi; done'.format(' '.join(_COMPRESSED_FILE_NAMES))
+)
+
+# Inputs of the 'parse.calc' namespace which are passed to the fused
+# TBmodels calcfunction.
+_FUSED_PARSE_INPUTS = (
+    'pos_kind', 'distance_ratio_threshold', 'ignore_orbital_order'
+)
+
+# Boolean inputs which are supported only if 'fuse_tbmodels' is set.
+_FUSED_ONLY_INPUTS = (
+    'preprocess_symmetries', 'compress_output', 'compact_model_storage'
+)
+
 
 class TightBindingCalculation(WorkChain):
     """
@@ -77,25 +114,172 @@ class TightBindingCalculation(WorkChain):
             valid_type=orm.Code,
             help='Code that runs the TBmodels CLI.'
         )
+        spec.input(
+            'retrieve_checkpoint',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the Wannier90 checkpoint file is '
+            "retrieved, and the retrieved folder is added to the outputs as "
+            "'checkpoint_folder'."
+        )
+        spec.input(
+            'restart_checkpoint_folder',
+            valid_type=orm.FolderData,
+            required=False,
+            help='Retrieved folder of a previous Wannier90 calculation for '
+            'the same system, which contains the checkpoint file. The '
+            'converged gauge of that calculation (e.g. for a nearby energy '
+            'window) is used as initial projections, replacing the '
+            "``.amn`` file of the 'wannier.local_input_folder'. The "
+            'restart is ignored if no '
+            "'wannier.local_input_folder' is given, or if a "
+            "'wannier.remote_input_folder' is given as well."
+        )
+        spec.input(
+            'preprocess_symmetries',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help="Determines whether the 'symmetries' are converted to a "
+            'list of full symmetry groups before the symmetrization. The '
+            'converted symmetries are re-used by all calculations with the '
+            'same symmetries file, and are kept in memory by the fused '
+            "TBmodels step. This requires 'fuse_tbmodels', since the "
+            'TBmodels symmetrize calculation reads the symmetries from file '
+            'in each calculation.'
+        )
+        spec.input(
+            'fuse_tbmodels',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the parse, slice and symmetrize steps '
+            'are performed in a single calcfunction, using the TBmodels '
+            'Python interface, instead of separate calculations. Only the '
+            "'pos_kind', 'distance_ratio_threshold' and "
+            "'ignore_orbital_order' inputs of the 'parse.calc' namespace "
+            "are used in this case, and the other inputs of the 'parse', "
+            "'slice' and 'symmetrize' namespaces are ignored."
+        )
+        spec.input(
+            'compress_output',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the ``_hr.dat``, ``_wsvec.dat``, '
+            '``_centres.xyz`` and ``.win`` files of Wannier90 are compressed '
+            'on the remote computer, and retrieved only in compressed form. '
+            "This requires 'fuse_tbmodels', since the TBmodels parse "
+            'calculation can not read the compressed files.'
+        )
+        spec.input(
+            'compact_model_storage',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the tight-binding models are stored '
+            'as chunked, compressed HDF5. The models can still be loaded '
+            "with ``tbmodels.io.load``. The output models are deduplicated "
+            'by their content: if a model with the same content exists, it '
+            'is returned instead of the new model, through a workfunction '
+            "which links both models. This requires 'fuse_tbmodels', since "
+            'the models written by the TBmodels calculations are not '
+            'compressed.'
+        )
+        spec.input(
+            'truncation_hopping_threshold',
+            valid_type=orm.Float,
+            required=False,
+            help='If given, hopping terms whose absolute value is smaller '
+            'than this threshold are removed from the truncated '
+            "tight-binding model, which is added to the outputs as "
+            "'tb_model_truncated'."
+        )
+        spec.input(
+            'truncation_distance_cutoff',
+            valid_type=orm.Float,
+            required=False,
+            help='If given, hopping terms between orbitals whose cartesian '
+            'distance is larger than this cutoff are removed from the '
+            "truncated tight-binding model, which is added to the outputs "
+            "as 'tb_model_truncated'."
+        )
+        spec.inputs.validator = cls._validate_inputs
 
         spec.output(
             'tb_model',
             valid_type=orm.SinglefileData,
             help='The calculated tight-binding model, in TBmodels HDF5 format.'
         )
+        spec.output(
+            'checkpoint_folder',
+            valid_type=orm.FolderData,
+            required=False,
+            help='Retrieved folder of the Wannier90 calculation, which '
+            'contains the checkpoint file.'
+        )
+        spec.output(
+            'tb_model_truncated',
+            valid_type=orm.SinglefileData,
+            required=False,
+            help='The tight-binding model where small or long-range hopping '
+            'terms are removed, in TBmodels HDF5 format.'
+        )
+        spec.output(
+            'truncation_info',
+            valid_type=orm.Dict,
+            required=False,
+            help='Number of hopping terms before and after the truncation, '
+            'and the maximum and mean change of the eigenvalues at the '
+            'Wannier90 k-points caused by the truncation.'
+        )
 
         spec.outline(
-            cls.run_wannier, cls.parse,
-            if_(cls.has_slice)(cls.slice),
-            if_(cls.has_symmetries)(cls.symmetrize), cls.finalize
+            if_(cls.has_symmetries)(cls.prepare_symmetries), cls.run_wannier,
+            if_(cls.is_fused)(cls.run_fused).else_(
+                cls.parse,
+                if_(cls.has_slice)(cls.slice),
+                if_(cls.has_symmetries)(cls.symmetrize),
+            ),
+            if_(cls.has_truncation)(cls.truncate), cls.finalize
         )
 
+    @staticmethod
+    def _validate_inputs(inputs, ctx=None):  # pylint: disable=unused-argument,inconsistent-return-statements
+        """
+        Checks that the inputs which require the fused TBmodels step are
+        set only together with 'fuse_tbmodels'.
+        """
+        if 'fuse_tbmodels' in inputs and inputs['fuse_tbmodels'].value:
+            return
+        for key in _FUSED_ONLY_INPUTS:
+            if key in inputs and inputs[key].value:
+                return "The '{}' input requires 'fuse_tbmodels'.".format(key)
+
     def has_slice(self):
         return 'slice_idx' in self.inputs
 
     def has_symmetries(self):
         return 'symmetries' in self.inputs
 
+    def is_fused(self):
+        return self.inputs.fuse_tbmodels.value
+
+    def has_truncation(self):
+        return any(
+            key in self.inputs for key in
+            ['truncation_hopping_threshold', 'truncation_distance_cutoff']
+        )
+
+    @check_workchain_step
+    def prepare_symmetries(self):
+        """
+        Pre-process the symmetries, if requested.
+        """
+        if self.inputs.preprocess_symmetries.value:
+            self.report("Retrieving pre-processed symmetries.")
+            self.ctx.symmetries = get_preprocessed_symmetries(
+                self.inputs.symmetries
+            )
+        else:
+            self.ctx.symmetries = self.inputs.symmetries
+
     @check_workchain_step
     def run_wannier(self):
         """
@@ -111,12 +295,48 @@ class TightBindingCalculation(WorkChain):
         self.report("Running Wannier90 calculation.")
 
         wannier_inputs['parameters'] = orm.Dict(dict=wannier_parameters)
+        if self.inputs.compress_output.value:
+            self.report("Compressing Wannier90 output files.")
+            additional_retrieve_list = [
+                filename + '.gz' for filename in _COMPRESSED_FILE_NAMES
+            ]
+            metadata = dict(wannier_inputs.get('metadata', {}))
+            options = dict(metadata.get('options', {}))
+            options['append_text'] = '\n'.join([
+                options.get('append_text', ''), _COMPRESS_COMMAND
+            ]).strip()
+            metadata['options'] = options
+            wannier_inputs['metadata'] = metadata
+        else:
+            additional_retrieve_list = ['*.win']
+        if self.inputs.retrieve_checkpoint.value:
+            additional_retrieve_list.append('*.chk')
         wannier_inputs['settings'] = orm.Dict(
             dict=ChainMap(
                 wannier_inputs.get('settings', orm.Dict()).get_dict(),
-                {"additional_retrieve_list": ['*.win']}
+                {"additional_retrieve_list": additional_retrieve_list}
             )
         )
+        restart_folder = self.inputs.get('restart_checkpoint_folder', None)
+        if restart_folder is not None:
+            # The new '.amn' file is written into a copy of the complete
+            # input folder, because the files of a remote input folder
+            # are copied after the local files, and would overwrite them.
+            if 'local_input_folder' in wannier_inputs and (
+                'remote_input_folder' not in wannier_inputs
+            ):
+                self.report("Using the gauge of the checkpoint file.")
+                input_folder = create_restart_input_folder_inline(
+                    input_folder=wannier_inputs['local_input_folder'],
+                    checkpoint_folder=restart_folder
+                )
+                wannier_inputs['local_input_folder'] = input_folder
+            else:
+                self.report(
+                    "Restart requires the 'wannier.local_input_folder' "
+                    "input, and no 'wannier.remote_input_folder'. Ignoring "
+                    "the checkpoint file."
+                )
 
         return ToContext(
             wannier_calc=self.submit(
@@ -128,8 +348,33 @@ class TightBindingCalculation(WorkChain):
 
     @property
     def tb_model(self):
+        if 'fused_tb_model' in self.ctx:
+            return self.ctx.fused_tb_model
         return self.ctx.tbmodels_calc.outputs.tb_model
 
+    @check_workchain_step
+    def run_fused(self):
+        """
+        Parses the Wannier90 output, and slices and symmetrizes the
+        resulting tight-binding model in a single calcfunction.
+        """
+        parse_inputs = self.exposed_inputs(ParseWorkChain,
+                                           namespace='parse')['calc']
+        inputs = {
+            key: parse_inputs[key]
+            for key in _FUSED_PARSE_INPUTS if key in parse_inputs
+        }
+        if self.has_slice():
+            inputs['slice_idx'] = self.inputs.slice_idx
+        if self.has_symmetries():
+            inputs['symmetries'] = self.ctx.symmetries
+        if self.inputs.compact_model_storage.value:
+            inputs['compress'] = self.inputs.compact_model_storage
+        self.report("Creating tight-binding model from Wannier90 output.")
+        self.ctx.fused_tb_model = fused_tbmodels_inline(
+            wannier_folder=self.ctx.wannier_calc.outputs.retrieved, **inputs
+        )
+
     @check_workchain_step
     def parse(self):
         """
@@ -166,15 +411,208 @@ class TightBindingCalculation(WorkChain):
         )
         inputs.setdefault('code', self.inputs.code_tbmodels)
         inputs['tb_model'] = self.tb_model
+        inputs['symmetries'] = self.ctx.symmetries
         self.report("Symmetrizing tight-binding model.")
         return ToContext(
             tbmodels_calc=self.submit(SymmetrizeCalculation, **inputs)
         )
 
+    @check_workchain_step
+    def truncate(self):
+        """
+        Removes small or long-range hopping terms from the tight-binding
+        model.
+        """
+        inputs = {}
+        if 'truncation_hopping_threshold' in self.inputs:
+            inputs['hopping_threshold'
+                   ] = self.inputs.truncation_hopping_threshold
+        if 'truncation_distance_cutoff' in self.inputs:
+            inputs['distance_cutoff'] = self.inputs.truncation_distance_cutoff
+        if self.inputs.compact_model_storage.value:
+            inputs['compress'] = self.inputs.compact_model_storage
+        self.report("Truncating tight-binding model.")
+        result = truncate_model_inline(
+            tb_model=self.tb_model,
+            kpoints=self.inputs.wannier.kpoints,
+            **inputs
+        )
+        self.ctx.truncated_tb_model = result['tb_model']
+        self.ctx.truncation_info = result['truncation_info']
+        info = self.ctx.truncation_info.get_dict()
+        self.report(
+            'Removed {} of {} hopping terms, which changes the eigenvalues '
+            'by at most {:.4g} eV (mean {:.4g} eV).'.format(
+                info['num_hoppings'] - info['num_hoppings_truncated'],
+                info['num_hoppings'], info['max_eigenvalue_difference'],
+                info['mean_eigenvalue_difference']
+            )
+        )
+
     @check_workchain_step
     def finalize(self):
         """
         Adds the final tight-binding model to the output.
         """
-        self.out("tb_model", self.tb_model)
+        tb_model = self.tb_model
+        truncated_tb_model = self.ctx.get('truncated_tb_model', None)
+        if self.inputs.compact_model_storage.value:
+            self.report('Deduplicating tight-binding models.')
+            tb_model = deduplicate_model(tb_model)
+            if truncated_tb_model is not None:
+                truncated_tb_model = deduplicate_model(truncated_tb_model)
+        self.out("tb_model", tb_model)
         self.report('Adding tight-binding model to results.')
+        if self.has_truncation():
+            self.out('tb_model_truncated', truncated_tb_model)
+            self.out('truncation_info', self.ctx.truncation_info)
+        if self.inputs.retrieve_checkpoint.value:
+            self.out(
+                'checkpoint_folder', self.ctx.wannier_calc.outputs.retrieved
+            )
+
+
+@calcfunction
+def fused_tbmodels_inline(
+    wannier_folder,
+    pos_kind,
+    distance_ratio_threshold=None,
+    ignore_orbital_order=None,
+    slice_idx=None,
+    symmetries=None,
+    compress=None
+):
+    """
+    Creates a tight-binding model from the retrieved Wannier90 output, and
+    optionally slices and symmetrizes it. This is equivalent to running the
+    TBmodels 'parse', 'slice' and 'symmetrize' commands, but only the final
+    model is written to a file. Output files which were compressed with
+    gzip are decompressed before parsing. If 'ignore_orbital_order' is not
+    given, the orbital order is ignored as in the TBmodels 'parse'
+    command. If 'compress' is set, the model is written as compressed HDF5.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        for filename in wannier_folder.list_object_names():
+            _extract_object(wannier_folder, filename, folder)
+        parse_kwargs = dict(
+            ignore_orbital_order=True
+            if ignore_orbital_order is None else ignore_orbital_order.value,
+            pos_kind=pos_kind.value
+        )
+        if distance_ratio_threshold is not None:
+            parse_kwargs['distance_ratio_threshold'
+                         ] = distance_ratio_threshold.value
+        model = tbmodels.Model.from_wannier_folder(
+            folder=folder, prefix='aiida', **parse_kwargs
+        )
+        if slice_idx is not None:
+            model = model.slice_orbitals(slice_idx=slice_idx.get_list())
+        if symmetries is not None:
+            model = _symmetrize(model, load_symmetries(symmetries))
+
+        output_path = os.path.join(folder, 'model.hdf5')
+        write_model(
+            model,
+            output_path,
+            compress=compress is not None and compress.value
+        )
+        return orm.SinglefileData(file=output_path)
+
+
+@calcfunction
+def truncate_model_inline(
+    tb_model,
+    kpoints,
+    hopping_threshold=None,
+    distance_cutoff=None,
+    compress=None
+):
+    """
+    Removes hopping terms which are smaller than the given threshold, or
+    longer than the given cartesian distance, from the tight-binding model.
+    The change of the eigenvalues at the given k-points is returned
+    together with the truncated model. If 'compress' is set, the truncated
+    model is written as compressed HDF5.
+    """
+    with tb_model.open(mode='rb') as input_file:
+        model = tbmodels.io.load(input_file)
+    with tb_model.open(mode='rb') as input_file:
+        truncated_model = tbmodels.io.load(input_file)
+    if hopping_threshold is not None:
+        truncated_model.remove_small_hop(cutoff=hopping_threshold.value)
+    if distance_cutoff is not None:
+        truncated_model.remove_long_range_hop(
+            cutoff_distance_cartesian=distance_cutoff.value
+        )
+
+    kpoints_bi = to_bands_inspect(kpoints)
+    if isinstance(kpoints_bi, EigenvalsData):
+        kpoints_bi = kpoints_bi.kpoints
+    kpoints_explicit = kpoints_bi.kpoints_explicit
+    eigenvalue_difference = np.abs(
+        np.array(model.eigenval(kpoints_explicit)) -
+        np.array(truncated_model.eigenval(kpoints_explicit))
+    )
+    truncation_info = orm.Dict(
+        dict=dict(
+            num_hoppings=_count_hoppings(model),
+            num_hoppings_truncated=_count_hoppings(truncated_model),
+            max_eigenvalue_difference=float(np.max(eigenvalue_difference)),
+            mean_eigenvalue_difference=float(np.mean(eigenvalue_difference))
+        )
+    )
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, 'model.hdf5')
+        write_model(
+            truncated_model,
+            output_path,
+            compress=compress is not None and compress.value
+        )
+        return {
+            'tb_model': orm.SinglefileData(file=output_path),
+            'truncation_info': truncation_info
+        }
+
+
+def _extract_object(folder_data, filename, target_dir):
+    """
+    Copies a file from a ``FolderData`` to the target directory. Files
+    compressed with gzip are decompressed, and their '.gz' suffix removed.
+    """
+    is_compressed = filename.endswith('.gz')
+    target_path = os.path.join(
+        target_dir, filename[:-len('.gz')] if is_compressed else filename
+    )
+    with folder_data.open(filename, mode='rb') as in_file:
+        with open(target_path, 'wb') as out_file:
+            if is_compressed:
+                with gzip.GzipFile(fileobj=in_file) as gzip_file:
+                    shutil.copyfileobj(gzip_file, out_file)
+            else:
+                shutil.copyfileobj(in_file, out_file)
+
+
+def _count_hoppings(model):
+    """
+    Returns the number of non-zero hopping terms of the model.
+    """
+    return int(
+        sum(np.count_nonzero(hop_mat) for hop_mat in model.hop.values())
+    )
+
+
+def _symmetrize(model, symmetries):
+    """
+    Symmetrizes the model w.r.t. a symmetry group, a single symmetry
+    operation, or a (nested) list of these, in the same way as the TBmodels
+    'symmetrize' command.
+    """
+    if isinstance(symmetries, sr.SymmetryGroup):
+        return model.symmetrize(
+            symmetries=symmetries.symmetries, full_group=symmetries.full_group
+        )
+    if isinstance(symmetries, sr.SymmetryOperation):
+        return model.symmetrize(symmetries=[symmetries], full_group=False)
+    for sym in symmetries:
+        model = _symmetrize(model, sym)
+    return model
@@ -6,6 +6,12 @@
 This module contains workflows to evaluate energy windows and search for optimal window values.
 """
 
-from . import run_window, window_search
+from . import (
+    band_index, engines, grid_scan, run_window, stage_folder, surrogate,
+    window_cache, window_search
+)
 
-__all__ = ['run_window', 'window_search']
+__all__ = [
+    'band_index', 'engines', 'grid_scan', 'run_window', 'stage_folder',
+    'surrogate', 'window_cache', 'window_search'
+]
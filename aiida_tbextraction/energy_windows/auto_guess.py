@@ -34,6 +34,40 @@ def get_initial_window_inline(wannier_bands, slice_reference_bands):
     )
 
 
+@calcfunction
+def shift_window_inline(
+    window, previous_wannier_bands, wannier_bands, slice_reference_bands
+):
+    """
+    InlineCalculation which shifts a window that was optimized for a
+    different (e.g. differently strained) structure by the change in the
+    band edges between the two structures.
+
+    Arguments
+    ---------
+    window : aiida.orm.data.list.List
+        Window which was optimized for the previous structure.
+    previous_wannier_bands : aiida.orm.data.array.bands.BandsData
+        Bands calculated for the Wannier run of the previous structure.
+    wannier_bands : aiida.orm.data.array.bands.BandsData
+        Bands calculated for the Wannier run of the current structure.
+    slice_reference_bands : aiida.orm.data.list.List
+        Indices of the reference bands which should be considered.
+    """
+    shift = np.array(
+        guess_window(
+            wannier_bands=wannier_bands,
+            slice_reference_bands=slice_reference_bands
+        )
+    ) - np.array(
+        guess_window(
+            wannier_bands=previous_wannier_bands,
+            slice_reference_bands=slice_reference_bands
+        )
+    )
+    return orm.List(list=(np.array(window.get_list()) + shift).tolist())
+
+
 @calcfunction
 def add_initial_window_inline(
     wannier_parameters, wannier_bands, slice_reference_bands
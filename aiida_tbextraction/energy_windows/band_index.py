@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines a sorted per-k eigenvalue index, which is used to quickly count
+the number of bands inside a given energy interval, and to project energy
+windows onto the region of valid windows.
+"""
+
+import numpy as np
+
+from aiida import orm
+from aiida.engine import calcfunction
+
+__all__ = ('BandCountIndex', 'get_band_index_inline')
+
+
+@calcfunction
+def get_band_index_inline(wannier_bands):
+    """
+    Creates the band count index for the given Wannier bands.
+
+    Arguments
+    ---------
+    wannier_bands : aiida.orm.data.array.bands.BandsData
+        Bands calculated for the Wannier run.
+    """
+    return BandCountIndex.from_bands(wannier_bands).to_node()
+
+
+class BandCountIndex:
+    """
+    Index of the band energies, sorted at each k-point. The number of
+    bands at each k-point which lie in an interval ``[lower, upper]`` is
+    determined with a single :func:`numpy.searchsorted` call over all
+    k-points.
+
+    Arguments
+    ---------
+    sorted_bands : numpy.ndarray
+        Band energies of shape ``(num_kpoints, num_bands)``, sorted
+        along the last axis.
+    """
+
+    _ARRAY_NAME = 'sorted_bands'
+
+    def __init__(self, sorted_bands):
+        self.sorted_bands = np.array(sorted_bands, dtype=float, ndmin=2)
+        num_kpoints, self.num_bands = self.sorted_bands.shape
+        self._e_min = np.min(self.sorted_bands)
+        self._e_max = np.max(self.sorted_bands)
+        # Each k-point is shifted to a separate (non-overlapping) energy
+        # range, such that the flattened array is globally sorted.
+        self._stride = (self._e_max - self._e_min) + 4.
+        self._offsets = np.arange(num_kpoints) * self._stride
+        self._flat_bands = (
+            self.sorted_bands - self._e_min + self._offsets[:, np.newaxis]
+        ).ravel()
+        self._row_start = np.arange(num_kpoints) * self.num_bands
+        self._rows = np.arange(num_kpoints)
+
+    @classmethod
+    def from_bands(cls, bands):
+        """
+        Create the index from a ``BandsData`` node. Spin-polarized bands
+        are not supported.
+        """
+        bands_array = bands.get_bands()
+        if bands_array.ndim != 2:
+            raise ValueError(
+                'The band count index can only be created for bands of '
+                'shape (num_kpoints, num_bands), got shape {}.'.format(
+                    bands_array.shape
+                )
+            )
+        return cls(np.sort(bands_array, axis=-1))
+
+    @classmethod
+    def from_node(cls, node):
+        """
+        Load the index from an ``ArrayData`` created by :meth:`to_node`.
+        """
+        return cls(node.get_array(cls._ARRAY_NAME))
+
+    def to_node(self):
+        """
+        Create an ``ArrayData`` node containing the index.
+        """
+        node = orm.ArrayData()
+        node.set_array(self._ARRAY_NAME, self.sorted_bands)
+        return node
+
+    @property
+    def num_kpoints(self):
+        return len(self._rows)
+
+    def count_bands(self, lower, upper):
+        """
+        Count the number of bands at each k-point with energy in
+        ``[lower, upper]``.
+        """
+        lower, upper = sorted([lower, upper])
+        return self._search(upper,
+                            side='right') - self._search(lower, side='left')
+
+    def _search_many(self, energies, side):
+        """
+        Returns the result of :meth:`_search` for each of the given
+        energies, as an array of shape ``(len(energies), num_kpoints)``.
+        """
+        return np.array([
+            self._search(energy, side=side) for energy in energies
+        ]).reshape(len(energies), self.num_kpoints)
+
+    def _search(self, energy, side):
+        """
+        Returns, for each k-point, the number of bands which are smaller
+        than (``side='left'``) or smaller or equal to (``side='right'``)
+        the given energy.
+        """
+        # Clipping the energy keeps the shifted value within the range
+        # reserved for each k-point, without changing the result.
+        energy_clipped = np.clip(energy, self._e_min - 1., self._e_max + 1.)
+        idx = np.searchsorted(
+            self._flat_bands,
+            energy_clipped - self._e_min + self._offsets,
+            side=side
+        ) - self._row_start
+        idx = np.clip(idx, 0, self.num_bands)
+
+        # Correct for rounding errors introduced by the shift, such that
+        # the result is exact also for energies very close to a band.
+        inside = np.less_equal if side == 'right' else np.less
+        for _ in range(self.num_bands + 1):
+            too_high = (idx > 0) & ~inside(
+                self.sorted_bands[self._rows,
+                                  np.maximum(idx - 1, 0)], energy
+            )
+            too_low = (idx < self.num_bands) & inside(
+                self.sorted_bands[self._rows,
+                                  np.minimum(idx, self.num_bands - 1)], energy
+            )
+            if not (np.any(too_high) or np.any(too_low)):
+                break
+            idx[too_high] -= 1
+            idx[too_low] += 1
+        return idx
+
+    def is_valid_window(self, window, num_wann):
+        """
+        Check if the given window ``[dis_win_min, dis_froz_min,
+        dis_froz_max, dis_win_max]`` is sorted, has at most ``num_wann``
+        bands in the inner window and at least ``num_wann`` bands in the
+        outer window at each k-point.
+        """
+        win_min, froz_min, froz_max, win_max = window
+        return (
+            sorted(window) == list(window)
+            and np.max(self.count_bands(froz_min, froz_max)) <= num_wann
+            and np.min(self.count_bands(win_min, win_max)) >= num_wann
+        )
+
+    def valid_window_mask(  # pylint: disable=too-many-arguments
+        self, win_min, froz_min, froz_max, win_max, num_wann
+    ):
+        """
+        Check the validity of all windows on a grid, given by the values
+        of ``dis_win_min``, ``dis_froz_min``, ``dis_froz_max`` and
+        ``dis_win_max`` along each axis. Returns a boolean array of shape
+        ``(len(win_min), len(froz_min), len(froz_max), len(win_max))``.
+        """
+        win_min, froz_min, froz_max, win_max = (
+            np.array(values, dtype=float, ndmin=1)
+            for values in [win_min, froz_min, froz_max, win_max]
+        )
+        # The band counts are computed only for each pair of inner and
+        # outer limits, and broadcast over the full grid.
+        inner_count = (
+            self._search_many(froz_max, side='right')[np.newaxis, :, :] -
+            self._search_many(froz_min, side='left')[:, np.newaxis, :]
+        )
+        outer_count = (
+            self._search_many(win_max, side='right')[np.newaxis, :, :] -
+            self._search_many(win_min, side='left')[:, np.newaxis, :]
+        )
+        inner_valid = np.max(inner_count, axis=-1) <= num_wann
+        outer_valid = np.min(outer_count, axis=-1) >= num_wann
+
+        win_min = win_min[:, None, None, None]
+        froz_min = froz_min[None, :, None, None]
+        froz_max = froz_max[None, None, :, None]
+        win_max = win_max[None, None, None, :]
+        is_sorted = (win_min <= froz_min) & (froz_min <=
+                                             froz_max) & (froz_max <= win_max)
+        return (
+            is_sorted & inner_valid[np.newaxis, :, :, np.newaxis]
+            & outer_valid[:, np.newaxis, np.newaxis, :]
+        )
+
+    def project_window(self, window, num_wann, margin=1e-4):
+        """
+        Get a valid window which is close to the given window. The window
+        values are first sorted. If the inner window contains too many
+        bands, it is shrunk from the side which needs the smaller change.
+        Similarly, if the outer window contains too few bands, it is
+        expanded. The window limits are placed at a distance ``margin``
+        from the band energies which determine them.
+
+        Returns ``None`` if no valid window can be found in this way.
+        """
+        win_min, froz_min, froz_max, win_max = sorted(map(float, window))
+
+        if np.max(self.count_bands(froz_min, froz_max)) > num_wann:
+            froz_min, froz_max = _closest_candidate(
+                (froz_min, froz_max),
+                [
+                    (
+                        froz_min,
+                        self._inner_upper_limit(froz_min, num_wann) - margin
+                    ),
+                    (
+                        self._inner_lower_limit(froz_max, num_wann) + margin,
+                        froz_max
+                    ),
+                ],
+            )
+            if froz_min is None:
+                return None
+
+        if np.min(self.count_bands(win_min, win_max)) < num_wann:
+            win_min, win_max = self._expand_outer_window(
+                win_min, win_max, num_wann=num_wann, margin=margin
+            )
+            if win_min is None:
+                return None
+
+        projected_window = [win_min, froz_min, froz_max, win_max]
+        if not self.is_valid_window(projected_window, num_wann):
+            return None
+        return projected_window
+
+    def create_simplex(self, window, num_wann, size, margin=1e-4):
+        """
+        Create an initial simplex around the given (valid) window. Each
+        vertex except the first displaces one of the window values. The
+        displacement is given by the typical spacing between bands at that
+        energy, limited to between ``size / 4`` and ``4 * size``. It is
+        oriented such that the vertex remains a valid window, if possible.
+        """
+        window = [float(x) for x in window]
+        simplex = [window]
+        for dim, value in enumerate(window):
+            lower, upper = self._valid_range(
+                window, dim, num_wann=num_wann, margin=margin
+            )
+            step = float(
+                np.clip(self._band_spacing(value), size / 4., 4. * size)
+            )
+            room_up, room_down = upper - value, value - lower
+            if room_up >= step:
+                displacement = step
+            elif room_down >= step:
+                displacement = -step
+            elif max(room_up, room_down) > 0:
+                displacement = room_up if room_up >= room_down else -room_down
+            else:
+                displacement = step
+            vertex = list(window)
+            vertex[dim] += displacement
+            simplex.append(vertex)
+        return simplex
+
+    def _valid_range(self, window, dim, num_wann, margin):
+        """
+        Returns the range of values for the window value with index ``dim``
+        for which the window is valid, keeping the other values fixed.
+        """
+        win_min, froz_min, froz_max, win_max = window
+        if dim == 0:
+            return -np.inf, min(
+                froz_min,
+                self._outer_lower_limit(win_max, num_wann=num_wann) - margin
+            )
+        if dim == 1:
+            return max(
+                win_min,
+                self._inner_lower_limit(froz_max, num_wann=num_wann) + margin
+            ), froz_max
+        if dim == 2:
+            return froz_min, min(
+                win_max,
+                self._inner_upper_limit(froz_min, num_wann=num_wann) - margin
+            )
+        return max(
+            froz_max,
+            self._outer_upper_limit(win_min, num_wann=num_wann) + margin
+        ), np.inf
+
+    def _band_spacing(self, energy):
+        """
+        Returns the median (over k-points) energy difference between the
+        bands directly below and above the given energy.
+        """
+        idx = self._search(energy, side='left')
+        in_range = (idx > 0) & (idx < self.num_bands)
+        if not np.any(in_range):
+            return np.inf
+        rows = self._rows[in_range]
+        return np.median(
+            self.sorted_bands[rows, idx[in_range]] -
+            self.sorted_bands[rows, idx[in_range] - 1]
+        )
+
+    def _inner_upper_limit(self, lower, num_wann):
+        """
+        Returns the energy below which the upper limit of the inner window
+        must be such that it contains at most ``num_wann`` bands.
+        """
+        idx = self._search(lower, side='left') + num_wann
+        in_range = idx < self.num_bands
+        if not np.any(in_range):
+            return np.inf
+        return np.min(self.sorted_bands[self._rows[in_range], idx[in_range]])
+
+    def _inner_lower_limit(self, upper, num_wann):
+        """
+        Returns the energy above which the lower limit of the inner window
+        must be such that it contains at most ``num_wann`` bands.
+        """
+        idx = self._search(upper, side='right') - num_wann - 1
+        in_range = idx >= 0
+        if not np.any(in_range):
+            return -np.inf
+        return np.max(self.sorted_bands[self._rows[in_range], idx[in_range]])
+
+    def _expand_outer_window(self, win_min, win_max, num_wann, margin):
+        """
+        Expand the outer window with the smallest total displacement such
+        that it contains at least ``num_wann`` bands. The lower limit is
+        lowered in steps of the band energies below it, and the upper limit
+        is raised as much as needed for each of these lower limits.
+        """
+        lower_candidates = np.unique(
+            self.sorted_bands[self.sorted_bands < win_min]
+        )[::-1] - margin
+        best_limits, best_displacement = (None, None), np.inf
+        for lower in np.concatenate([[win_min], lower_candidates]):
+            if win_min - lower >= best_displacement:
+                break
+            upper = max(
+                win_max,
+                self._outer_upper_limit(lower, num_wann=num_wann) + margin
+            )
+            displacement = (win_min - lower) + (upper - win_max)
+            if displacement < best_displacement:
+                best_limits, best_displacement = (lower, upper), displacement
+        return best_limits
+
+    def _outer_upper_limit(self, lower, num_wann):
+        """
+        Returns the smallest upper limit of the outer window such that it
+        contains at least ``num_wann`` bands.
+        """
+        idx = self._search(lower, side='left') + num_wann - 1
+        if np.any(idx >= self.num_bands):
+            return np.inf
+        return np.max(self.sorted_bands[self._rows, idx])
+
+    def _outer_lower_limit(self, upper, num_wann):
+        """
+        Returns the largest lower limit of the outer window such that it
+        contains at least ``num_wann`` bands.
+        """
+        idx = self._search(upper, side='right') - num_wann
+        if np.any(idx < 0):
+            return -np.inf
+        return np.min(self.sorted_bands[self._rows, idx])
+
+
+def _closest_candidate(limits, candidates):
+    """
+    Returns the candidate for the given pair of limits which is closest to
+    the original limits, ignoring candidates with infinite or unsorted
+    limits. If there is no valid candidate, ``(None, None)`` is returned.
+    """
+    valid_candidates = [(lower, upper) for lower, upper in candidates
+                        if np.isfinite([lower, upper]).all() and lower <= upper
+                        ]
+    if not valid_candidates:
+        return None, None
+    return min(
+        valid_candidates,
+        key=lambda candidate: np.sum(np.abs(np.array(candidate) - limits))
+    )
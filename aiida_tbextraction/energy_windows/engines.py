@@ -0,0 +1,745 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines optimization engines which project the proposed energy windows
+onto the region of valid windows, and engines which evaluate a batch of
+energy windows in parallel at each iteration.
+"""
+
+import numpy as np
+
+from aiida import orm
+from aiida_optimize.helpers import get_nested_result
+from aiida_optimize.engines.base import OptimizationEngineImpl, OptimizationEngineWrapper
+from aiida_optimize.engines._nelder_mead import _NelderMeadImpl
+
+from .band_index import BandCountIndex
+from .surrogate import GaussianProcessSurrogate
+
+__all__ = ('MultiDirectionalSearch', 'ProjectedNelderMead')
+
+EXPANSION = 2.
+CONTRACTION = 0.5
+
+#: Cost values above this threshold belong to invalid windows, and are not
+#: used to train the surrogate model.
+INVALID_COST_THRESHOLD = 1e10
+
+#: Inputs of the evaluation process which are used for successive halving.
+STRIDE_KEY = 'reference_kpoint_stride'
+TB_MODEL_KEY = 'tb_model'
+
+#: Output and input of the evaluation process which are used to restart
+#: Wannier90 from the gauge of a nearby window.
+CHECKPOINT_KEY = 'checkpoint_folder'
+RESTART_KEY = 'restart_checkpoint_folder'
+
+
+class _WindowProjectionMixin:
+    """
+    Mixin for engines which project the proposed windows onto the region
+    of valid windows, given by the ``window_constraints`` attribute. If
+    it is ``None``, the windows are not changed.
+    """
+    def _project(self, window):
+        """
+        Project the window onto the region of valid windows.
+        """
+        window = [float(x) for x in window]
+        if self.window_constraints is None:
+            return window
+        projected_window = self._band_index.project_window(
+            window, num_wann=self.window_constraints['num_wann']
+        )
+        if projected_window is None:
+            self._logger.report(
+                'Could not project window {} onto the valid region.'.
+                format(window)
+            )
+            return window
+        return projected_window
+
+    @property
+    def _band_index(self):
+        """
+        The band count index used to project windows, which is loaded only
+        once per engine instance.
+        """
+        try:
+            return self._band_index_instance
+        except AttributeError:
+            self._band_index_instance = BandCountIndex.from_node(  # pylint: disable=attribute-defined-outside-init
+                orm.load_node(self.window_constraints['band_index'])
+            )
+            return self._band_index_instance
+
+
+class _BatchEngineImpl(_WindowProjectionMixin, OptimizationEngineImpl):
+    """
+    Base class for engines that propose a batch of windows at each step,
+    which are all evaluated in parallel.
+
+    If ``window_constraints`` are given, the proposed windows are projected
+    onto the region of valid windows before they are evaluated, except for
+    the initial simplex. Windows which have already been evaluated are not
+    launched again.
+
+    If ``surrogate_screening`` is set, a Gaussian process is fitted to the
+    evaluated cost values. Proposed windows whose predicted cost is worse
+    than the reference value (by at least ``surrogate_kappa`` standard
+    deviations) are not evaluated, and the predicted cost is used instead.
+    At least one window is evaluated in each batch.
+
+    If ``halving_strides`` are given, each batch of windows is evaluated
+    in successive halving fashion: all windows are first evaluated with
+    only every ``halving_strides[0]``-th k-point of the reference bands,
+    and the best ``halving_fraction`` of them is promoted to the next
+    stride, re-using the tight-binding model. The windows which are not
+    promoted are assigned the maximum of their partial cost value and the
+    cost values of the fully evaluated windows of the batch, and are not
+    evaluated again.
+
+    If ``gauge_restart`` is set, the Wannier90 checkpoint of the nearest
+    evaluated window is passed to each new evaluation, such that Wannier90
+    can start from its converged gauge.
+    """
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        input_key,
+        result_key,
+        logger,
+        num_iter=0,
+        max_iter=1000,
+        finished=False,
+        window_constraints=None,
+        surrogate_screening=False,
+        surrogate_kappa=2.,
+        surrogate_min_points=None,
+        halving_strides=None,
+        halving_fraction=0.5,
+        gauge_restart=False,
+        pending_windows=None,
+        evaluated=None,
+        predicted=None,
+        halving_rung=None,
+        halving_windows=None,
+        halving_dropped=None,
+        checkpoints=None,
+        result_state=None,
+    ):
+        super().__init__(logger=logger, result_state=result_state)
+        self.input_key = input_key
+        self.result_key = result_key
+        self.num_iter = num_iter
+        self.max_iter = max_iter
+        self.finished = finished
+        self.window_constraints = window_constraints
+        self.surrogate_screening = surrogate_screening
+        self.surrogate_kappa = surrogate_kappa
+        self.surrogate_min_points = surrogate_min_points
+        self.pending_windows = pending_windows
+        self.evaluated = [] if evaluated is None else evaluated
+        self.predicted = [] if predicted is None else predicted
+        if halving_strides is not None and halving_strides[-1] != 1:
+            halving_strides = list(halving_strides) + [1]
+        self.halving_strides = halving_strides
+        self.halving_fraction = halving_fraction
+        self.halving_rung = halving_rung
+        self.halving_windows = halving_windows
+        self.halving_dropped = [] if halving_dropped is None else halving_dropped
+        self.gauge_restart = gauge_restart
+        self.checkpoints = [] if checkpoints is None else checkpoints
+
+    @property
+    def _state(self):
+        return {
+            k: v
+            for k, v in self.__dict__.items() if not k.startswith('_')
+        }
+
+    @property
+    def is_finished(self):
+        return self.finished
+
+    def _create_inputs(self):
+        if self.halving_rung is not None:
+            return self._create_halving_inputs()
+        self.pending_windows = [[float(x) for x in window]
+                                for window in self._propose()]
+        if self._should_project():
+            self.pending_windows = [
+                self._project(window) for window in self.pending_windows
+            ]
+        new_windows = []
+        for window in self.pending_windows:
+            if self._get_evaluated(window) is None and all(
+                not _is_same_window(window, new_window)
+                for new_window in new_windows
+            ):
+                new_windows.append(window)
+        num_reused = len(self.pending_windows) - len(new_windows)
+        if num_reused:
+            self._logger.report(
+                'Re-using {} previously evaluated windows.'.format(num_reused)
+            )
+        self.predicted = []
+        if self.surrogate_screening:
+            new_windows = self._screen(new_windows)
+        if self.halving_strides and len(new_windows) > 1:
+            self.halving_rung = 0
+            self.halving_windows = [[window, None] for window in new_windows]
+            return self._create_halving_inputs()
+        return [self._to_input_dict(window) for window in new_windows]
+
+    def _create_halving_inputs(self):
+        """
+        Create the inputs for the windows at the current successive
+        halving rung.
+        """
+        stride = self.halving_strides[self.halving_rung]
+        self._logger.report(
+            'Evaluating {} windows with k-point stride {}.'.format(
+                len(self.halving_windows), stride
+            )
+        )
+        inputs = []
+        for window, tb_model_uuid in self.halving_windows:
+            if tb_model_uuid is not None:
+                input_dict = {
+                    self.input_key: orm.List(list=window),
+                    TB_MODEL_KEY: orm.load_node(tb_model_uuid)
+                }
+            else:
+                input_dict = self._to_input_dict(window)
+            if stride > 1:
+                input_dict[STRIDE_KEY] = orm.Int(stride)
+            inputs.append(input_dict)
+        return inputs
+
+    def _update_halving(self, results):
+        """
+        Update the successive halving with the results of the current rung.
+        Returns True if the batch of windows is fully evaluated.
+        """
+        values = [value for _, value, _ in results]
+        if self.halving_rung == len(self.halving_strides) - 1:
+            # The dropped windows are recorded as evaluated, such that
+            # they are not launched again if the engine proposes them in a
+            # later step.
+            max_value = max(values)
+            self.evaluated.extend([window, max(value, max_value)]
+                                  for window, value in self.halving_dropped)
+            self.halving_rung = None
+            self.halving_windows = None
+            self.halving_dropped = []
+            return True
+
+        num_promoted = max(
+            1, int(np.ceil(self.halving_fraction * len(results)))
+        )
+        order = np.argsort(values, kind='stable')
+        self.halving_windows = [[
+            results[i][0],
+            None if results[i][2] is None else results[i][2].uuid
+        ] for i in order[:num_promoted]]
+        self.halving_dropped.extend([results[i][0], results[i][1]]
+                                    for i in order[num_promoted:])
+        self._logger.report(
+            'Promoting {} of {} windows.'.format(num_promoted, len(results))
+        )
+        self.halving_rung += 1
+        return False
+
+    def _screen(self, windows):
+        """
+        Returns the windows which should be evaluated, and stores the
+        predicted cost of the rejected windows in ``predicted``.
+        """
+        training_data = [[window, value] for window, value in self.evaluated
+                         if value < INVALID_COST_THRESHOLD]
+        min_points = self.surrogate_min_points
+        if min_points is None:
+            min_points = 2 * (len(self.pending_windows[0]) + 1)
+        if len(windows) < 2 or len(training_data) < min_points:
+            return windows
+
+        surrogate = GaussianProcessSurrogate(*zip(*training_data))
+        mean, std = surrogate.predict(windows)
+        lower_bound = mean - self.surrogate_kappa * std
+        reference = self._screening_reference()
+        rejected = lower_bound > reference
+        if np.all(rejected):
+            rejected[np.argmin(lower_bound)] = False
+        self.predicted = [[
+            window, float(value)
+        ] for window, value, is_rejected in zip(windows, mean, rejected)
+                          if is_rejected]
+        if self.predicted:
+            self._logger.report(
+                'Skipping {} of {} windows based on the surrogate model.'.
+                format(len(self.predicted), len(windows))
+            )
+        return [
+            window for window, is_rejected in zip(windows, rejected)
+            if not is_rejected
+        ]
+
+    def _screening_reference(self):
+        """
+        Returns the cost value which windows must be expected to improve
+        upon to be evaluated. Windows with a predicted cost above this
+        value must not become the optimal window of the engine.
+        """
+        return min(value for _, value in self.evaluated)
+
+    def _update(self, outputs):
+        results = [(
+            self._result_mapping[idx].input[self.input_key].get_list(),
+            get_nested_result(res, self.result_key).value,
+            res.get(TB_MODEL_KEY, None)
+        ) for idx, res in sorted(outputs.items())]
+        self.checkpoints.extend([
+            self._result_mapping[idx].input[self.input_key].get_list(),
+            res[CHECKPOINT_KEY].uuid
+        ] for idx, res in sorted(outputs.items()) if CHECKPOINT_KEY in res)
+        if self.halving_rung is None or self.halving_rung == len(
+            self.halving_strides
+        ) - 1:
+            self.evaluated.extend([window, value]
+                                  for window, value, _ in results)
+        if self.halving_rung is not None and not self._update_halving(results):
+            return
+        self._accept([
+            self._get_evaluated(window, include_predicted=True)
+            for window in self.pending_windows
+        ])
+        self.predicted = []
+
+    def _get_evaluated(self, window, include_predicted=False):
+        """
+        Returns the cost value of a window which was already evaluated, or
+        ``None`` if the window was not evaluated. If ``include_predicted``
+        is set, the predicted cost values of the current batch are also
+        considered.
+        """
+        candidates = self.evaluated
+        if include_predicted:
+            candidates = candidates + self.predicted
+        for evaluated_window, value in candidates:
+            if _is_same_window(window, evaluated_window):
+                return value
+        return None
+
+    def _propose(self):
+        """
+        Returns the list of windows which should be evaluated next.
+        """
+        raise NotImplementedError
+
+    def _should_project(self):  # pylint: disable=no-self-use
+        """
+        Returns whether the proposed windows are projected onto the region
+        of valid windows. The initial simplex is evaluated as given, since
+        projecting its vertices can make it degenerate.
+        """
+        return True
+
+    def _accept(self, values):
+        """
+        Update the engine with the cost values of the last batch of windows,
+        which are given in the order in which they were proposed. The
+        (projected) windows are stored in ``pending_windows``.
+        """
+        raise NotImplementedError
+
+    def _to_input_dict(self, window):
+        input_dict = {self.input_key: orm.List(list=window)}
+        if self.gauge_restart and self.checkpoints:
+            distances = [
+                np.linalg.norm(np.array(window) - checkpoint_window)
+                for checkpoint_window, _ in self.checkpoints
+            ]
+            input_dict[RESTART_KEY] = orm.load_node(
+                self.checkpoints[int(np.argmin(distances))][1]
+            )
+        return input_dict
+
+    def _get_optimal_result(self):
+        """
+        Return the index, input and output value of the best evaluation.
+        """
+        # Evaluations on a subset of the k-points are not considered.
+        cost_values = {
+            k: get_nested_result(v.output, self.result_key)
+            for k, v in self._result_mapping.items()
+            if v.output is not None and STRIDE_KEY not in v.input
+        }
+        opt_index, opt_output = min(
+            cost_values.items(), key=lambda item: item[1].value
+        )
+        opt_input = self._result_mapping[opt_index].input[self.input_key]
+        return (opt_index, opt_input, opt_output)
+
+
+def _is_same_window(window1, window2):
+    return np.allclose(window1, window2, rtol=0, atol=1e-10)
+
+
+class _MultiDirectionalSearchImpl(_BatchEngineImpl):
+    """
+    Implementation class for the multi-directional search engine.
+    """
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        simplex,
+        fun_simplex,
+        xtol,
+        ftol,
+        speculative,
+        next_step='initialize',
+        trial_windows=None,
+        trial_values=None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.simplex = [list(map(float, x)) for x in simplex]
+        assert len(self.simplex) == len(self.simplex[0]) + 1
+        self.fun_simplex = None if fun_simplex is None else list(fun_simplex)
+        self.xtol = xtol
+        self.ftol = ftol
+        self.speculative = speculative
+        self.next_step = next_step
+        self.trial_windows = trial_windows
+        self.trial_values = trial_values
+
+    @property
+    def _best(self):
+        return np.array(self.simplex[0])
+
+    @property
+    def _edges(self):
+        return np.array(self.simplex[1:]) - self._best
+
+    def _trial_points(self, kind):
+        factor = {
+            'reflection': -1.,
+            'expansion': -EXPANSION,
+            'contraction': CONTRACTION
+        }[kind]
+        return (self._best + factor * self._edges).tolist()
+
+    def _propose(self):
+        if self.next_step == 'initialize':
+            self._logger.report('Submitting initialization step.')
+            return self.simplex
+        if self.next_step == 'speculative':
+            self._logger.report(
+                'Submitting reflection, expansion and contraction steps.'
+            )
+            return (
+                self._trial_points('reflection') +
+                self._trial_points('expansion') +
+                self._trial_points('contraction')
+            )
+        self._logger.report('Submitting {} step.'.format(self.next_step))
+        return self._trial_points(self.next_step)
+
+    def _should_project(self):
+        return self.next_step != 'initialize'
+
+    def _screening_reference(self):
+        # Only windows which improve upon the optimal vertex can be
+        # accepted as the new optimal vertex.
+        if self.fun_simplex is None:
+            return super()._screening_reference()
+        return self.fun_simplex[0]
+
+    def _accept(self, values):
+        num_edges = len(self.simplex) - 1
+        windows = self.pending_windows
+        if self.next_step == 'initialize':
+            self.simplex = windows
+            self.fun_simplex = list(values)
+        elif self.next_step == 'reflection':
+            if min(values) < self.fun_simplex[0]:
+                self.trial_windows = windows
+                self.trial_values = list(values)
+                self.next_step = 'expansion'
+            else:
+                self.next_step = 'contraction'
+            return
+        else:
+            if self.next_step == 'speculative':
+                self._select_step(
+                    reflection=(windows[:num_edges], values[:num_edges]),
+                    expansion=(
+                        windows[num_edges:2 * num_edges],
+                        values[num_edges:2 * num_edges]
+                    ),
+                    contraction=(
+                        windows[2 * num_edges:], values[2 * num_edges:]
+                    )
+                )
+            elif self.next_step == 'expansion':
+                self._select_step(
+                    reflection=(self.trial_windows, self.trial_values),
+                    expansion=(windows, values)
+                )
+            else:
+                self._select_step(contraction=(windows, values))
+            self.num_iter += 1
+        self.trial_windows = None
+        self.trial_values = None
+        self.next_step = 'speculative' if self.speculative else 'reflection'
+        self._sort()
+        self._check_finished()
+
+    def _select_step(self, reflection=None, expansion=None, contraction=None):
+        """
+        Replace the non-optimal vertices of the simplex with the
+        accepted trial windows. Each step is given as a tuple of the
+        trial windows and their cost values.
+        """
+        if reflection is not None and min(reflection[1]) < self.fun_simplex[0]:
+            if expansion is not None and min(expansion[1]
+                                             ) < min(reflection[1]):
+                self._replace_edges('expansion', *expansion)
+            else:
+                self._replace_edges('reflection', *reflection)
+        else:
+            self._replace_edges('contraction', *contraction)
+
+    def _replace_edges(self, kind, windows, values):
+        self._logger.report('Accepting {} step.'.format(kind))
+        self.simplex = [self.simplex[0]] + list(windows)
+        self.fun_simplex = [self.fun_simplex[0]] + list(values)
+
+    def _sort(self):
+        idx = np.argsort(self.fun_simplex, kind='stable')
+        self.simplex = [self.simplex[i] for i in idx]
+        self.fun_simplex = [float(self.fun_simplex[i]) for i in idx]
+
+    def _check_finished(self):
+        """
+        Updates the 'finished' attribute.
+        """
+        x_dist_max = np.max(np.linalg.norm(self._edges, axis=-1))
+        self._logger.report(
+            'Maximum distance value for the simplex: {}'.format(x_dist_max)
+        )
+        f_diff_max = np.max(
+            np.abs(np.array(self.fun_simplex[1:]) - self.fun_simplex[0])
+        )
+        self._logger.report(
+            'Maximum function difference: {}'.format(f_diff_max)
+        )
+        converged = (self.xtol is None or x_dist_max < self.xtol
+                     ) and (self.ftol is None or f_diff_max < self.ftol)
+        if self.num_iter >= self.max_iter:
+            self._logger.report('Maximum number of iterations reached.')
+        self.finished = converged or self.num_iter >= self.max_iter
+
+
+class _ProjectedNelderMeadImpl(_WindowProjectionMixin, _NelderMeadImpl):
+    """
+    Implementation class for the Nelder-Mead engine which projects the
+    proposed windows onto the region of valid windows.
+    """
+    def __init__(self, window_constraints=None, **kwargs):
+        super().__init__(**kwargs)
+        self.window_constraints = window_constraints
+
+    @property
+    def _state(self):
+        state = super()._state
+        state.pop('_band_index_instance', None)
+        return state
+
+    def _to_input_list(self, x):
+        # The initial simplex is evaluated as given, since projecting its
+        # vertices can make it degenerate.
+        if self.next_update == 'update_initialize':
+            return super()._to_input_list([float(value) for value in x])
+        return super()._to_input_list(self._project(x))
+
+    def _create_inputs(self):
+        inputs = super()._create_inputs()
+        # The vertices of the shrunk simplex are replaced by the projected
+        # windows, such that they match the cost values. The other steps
+        # read the (projected) windows back from the evaluation inputs.
+        if self.next_update == 'update_shrink':
+            windows = [
+                input_dict[self.input_key].get_list() for input_dict in inputs
+            ]
+            self.simplex[len(self.simplex) - len(windows):] = windows
+        return inputs
+
+
+class _ProjectingEngineWrapper(OptimizationEngineWrapper):
+    """
+    Base class for the wrappers of engines which support the
+    ``window_constraints`` keyword argument.
+    """
+
+
+class _BatchEngineWrapper(_ProjectingEngineWrapper):
+    """
+    Base class for the wrappers of engines which evaluate a batch of
+    windows at each step, and support the ``surrogate_screening``,
+    ``halving_strides`` and ``gauge_restart`` keyword arguments.
+    """
+
+
+class MultiDirectionalSearch(_BatchEngineWrapper):
+    """
+    Engine to perform a multi-directional (parallel simplex) search. At
+    each iteration, all non-optimal vertices of the simplex are reflected
+    through the optimal vertex, and the resulting trial points are
+    evaluated at the same time. Depending on the outcome, the step is
+    expanded or contracted.
+
+    :param simplex: The initial simplex. Must be of shape (N + 1, N), where N is the dimension of the problem.
+    :type simplex: array
+
+    :param fun_simplex: Function values at the simplex positions.
+    :type fun_simplex: array
+
+    :param xtol: Tolerance for the input x.
+    :type xtol: float
+
+    :param ftol: Tolerance for the function value.
+    :type ftol: float
+
+    :param max_iter: Maximum number of iteration steps.
+    :type max_iter: int
+
+    :param speculative: If True, the reflection, expansion and contraction points are all evaluated in the same step. This triples the number of parallel evaluations, but halves the number of sequential steps.
+    :type speculative: bool
+
+    :param input_key: Name of the input argument in the evaluation process.
+    :type input_key: str
+
+    :param result_key: Name of the output argument in the evaluation process.
+    :type result_key: str
+
+    :param window_constraints: Dictionary containing the UUID of the band count index (key ``band_index``) and the number of Wannier functions (key ``num_wann``). If given, the windows are projected onto the region of valid windows before they are evaluated.
+    :type window_constraints: dict
+
+    :param surrogate_screening: If True, windows whose cost value is predicted to be worse than the optimal vertex by a Gaussian process surrogate model are not evaluated.
+    :type surrogate_screening: bool
+
+    :param surrogate_kappa: Number of standard deviations of the surrogate prediction by which a window must be worse than the optimal vertex to be skipped.
+    :type surrogate_kappa: float
+
+    :param surrogate_min_points: Minimum number of evaluated windows before the surrogate model is used. Defaults to twice the number of simplex vertices.
+    :type surrogate_min_points: int
+
+    :param halving_strides: If given, each batch of windows is evaluated in successive halving fashion, with the given strides in the k-points of the reference bands.
+    :type halving_strides: list(int)
+
+    :param halving_fraction: Fraction of windows which are promoted to the next stride in successive halving.
+    :type halving_fraction: float
+
+    :param gauge_restart: If True, the Wannier90 checkpoint of the nearest evaluated window is passed to each new evaluation. The evaluation process must return its checkpoint as ``checkpoint_folder`` output.
+    :type gauge_restart: bool
+    """
+    _IMPL_CLASS = _MultiDirectionalSearchImpl
+
+    def __new__(  # pylint: disable=arguments-differ,too-many-arguments
+        cls,
+        simplex,
+        fun_simplex=None,
+        xtol=1e-4,
+        ftol=1e-4,
+        max_iter=1000,
+        speculative=True,
+        input_key='x',
+        result_key='result',
+        window_constraints=None,
+        surrogate_screening=False,
+        surrogate_kappa=2.,
+        surrogate_min_points=None,
+        halving_strides=None,
+        halving_fraction=0.5,
+        gauge_restart=False,
+        logger=None
+    ):
+        return cls._IMPL_CLASS(  # pylint: disable=no-member
+            simplex=simplex,
+            fun_simplex=fun_simplex,
+            xtol=xtol,
+            ftol=ftol,
+            max_iter=max_iter,
+            speculative=speculative,
+            input_key=input_key,
+            result_key=result_key,
+            window_constraints=window_constraints,
+            surrogate_screening=surrogate_screening,
+            surrogate_kappa=surrogate_kappa,
+            surrogate_min_points=surrogate_min_points,
+            halving_strides=halving_strides,
+            halving_fraction=halving_fraction,
+            gauge_restart=gauge_restart,
+            logger=logger
+        )
+
+
+class ProjectedNelderMead(_ProjectingEngineWrapper):
+    """
+    Engine to perform the Nelder-Mead (downhill simplex) method, where the
+    proposed windows are projected onto the region of valid windows
+    before they are evaluated. The initial simplex is evaluated as given.
+    Without ``window_constraints``, it is equivalent to the ``NelderMead``
+    engine of ``aiida_optimize``.
+
+    :param simplex: The current / initial simplex. Must be of shape (N + 1, N), where N is the dimension of the problem.
+    :type simplex: array
+
+    :param fun_simplex: Function values at the simplex positions.
+    :type fun_simplex: array
+
+    :param xtol: Tolerance for the input x.
+    :type xtol: float
+
+    :param ftol: Tolerance for the function value.
+    :type ftol: float
+
+    :param max_iter: Maximum number of iteration steps.
+    :type max_iter: int
+
+    :param input_key: Name of the input argument in the evaluation process.
+    :type input_key: str
+
+    :param result_key: Name of the output argument in the evaluation process.
+    :type result_key: str
+
+    :param window_constraints: Dictionary containing the UUID of the band count index (key ``band_index``) and the number of Wannier functions (key ``num_wann``). If given, the windows are projected onto the region of valid windows before they are evaluated.
+    :type window_constraints: dict
+    """
+    _IMPL_CLASS = _ProjectedNelderMeadImpl
+
+    def __new__(  # pylint: disable=arguments-differ,too-many-arguments
+        cls,
+        simplex,
+        fun_simplex=None,
+        xtol=1e-4,
+        ftol=1e-4,
+        max_iter=1000,
+        input_key='x',
+        result_key='result',
+        window_constraints=None,
+        logger=None
+    ):
+        return cls._IMPL_CLASS(  # pylint: disable=no-member
+            simplex=simplex,
+            fun_simplex=fun_simplex,
+            xtol=xtol,
+            ftol=ftol,
+            max_iter=max_iter,
+            input_key=input_key,
+            result_key=result_key,
+            window_constraints=window_constraints,
+            logger=logger
+        )
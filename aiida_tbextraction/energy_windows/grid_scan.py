@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines a workflow which evaluates the energy windows on a regular grid.
+"""
+
+import numbers
+
+import numpy as np
+
+from aiida import orm
+from aiida.engine import WorkChain, ToContext, while_
+
+from aiida_tools import check_workchain_step
+
+from .run_window import (
+    RunWindow, TELEMETRY_KEY, get_evaluation_outputs, get_telemetry
+)
+from .band_index import BandCountIndex, get_band_index_inline
+
+__all__ = ('WindowGridScan', )
+
+
+class WindowGridScan(WorkChain):
+    """
+    This workchain evaluates all valid energy windows on a regular grid, and selects the best-matching tight-binding model.
+    """
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+
+        spec.expose_inputs(
+            RunWindow,
+            exclude=[
+                'window', 'wannier.kpoints', 'tb_model',
+                'reference_kpoint_stride', 'restart_checkpoint_folder'
+            ]
+        )
+        # Workaround for plumpy issue #135 (https://github.com/aiidateam/plumpy/issues/135)
+        spec.inputs['model_evaluation'].dynamic = True
+        spec.input(
+            'window_grid',
+            valid_type=orm.List,
+            help='Grid of disentanglement energy windows, given as a list '
+            '``[dis_win_min, dis_froz_min, dis_froz_max, dis_win_max]``, '
+            'where each entry is a list ``[start, stop, step]``. The stop '
+            'value is included if it lies on the grid. The step must be '
+            'positive, and the stop value must not be smaller than the '
+            'start value.',
+            validator=cls._validate_window_grid
+        )
+        spec.input(
+            'max_concurrent',
+            valid_type=orm.Int,
+            default=lambda: orm.Int(10),
+            help='Maximum number of window evaluations which run at the '
+            'same time. The windows are evaluated in batches of this size, '
+            'and the next batch is submitted once all evaluations of the '
+            'current batch are finished.'
+        )
+
+        spec.output(
+            'cost_grid',
+            valid_type=orm.ArrayData,
+            help="Cost values on the window grid, in the array 'cost_value'. "
+            "Invalid windows have cost value NaN. The grid values are given "
+            "in the arrays 'dis_win_min', 'dis_froz_min', 'dis_froz_max' "
+            "and 'dis_win_max'."
+        )
+        spec.output('window', valid_type=orm.List)
+        spec.output(
+            TELEMETRY_KEY,
+            valid_type=orm.List,
+            help='Telemetry records of all evaluated windows, in the order '
+            'in which the evaluations were launched. Each record is the '
+            "'telemetry' output of the corresponding ``RunWindow`` process. "
+            'While the grid scan is running, the records are appended to the '
+            "'telemetry' extra of the workchain node after each batch of "
+            'evaluations. This output is also added if all evaluations fail.'
+        )
+        spec.outputs.dynamic = True
+        spec.outline(
+            cls.create_grid,
+            while_(cls.has_pending)(cls.submit_batch, cls.collect_batch),
+            cls.finalize
+        )
+
+        spec.exit_code(
+            300,
+            'ERROR_NO_VALID_WINDOW',
+            message='None of the windows on the grid is valid.'
+        )
+        spec.exit_code(
+            301,
+            'ERROR_ALL_WINDOWS_FAILED',
+            message='The evaluation of all windows failed.'
+        )
+
+    @staticmethod
+    def _validate_window_grid(window_grid, ctx=None):  # pylint: disable=unused-argument,inconsistent-return-statements
+        """
+        Checks that the window grid consists of four valid
+        ``[start, stop, step]`` entries.
+        """
+        grid = window_grid.get_list()
+        if len(grid) != 4:
+            return "The 'window_grid' must have four entries."
+        for entry in grid:
+            if len(entry) != 3 or not all(
+                isinstance(val, numbers.Real) for val in entry
+            ):
+                return "Each 'window_grid' entry must be a list [start, stop, step] of numbers."
+            start, stop, step = entry
+            if step <= 0:
+                return "The step of each 'window_grid' entry must be positive."
+            if stop < start:
+                return "The stop value of each 'window_grid' entry must not be smaller than the start value."
+
+    @check_workchain_step
+    def create_grid(self):
+        """
+        Create the window grid, and determine which windows are valid.
+        """
+        # The band index is created only once, and shared between all
+        # RunWindow evaluations.
+        if 'band_index' in self.inputs:
+            self.ctx.band_index = self.inputs.band_index
+        else:
+            self.ctx.band_index = get_band_index_inline(
+                wannier_bands=self.inputs.wannier_bands
+            )
+        band_index = BandCountIndex.from_node(self.ctx.band_index)
+
+        axes = [
+            np.arange(start, stop + step / 2., step)
+            for start, stop, step in self.inputs.window_grid.get_list()
+        ]
+        self.ctx.grid_axes = [ax.tolist() for ax in axes]
+        mask = band_index.valid_window_mask(
+            *axes,
+            num_wann=int(
+                self.inputs.wannier.parameters.get_attribute('num_wann')
+            )
+        )
+        self.ctx.pending_indices = np.flatnonzero(mask).tolist()
+        self.report(
+            'Evaluating {} valid windows out of {} grid points.'.format(
+                len(self.ctx.pending_indices), mask.size
+            )
+        )
+        self.ctx.finished_calcs = {}
+        if not self.ctx.pending_indices:
+            return self.exit_codes.ERROR_NO_VALID_WINDOW
+
+    def has_pending(self):
+        return bool(self.ctx.pending_indices)
+
+    @check_workchain_step
+    def submit_batch(self):
+        """
+        Submit the evaluations of the next batch of windows, up to the
+        maximum number of concurrent evaluations.
+        """
+        batch_size = self.inputs.max_concurrent.value
+        self.ctx.submitted_indices = self.ctx.pending_indices[:batch_size]
+        self.ctx.pending_indices = self.ctx.pending_indices[batch_size:]
+        self.report(
+            'Submitting {} window evaluations, {} remaining.'.format(
+                len(self.ctx.submitted_indices), len(self.ctx.pending_indices)
+            )
+        )
+        runwindow_inputs = self.exposed_inputs(RunWindow)
+        runwindow_inputs['wannier']['kpoints'] = self.inputs.wannier_bands
+        runwindow_inputs['band_index'] = self.ctx.band_index
+        calcs = {}
+        for flat_index in self.ctx.submitted_indices:
+            calcs[self._calc_key(flat_index)] = self.submit(
+                RunWindow,
+                window=orm.List(list=self._get_window(flat_index)),
+                **runwindow_inputs
+            )
+        return ToContext(**calcs)
+
+    @check_workchain_step
+    def collect_batch(self):
+        """
+        Collect the results of the current batch of window evaluations,
+        and append their telemetry to the extras of the workchain node.
+        """
+        calcs = [
+            self.ctx[self._calc_key(flat_index)]
+            for flat_index in self.ctx.submitted_indices
+        ]
+        self.node.set_extra(
+            TELEMETRY_KEY,
+            self.node.get_extra(TELEMETRY_KEY, []) + get_telemetry(calcs)
+        )
+        for flat_index, calc in zip(self.ctx.submitted_indices, calcs):
+            if calc.is_finished_ok:
+                self.ctx.finished_calcs[str(flat_index)] = calc.uuid
+            else:
+                self.report(
+                    'Evaluation of window {} failed.'.format(
+                        self._get_window(flat_index)
+                    )
+                )
+
+    @check_workchain_step
+    def finalize(self):
+        """
+        Add the cost grid and the outputs of the optimal window to the outputs.
+        """
+        self.report('Adding telemetry to outputs.')
+        self.out(
+            TELEMETRY_KEY,
+            orm.List(list=self.node.get_extra(TELEMETRY_KEY, [])).store()
+        )
+        if not self.ctx.finished_calcs:
+            return self.exit_codes.ERROR_ALL_WINDOWS_FAILED
+        grid_shape = [len(ax) for ax in self.ctx.grid_axes]
+        cost_values = np.full(grid_shape, np.nan)
+        for flat_index, uuid in self.ctx.finished_calcs.items():
+            calc = orm.load_node(uuid)
+            cost_values.flat[int(flat_index)] = calc.outputs.cost_value.value
+
+        self.report('Adding cost grid to outputs.')
+        cost_grid = orm.ArrayData()
+        cost_grid.set_array('cost_value', cost_values)
+        for name, axis in zip([
+            'dis_win_min', 'dis_froz_min', 'dis_froz_max', 'dis_win_max'
+        ], self.ctx.grid_axes):
+            cost_grid.set_array(name, np.array(axis))
+        self.out('cost_grid', cost_grid.store())
+
+        optimal_calc = orm.load_node(
+            self.ctx.finished_calcs[str(np.nanargmin(cost_values))]
+        )
+        self.report('Adding optimal window to outputs.')
+        self.out('window', optimal_calc.inputs.window)
+        self.report("Adding outputs of the optimal calculation.")
+        self.out_many(get_evaluation_outputs(optimal_calc))
+        self.report('Finished!')
+
+    def _get_window(self, flat_index):
+        multi_index = np.unravel_index(
+            flat_index, [len(ax) for ax in self.ctx.grid_axes]
+        )
+        return [
+            float(ax[idx]) for ax, idx in zip(self.ctx.grid_axes, multi_index)
+        ]
+
+    @staticmethod
+    def _calc_key(flat_index):
+        return 'window_{}'.format(flat_index)
@@ -11,6 +11,7 @@ from collections import ChainMap
 import numpy as np
 
 from aiida import orm
+from aiida.common import timezone
 from aiida.engine import WorkChain, ToContext, if_, calcfunction
 
 from aiida_tools import check_workchain_step, get_outputs_dict
@@ -18,8 +19,35 @@ from aiida_tools.process_inputs import PROCESS_INPUT_KWARGS, load_object
 
 from ..model_evaluation import ModelEvaluationBase
 from ..calculate_tb import TightBindingCalculation
+from .._calcfunctions import subsample_bands_inline
+from .band_index import BandCountIndex
+from .stage_folder import get_staged_folder
+from .window_cache import (
+    STATUS_EXTRA, get_tb_cache_key, get_evaluation_cache_key,
+    lookup_window_cache, register_window_cache
+)
 
-__all__ = ('RunWindow', )
+__all__ = ('RunWindow', 'get_called_telemetry')
+
+TELEMETRY_KEY = 'telemetry'
+CHECKPOINT_KEY = 'checkpoint_folder'
+
+# Inputs of the tight-binding calculation which do not change the resulting
+# model, and are not used in the window cache key.
+_TB_CACHE_EXCLUDED_INPUTS = (
+    'retrieve_checkpoint', 'restart_checkpoint_folder'
+)
+
+# Labels of the tight-binding calculation sub-processes, and the name of the
+# corresponding stage in the telemetry.
+_TB_STAGES = {
+    'Wannier90Calculation': 'wannier90',
+    'ParseWorkChain': 'parse',
+    'SliceCalculation': 'slice',
+    'SymmetrizeCalculation': 'symmetrize',
+    'fused_tbmodels_inline': 'tbmodels',
+    'truncate_model_inline': 'truncate',
+}
 
 
 class RunWindow(WorkChain):
@@ -31,6 +59,10 @@ class RunWindow(WorkChain):
         super().define(spec)
         spec.expose_inputs(TightBindingCalculation)
         spec.expose_inputs(ModelEvaluationBase, exclude=['tb_model'])
+        # The validator of the exposed namespace is overwritten with each
+        # call to 'expose_inputs', and is restored here such that the
+        # tight-binding inputs are checked before any window is evaluated.
+        spec.inputs.validator = TightBindingCalculation.spec().inputs.validator
         spec.input_namespace(
             'model_evaluation',
             dynamic=True,
@@ -53,30 +85,92 @@ class RunWindow(WorkChain):
             "assumed to be consistent with the ``*.eig`` file given in "
             "'wannier.{local,remote}_input_folder'."
         )
+        spec.input(
+            'band_index',
+            valid_type=orm.ArrayData,
+            required=False,
+            help="Band count index created from the ``wannier_bands`` by "
+            "``get_band_index_inline``. If given, it is used instead of the "
+            "``wannier_bands`` to determine if the energy window is valid."
+        )
         spec.input(
             'model_evaluation_workflow',
             help=
             'AiiDA workflow that will be used to evaluate the tight-binding model.',
             **PROCESS_INPUT_KWARGS
         )
+        spec.input(
+            'use_window_cache',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help="Determines whether results of previous calculations with "
+            "the same inputs are re-used. The tight-binding calculation is "
+            "skipped if a tight-binding model for the same inputs exists, "
+            "and the model evaluation is skipped if the evaluation inputs "
+            "are also the same."
+        )
+        spec.input(
+            'window_cache_tolerance',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(1e-3),
+            help="Tolerance to which the window values are rounded when "
+            "looking up cached results."
+        )
+        spec.input(
+            'window_cache_max_age',
+            valid_type=orm.Float,
+            required=False,
+            help="Maximum age (in days) of cached results which are re-used."
+        )
+
+        spec.input(
+            'tb_model',
+            valid_type=orm.SinglefileData,
+            required=False,
+            help='Tight-binding model which was previously calculated for '
+            'the given window. If given, the tight-binding calculation is '
+            'skipped.'
+        )
+        spec.input(
+            'reference_kpoint_stride',
+            valid_type=orm.Int,
+            required=False,
+            help='If given, only every n-th k-point of the reference bands '
+            'is used in the model evaluation. This gives a cheaper, '
+            'approximate cost value.'
+        )
 
         spec.expose_outputs(ModelEvaluationBase)
+        spec.output(
+            CHECKPOINT_KEY,
+            valid_type=orm.FolderData,
+            required=False,
+            help='Retrieved folder of the Wannier90 calculation, which '
+            "contains the checkpoint file. This is returned only if the "
+            "'retrieve_checkpoint' input is set, and the tight-binding model "
+            'was calculated.'
+        )
+        spec.output(
+            TELEMETRY_KEY,
+            valid_type=orm.Dict,
+            required=False,
+            help="Summary of the window evaluation, containing the 'window', "
+            "'cost_value', whether the window is 'valid', the cache status, "
+            "the wall-clock time in seconds of each stage ('durations') and "
+            "the PKs of the processes which were run ('pks')."
+        )
         spec.outputs.dynamic = True
         spec.outline(
-            if_(cls.window_valid
-                )(cls.calculate_model, cls.evaluate_bands, cls.finalize),
-            if_(cls.window_invalid)(cls.abort_invalid)
+            if_(cls.window_valid)(
+                cls.check_cache,
+                if_(cls.needs_model)(cls.calculate_model),
+                if_(cls.needs_evaluation)(cls.evaluate_bands),
+                cls.finalize,
+            ).else_(cls.abort_invalid)
         )
 
     @check_workchain_step
-    def window_invalid(self):
-        """
-        Check if a window is invalid.
-        """
-        return not self.window_valid(show_msg=False)
-
-    @check_workchain_step
-    def window_valid(self, show_msg=True):
+    def window_valid(self):
         """
         Check if a window is valid.
         """
@@ -92,28 +186,24 @@ class RunWindow(WorkChain):
 
         # window values must be sorted
         if sorted(window_list) != window_list:
-            if show_msg:
-                self.report(
-                    '{}: windows values not sorted.'.
-                    format(window_invalid_str)
-                )
+            self.report(
+                '{}: windows values not sorted.'.format(window_invalid_str)
+            )
             return False
 
         # check number of bands in inner window <= num_wann
         if np.max(self._count_bands(limits=(froz_min, froz_max))) > num_wann:
-            if show_msg:
-                self.report(
-                    '{}: Too many bands in inner window.'.
-                    format(window_invalid_str)
-                )
+            self.report(
+                '{}: Too many bands in inner window.'.
+                format(window_invalid_str)
+            )
             return False
         # check number of bands in outer window >= num_wann
         if np.min(self._count_bands(limits=(win_min, win_max))) < num_wann:
-            if show_msg:
-                self.report(
-                    '{}: Too few bands in outer window.'.
-                    format(window_invalid_str)
-                )
+            self.report(
+                '{}: Too few bands in outer window.'.
+                format(window_invalid_str)
+            )
             return False
         return True
 
@@ -121,12 +211,116 @@ class RunWindow(WorkChain):
         """
         Count the number of bands within the given limits.
         """
-        lower, upper = sorted(limits)
-        bands = self.inputs.wannier_bands.get_bands()
-        band_count = np.sum(
-            np.logical_and(lower <= bands, bands <= upper), axis=-1
+        return self._band_index.count_bands(*limits)
+
+    @property
+    def _band_index(self):
+        """
+        The band count index, which is loaded only once per process instance.
+        """
+        try:
+            return self._band_index_instance
+        except AttributeError:
+            if 'band_index' in self.inputs:
+                band_index = BandCountIndex.from_node(self.inputs.band_index)
+            else:
+                band_index = BandCountIndex.from_bands(
+                    self.inputs.wannier_bands
+                )
+            self._band_index_instance = band_index  # pylint: disable=attribute-defined-outside-init
+            return band_index
+
+    @check_workchain_step
+    def check_cache(self):
+        """
+        Look up the tight-binding model and evaluation result in the
+        window cache.
+        """
+        self.ctx.tb_model = self.inputs.get('tb_model', None)
+        self.ctx.cached_evaluation = None
+        if not self.inputs.use_window_cache.value:
+            return
+        max_age = self.inputs.get('window_cache_max_age', None)
+        if max_age is not None:
+            max_age = max_age.value
+        tb_inputs = self.exposed_inputs(TightBindingCalculation)
+        for key in _TB_CACHE_EXCLUDED_INPUTS:
+            tb_inputs.pop(key, None)
+        # A staged input folder is described by its source folder, such
+        # that evaluations with and without staging share cache entries.
+        wannier_inputs = tb_inputs['wannier']
+        if 'remote_input_folder' in wannier_inputs:
+            staged_folder = get_staged_folder(
+                wannier_inputs['remote_input_folder']
+            )
+            if staged_folder is not None:
+                wannier_inputs.pop('remote_input_folder')
+                wannier_inputs['local_input_folder'] = staged_folder
+        self.ctx.tb_cache_key = get_tb_cache_key(
+            tb_inputs=tb_inputs,
+            window=self.inputs.window.get_list(),
+            tolerance=self.inputs.window_cache_tolerance.value
+        )
+        self.ctx.evaluation_cache_key = get_evaluation_cache_key(
+            tb_key=self.ctx.tb_cache_key,
+            evaluation_workflow=self.inputs.model_evaluation_workflow.value,
+            evaluation_inputs=dict(
+                self._evaluation_inputs,
+                reference_kpoint_stride=self.inputs.get(
+                    'reference_kpoint_stride', None
+                )
+            )
+        )
+        cached_evaluation = lookup_window_cache(
+            self.ctx.evaluation_cache_key, kind='evaluation', max_age=max_age
+        )
+        if cached_evaluation is not None:
+            self.report(
+                'Found cached evaluation in {}.'.format(cached_evaluation.pk)
+            )
+            self.ctx.cached_evaluation = cached_evaluation
+            self.ctx.tb_model = cached_evaluation.outputs.tb_model
+            status = 'hit'
+        elif self.ctx.tb_model is not None:
+            # The tight-binding model is given explicitly, there is no
+            # need to look it up.
+            status = 'miss'
+        else:
+            cached_tb = lookup_window_cache(
+                self.ctx.tb_cache_key, kind='tb', max_age=max_age
+            )
+            if cached_tb is not None:
+                self.report(
+                    'Found cached tight-binding model in {}.'.format(
+                        cached_tb.pk
+                    )
+                )
+                self.ctx.tb_model = cached_tb.outputs.tb_model
+                status = 'tb_hit'
+            else:
+                status = 'miss'
+        register_window_cache(self.node, status=status)
+
+    @check_workchain_step
+    def needs_model(self):
+        """
+        Check if the tight-binding model needs to be calculated.
+        """
+        return self.ctx.tb_model is None
+
+    @check_workchain_step
+    def needs_evaluation(self):
+        """
+        Check if the tight-binding model needs to be evaluated.
+        """
+        return self.ctx.cached_evaluation is None
+
+    @property
+    def _evaluation_inputs(self):
+        return ChainMap(
+            self.inputs.model_evaluation,
+            self.exposed_inputs(ModelEvaluationBase),
         )
-        return band_count
 
     @check_workchain_step
     def calculate_model(self):
@@ -139,6 +333,18 @@ class RunWindow(WorkChain):
             parameters=inputs['wannier']['parameters'],
             window=self.inputs.window
         )
+        # The gauge restart needs the complete local input folder, which
+        # is recovered from a staged remote input folder.
+        wannier_inputs = inputs['wannier']
+        if 'restart_checkpoint_folder' in inputs and (
+            'remote_input_folder' in wannier_inputs
+        ):
+            staged_folder = get_staged_folder(
+                wannier_inputs['remote_input_folder']
+            )
+            if staged_folder is not None:
+                wannier_inputs.pop('remote_input_folder')
+                wannier_inputs['local_input_folder'] = staged_folder
         self.report("Calculating tight-binding model.")
         return ToContext(
             tbextraction_calc=self.submit(TightBindingCalculation, **inputs)
@@ -150,27 +356,100 @@ class RunWindow(WorkChain):
         Add the tight-binding model to the outputs and run the evaluation workflow.
         """
         self.report("Adding tight-binding model to output.")
-        tb_model = self.ctx.tbextraction_calc.outputs.tb_model
+        tb_model = self._tb_model
         self.out('tb_model', tb_model)
+        if self.ctx.tb_model is None and (
+            CHECKPOINT_KEY in self.ctx.tbextraction_calc.outputs
+        ):
+            self.out(
+                CHECKPOINT_KEY,
+                self.ctx.tbextraction_calc.outputs[CHECKPOINT_KEY]
+            )
+        evaluation_inputs = dict(self._evaluation_inputs)
+        stride = self.inputs.get('reference_kpoint_stride', None)
+        if stride is not None and stride.value > 1:
+            self.report(
+                'Using every {}-th k-point of the reference bands.'.format(
+                    stride.value
+                )
+            )
+            evaluation_inputs['reference_bands'] = subsample_bands_inline(
+                bands=evaluation_inputs['reference_bands'], stride=stride
+            )
         self.report("Running model evaluation.")
         return ToContext(
             model_evaluation_wf=self.submit(
                 load_object(self.inputs.model_evaluation_workflow),
                 tb_model=tb_model,
-                **ChainMap(
-                    self.inputs.model_evaluation,
-                    self.exposed_inputs(ModelEvaluationBase),
-                )
+                **evaluation_inputs
             )
         )
 
+    @property
+    def _tb_model(self):
+        if self.ctx.tb_model is not None:
+            return self.ctx.tb_model
+        return self.ctx.tbextraction_calc.outputs.tb_model
+
     @check_workchain_step
     def finalize(self):
         """
         Add the evaluation outputs.
         """
-        self.report("Retrieving model evaluation outputs.")
-        self.out_many(get_outputs_dict(self.ctx.model_evaluation_wf))
+        if self.ctx.cached_evaluation is not None:
+            self.report("Retrieving cached outputs.")
+            outputs = get_evaluation_outputs(self.ctx.cached_evaluation)
+        else:
+            self.report("Retrieving model evaluation outputs.")
+            outputs = get_outputs_dict(self.ctx.model_evaluation_wf)
+        self.out_many(outputs)
+        if self.inputs.use_window_cache.value:
+            register_window_cache(
+                self.node,
+                tb_key=self.ctx.tb_cache_key,
+                evaluation_key=self.ctx.evaluation_cache_key
+            )
+        self._add_telemetry(valid=True, cost_value=outputs['cost_value'].value)
+
+    def _add_telemetry(self, valid, cost_value):
+        """
+        Add the telemetry of the window evaluation to the outputs. The
+        duration of each stage is given by the time between the creation
+        and the last modification of the corresponding process node.
+        """
+        durations = {}
+        pks = {'run_window': self.node.pk}
+        if valid:
+            tb_calc = self.ctx.get('tbextraction_calc', None)
+            if tb_calc is not None:
+                pks['tb_calculation'] = tb_calc.pk
+                for child in tb_calc.called:
+                    stage = _TB_STAGES.get(child.process_label, None)
+                    if stage is not None:
+                        pks[stage] = child.pk
+                        durations[stage] = _get_duration(child)
+            evaluation_wf = self.ctx.get('model_evaluation_wf', None)
+            if evaluation_wf is not None:
+                pks['evaluation'] = evaluation_wf.pk
+                durations['evaluation'] = _get_duration(evaluation_wf)
+        durations['total'] = (timezone.now() - self.node.ctime).total_seconds()
+        stride = self.inputs.get('reference_kpoint_stride', None)
+        self.out(
+            TELEMETRY_KEY,
+            orm.Dict(
+                dict=dict(
+                    window=self.inputs.window.get_list(),
+                    cost_value=cost_value,
+                    valid=valid,
+                    cache_status=self.node.get_extra(STATUS_EXTRA, None),
+                    reference_kpoint_stride=(
+                        1 if stride is None else stride.value
+                    ),
+                    durations=durations,
+                    pks=pks
+                )
+            ).store()
+        )
 
     @check_workchain_step
     def abort_invalid(self):
@@ -180,7 +459,53 @@ class RunWindow(WorkChain):
         database.
         """
         self.report('Window is invalid, assigning very large cost_value.')
-        self.out('cost_value', orm.Float(314159265358979323).store())
+        cost_value = orm.Float(314159265358979323).store()
+        self.out('cost_value', cost_value)
+        self._add_telemetry(valid=False, cost_value=cost_value.value)
+
+
+def get_evaluation_outputs(node):
+    """
+    Returns the outputs of a finished ``RunWindow`` node which describe the
+    tight-binding model and its evaluation, without the telemetry.
+    """
+    outputs = get_outputs_dict(node)
+    outputs.pop(TELEMETRY_KEY, None)
+    return outputs
+
+
+def get_telemetry(nodes):
+    """
+    Returns the telemetry records of the given ``RunWindow`` nodes, ordered
+    by their creation time. Nodes without telemetry (e.g. failed
+    evaluations) are skipped.
+    """
+    records = []
+    for node in sorted(nodes, key=lambda node: node.ctime):
+        if TELEMETRY_KEY in node.outputs:
+            records.append(node.outputs[TELEMETRY_KEY].get_dict())
+    return records
+
+
+def get_called_telemetry(node):
+    """
+    Returns the telemetry records of all ``RunWindow`` processes called
+    (directly or indirectly) by the given process node. Since each
+    ``RunWindow`` adds its telemetry as soon as the evaluation is finished,
+    this can be used to monitor a running window search.
+    """
+    return get_telemetry(
+        descendant for descendant in node.called_descendants
+        if descendant.process_label == RunWindow.__name__
+    )
+
+
+def _get_duration(node):
+    """
+    Returns the wall-clock time in seconds between the creation and the
+    last modification of a process node.
+    """
+    return (node.mtime - node.ctime).total_seconds()
 
 
 @calcfunction
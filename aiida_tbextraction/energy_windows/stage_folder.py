@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines a calculation which uploads a folder to a remote computer, such
+that it can be shared by multiple calculations.
+"""
+
+from aiida import orm
+from aiida.common import CalcInfo
+from aiida.engine import CalcJob
+
+__all__ = ('StageFolderCalculation', 'get_staged_folder')
+
+
+class StageFolderCalculation(CalcJob):
+    """
+    Uploads the contents of a folder to the computer of the given code.
+    The code itself is not executed, but a (short) job without commands is
+    still submitted to the scheduler of that computer. The uploaded folder
+    is available as the 'remote_folder' output, and can be passed to other
+    calculations as a remote input folder.
+    """
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+
+        spec.input(
+            'folder',
+            valid_type=orm.FolderData,
+            help='Folder which is uploaded to the remote computer.'
+        )
+
+    def prepare_for_submission(self, folder):  # pylint: disable=unused-argument
+        """
+        Create the calculation info, which copies the folder contents but
+        does not run any code.
+        """
+        calcinfo = CalcInfo()
+        calcinfo.uuid = self.uuid
+        calcinfo.codes_info = []
+        calcinfo.local_copy_list = [
+            (self.inputs.folder.uuid, filename, filename)
+            for filename in self.inputs.folder.list_object_names()
+        ]
+        calcinfo.remote_copy_list = []
+        calcinfo.retrieve_list = []
+        return calcinfo
+
+
+def get_staged_folder(remote_folder):
+    """
+    Returns the folder which was uploaded by a ``StageFolderCalculation``
+    to create the given remote folder, or ``None`` if the remote folder was
+    not created by staging.
+    """
+    creator = remote_folder.creator
+    if creator is None or (
+        creator.process_label != StageFolderCalculation.__name__
+    ):
+        return None
+    return creator.inputs.folder
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines a Gaussian process regression which is used as a surrogate model
+of the cost value, to screen candidate windows before evaluating them.
+"""
+
+import numpy as np
+
+__all__ = ('GaussianProcessSurrogate', )
+
+
+class GaussianProcessSurrogate:
+    """
+    Gaussian process regression with a squared-exponential kernel. The
+    cost values are standardized before the fit.
+
+    Arguments
+    ---------
+    windows : array
+        Windows at which the cost value was evaluated, of shape
+        ``(num_points, 4)``.
+    values : array
+        Cost values of the evaluated windows.
+    length_scale : float
+        Length scale of the kernel. If not given, the median distance
+        between the evaluated windows is used.
+    noise : float
+        Relative noise level added to the diagonal of the kernel matrix.
+    """
+    def __init__(self, windows, values, length_scale=None, noise=1e-4):
+        self._windows = np.array(windows, dtype=float)
+        values = np.array(values, dtype=float)
+        self._y_mean = np.mean(values)
+        self._y_std = np.std(values)
+        if self._y_std == 0:
+            self._y_std = 1.
+        if length_scale is None:
+            length_scale = self._median_distance()
+        self._length_scale = length_scale
+
+        kernel = self._kernel(self._windows, self._windows)
+        kernel[np.diag_indices_from(kernel)] += noise
+        self._cholesky = np.linalg.cholesky(kernel)
+        self._alpha = self._solve((values - self._y_mean) / self._y_std)
+
+    def predict(self, windows):
+        """
+        Returns the predicted mean and standard deviation of the cost value
+        at the given windows.
+        """
+        kernel = self._kernel(np.array(windows, dtype=float), self._windows)
+        mean = kernel @ self._alpha
+        tmp = np.linalg.solve(self._cholesky, kernel.T)
+        variance = np.clip(1 - np.sum(tmp**2, axis=0), 0, None)
+        return (
+            self._y_mean + self._y_std * mean, self._y_std * np.sqrt(variance)
+        )
+
+    def _kernel(self, windows1, windows2):
+        dist_sq = np.sum(
+            (windows1[:, np.newaxis, :] - windows2[np.newaxis, :, :])**2,
+            axis=-1
+        )
+        return np.exp(-0.5 * dist_sq / self._length_scale**2)
+
+    def _solve(self, rhs):
+        return np.linalg.solve(
+            self._cholesky.T, np.linalg.solve(self._cholesky, rhs)
+        )
+
+    def _median_distance(self):
+        dist = np.linalg.norm(
+            self._windows[:, np.newaxis, :] - self._windows[np.newaxis, :, :],
+            axis=-1
+        )[np.triu_indices(len(self._windows), k=1)]
+        dist = dist[dist > 0]
+        if dist.size == 0:
+            return 1.
+        return np.median(dist)
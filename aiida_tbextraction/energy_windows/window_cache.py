@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines a persistent, content-addressed cache of evaluated energy windows.
+
+The cache entries are finished ``RunWindow`` processes, which are marked
+with extras containing the hash of their inputs. Two keys are used: the
+tight-binding key identifies the inputs which determine the tight-binding
+model (Wannier90 input folder and parameters, parse, slice and symmetrize
+inputs, and the rounded window), and the evaluation key additionally
+contains the inputs of the model evaluation. A tight-binding hit allows
+skipping the tight-binding calculation, while an evaluation hit allows
+skipping the whole ``RunWindow``.
+"""
+
+import json
+import hashlib
+from datetime import timedelta
+
+from aiida import orm
+from aiida.common import timezone
+
+__all__ = (
+    'get_tb_cache_key', 'get_evaluation_cache_key', 'lookup_window_cache',
+    'register_window_cache', 'invalidate_window_cache', 'evict_window_cache',
+    'get_window_cache_statistics'
+)
+
+#: Version of the cache key format. Changing it invalidates all entries.
+CACHE_VERSION = 1
+
+TB_KEY_EXTRA = 'window_cache_tb_key'
+EVALUATION_KEY_EXTRA = 'window_cache_evaluation_key'
+STATUS_EXTRA = 'window_cache_status'
+LAST_USED_EXTRA = 'window_cache_last_used'
+
+
+def get_tb_cache_key(tb_inputs, window, tolerance):
+    """
+    Get the cache key for the tight-binding model created from the given
+    ``TightBindingCalculation`` inputs and window. The window values are
+    rounded to multiples of the given tolerance.
+    """
+    rounded_window = [int(round(value / tolerance)) for value in window]
+    return _hash_description({
+        'version': CACHE_VERSION,
+        'inputs': _describe(tb_inputs),
+        'window': rounded_window,
+        'tolerance': tolerance,
+    })
+
+
+def get_evaluation_cache_key(tb_key, evaluation_workflow, evaluation_inputs):
+    """
+    Get the cache key for the evaluation of the tight-binding model with
+    the given ``tb_key``.
+    """
+    return _hash_description({
+        'version': CACHE_VERSION,
+        'tb_key': tb_key,
+        'workflow': evaluation_workflow,
+        'inputs': _describe(evaluation_inputs),
+    })
+
+
+def lookup_window_cache(key, kind='tb', max_age=None):
+    """
+    Find the most recent cache entry for the given key.
+
+    Arguments
+    ---------
+    key : str
+        Tight-binding or evaluation cache key.
+    kind : str
+        Kind of the key, either 'tb' or 'evaluation'.
+    max_age : float
+        Maximum age of the cache entry, in days. Older entries are
+        ignored.
+    """
+    extra_name = {'tb': TB_KEY_EXTRA, 'evaluation': EVALUATION_KEY_EXTRA}[kind]
+    filters = {
+        'extras.{}'.format(extra_name): key,
+        'attributes.exit_status': 0
+    }
+    if max_age is not None:
+        filters['ctime'] = {'>': timezone.now() - timedelta(days=max_age)}
+    query = orm.QueryBuilder()
+    query.append(orm.WorkflowNode, filters=filters, project='*')
+    query.order_by({orm.WorkflowNode: {'ctime': 'desc'}})
+    query.limit(1)
+    result = query.first()
+    if result is None:
+        return None
+    node = result[0]
+    node.set_extra(
+        LAST_USED_EXTRA, timezone.datetime_to_isoformat(timezone.now())
+    )
+    return node
+
+
+def register_window_cache(node, status=None, tb_key=None, evaluation_key=None):
+    """
+    Mark a ``RunWindow`` node with its cache keys and / or the cache
+    status ('hit', 'tb_hit' or 'miss') of its lookup.
+    """
+    extras = {}
+    if status is not None:
+        extras[STATUS_EXTRA] = status
+    if tb_key is not None:
+        extras[TB_KEY_EXTRA] = tb_key
+    if evaluation_key is not None:
+        extras[EVALUATION_KEY_EXTRA] = evaluation_key
+    node.set_extra_many(extras)
+
+
+def invalidate_window_cache(nodes=None):
+    """
+    Remove the given nodes from the cache. If no nodes are given, the
+    complete cache is invalidated.
+
+    Returns the number of invalidated entries.
+    """
+    if nodes is None:
+        nodes = _get_cache_entries()
+    count = 0
+    for node in nodes:
+        for extra_name in [TB_KEY_EXTRA, EVALUATION_KEY_EXTRA]:
+            if extra_name in node.extras:
+                node.delete_extra(extra_name)
+        count += 1
+    return count
+
+
+def evict_window_cache(max_age=None, max_entries=None):
+    """
+    Evict cache entries which have not been used within ``max_age`` days,
+    and the least recently used entries in excess of ``max_entries``.
+
+    Returns the number of evicted entries.
+    """
+    entries = sorted(_get_cache_entries(), key=_last_used, reverse=True)
+    to_evict = []
+    if max_age is not None:
+        cutoff = timezone.now() - timedelta(days=max_age)
+        to_evict.extend(node for node in entries if _last_used(node) < cutoff)
+        entries = [node for node in entries if _last_used(node) >= cutoff]
+    if max_entries is not None:
+        to_evict.extend(entries[max_entries:])
+    return invalidate_window_cache(to_evict)
+
+
+def get_window_cache_statistics():
+    """
+    Returns the number of cache lookups with each status, the hit rates,
+    and the number of cache entries.
+    """
+    query = orm.QueryBuilder()
+    query.append(
+        orm.WorkflowNode,
+        filters={'extras': {
+            'has_key': STATUS_EXTRA
+        }},
+        project='extras.{}'.format(STATUS_EXTRA)
+    )
+    counts = {'hit': 0, 'tb_hit': 0, 'miss': 0}
+    for (status, ) in query.iterall():
+        counts[status] = counts.get(status, 0) + 1
+    num_lookups = sum(counts.values())
+    return {
+        'lookups':
+        counts,
+        'hit_rate':
+        counts['hit'] / num_lookups if num_lookups else 0.,
+        'tb_hit_rate': (counts['hit'] + counts['tb_hit']) /
+        num_lookups if num_lookups else 0.,
+        'num_entries':
+        len(_get_cache_entries()),
+    }
+
+
+def _get_cache_entries():
+    query = orm.QueryBuilder()
+    query.append(
+        orm.WorkflowNode,
+        filters={'extras': {
+            'has_key': TB_KEY_EXTRA
+        }},
+        project='*'
+    )
+    return [node for (node, ) in query.iterall()]
+
+
+def _last_used(node):
+    last_used = node.get_extra(LAST_USED_EXTRA, None)
+    if last_used is None:
+        return node.ctime
+    return timezone.isoformat_to_datetime(last_used)
+
+
+def _hash_description(description):
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def _describe(value):
+    """
+    Create a JSON-serializable description of (nested) process inputs,
+    where AiiDA nodes are replaced by their content hash. Codes and
+    metadata are ignored, since they do not change the result.
+    """
+    if isinstance(value, orm.Code):
+        return None
+    if isinstance(value, orm.Node):
+        return _node_hash(value)
+    if isinstance(value, dict) or hasattr(value, 'items'):
+        return {
+            str(key): _describe(val)
+            for key, val in value.items() if key != 'metadata'
+        }
+    if isinstance(value, (list, tuple)):
+        return [_describe(val) for val in value]
+    return value
+
+
+def _node_hash(node):
+    """
+    Get the content hash of a node. For stored nodes, the hash which was
+    computed when storing the node is used, to avoid re-hashing large
+    repository contents.
+    """
+    if node.is_stored:
+        node_hash = node.get_extra('_aiida_hash', None)
+        if node_hash is not None:
+            return node_hash
+    return node.get_hash()
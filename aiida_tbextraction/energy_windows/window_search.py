@@ -6,19 +6,34 @@
 Defines a workflow which optimizes the energy windows.
 """
 
-import copy
+import functools
+
+import numpy as np
 
 from aiida import orm
-from aiida.engine import WorkChain, ToContext
+from aiida.engine import WorkChain, ToContext, if_
 
-from aiida_tools import check_workchain_step, get_outputs_dict
+from aiida_tools import check_workchain_step
+from aiida_tools.process_inputs import PROCESS_INPUT_KWARGS, get_fullname, load_object
 from aiida_optimize import OptimizationWorkChain
-from aiida_optimize.engines import NelderMead
 
-from .run_window import RunWindow
+from .._symmetries import get_preprocessed_symmetries
+from ..model_evaluation._band_difference import plot_bands_inline
+from .run_window import (
+    RunWindow, TELEMETRY_KEY, get_evaluation_outputs, get_called_telemetry
+)
+from .band_index import BandCountIndex, get_band_index_inline
+from .engines import ProjectedNelderMead, _BatchEngineWrapper, _ProjectingEngineWrapper
+from .stage_folder import StageFolderCalculation
 
 __all__ = ('WindowSearch', )
 
+# Options of the Wannier90 calculation which are also used to stage the
+# input folder.
+_STAGING_OPTIONS = (
+    'resources', 'max_wallclock_seconds', 'queue_name', 'account', 'qos'
+)
+
 
 class WindowSearch(WorkChain):
     """
@@ -28,7 +43,13 @@ class WindowSearch(WorkChain):
     def define(cls, spec):
         super().define(spec)
 
-        spec.expose_inputs(RunWindow, exclude=['window', 'wannier.kpoints'])
+        spec.expose_inputs(
+            RunWindow,
+            exclude=[
+                'window', 'wannier.kpoints', 'tb_model',
+                'reference_kpoint_stride', 'restart_checkpoint_folder'
+            ]
+        )
         # Workaround for plumpy issue #135 (https://github.com/aiidateam/plumpy/issues/135)
         spec.inputs['model_evaluation'].dynamic = True
         spec.input(
@@ -37,6 +58,23 @@ class WindowSearch(WorkChain):
             help=
             'Initial value for the disentanglement energy windows, given as a list ``[dis_win_min, dis_froz_min, dis_froz_max, dis_win_max]``.'
         )
+        spec.input(
+            'initial_simplex_size',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(0.5),
+            help='Distance between the initial window and the other '
+            'vertices of the initial simplex.'
+        )
+        spec.input(
+            'adapt_initial_simplex',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the initial simplex is adapted to the '
+            'Wannier bands. The displacement of each window value is then '
+            'given by the typical band spacing at that energy (limited to '
+            "between 1/4 and 4 times the 'initial_simplex_size'), and its "
+            'direction is chosen such that the vertices are valid windows.'
+        )
         spec.input(
             'window_tol',
             valid_type=orm.Float,
@@ -49,10 +87,164 @@ class WindowSearch(WorkChain):
             default=lambda: orm.Float(0.02),
             help="Tolerance in the 'cost_value' for the window optimization."
         )
+        spec.input(
+            'engine',
+            default=lambda: get_fullname(ProjectedNelderMead),
+            help='Optimization engine used for the window search. The '
+            'engine must accept the same keyword arguments as the '
+            '``NelderMead`` engine. The default ``ProjectedNelderMead`` '
+            'engine projects each proposed window onto the region of valid '
+            'windows. Use ``MultiDirectionalSearch`` from '
+            '``aiida_tbextraction.energy_windows.engines`` to evaluate a '
+            'batch of windows in parallel at each iteration.',
+            **PROCESS_INPUT_KWARGS
+        )
+        spec.input(
+            'engine_kwargs',
+            valid_type=orm.Dict,
+            default=lambda: orm.Dict(dict={}),
+            help='Additional keyword arguments passed to the optimization '
+            'engine. These take precedence over the values set by the '
+            'window search.'
+        )
+        spec.input(
+            'project_windows',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(True),
+            help='Determines whether windows are projected onto the region '
+            'of valid windows, which is calculated from the '
+            '``wannier_bands`` and ``num_wann``. This is applied to the '
+            'initial simplex, and to all proposed windows if the engine '
+            'supports it (``ProjectedNelderMead`` and '
+            '``MultiDirectionalSearch``), such that no evaluation is '
+            'launched for windows which can be projected. For other engines, '
+            'only the initial simplex is projected, and invalid windows '
+            'proposed later are still evaluated, with a very large cost '
+            'value.'
+        )
+        spec.input(
+            'surrogate_screening',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether a surrogate model of the cost value is '
+            'used to skip windows which are predicted to be worse than the '
+            'current optimum. This is supported only by engines which '
+            'evaluate windows in batches (e.g. ``MultiDirectionalSearch``).'
+        )
+        spec.input(
+            'halving_strides',
+            valid_type=orm.List,
+            required=False,
+            help='If given, each batch of windows is evaluated in successive '
+            'halving fashion: the windows are first evaluated using only '
+            'every n-th k-point of the reference bands, for each stride n '
+            'in the given list, and only the best fraction of windows is '
+            'promoted to the next stride. The last stride is always 1. This '
+            'is supported only by engines which evaluate windows in batches.'
+        )
+        spec.input(
+            'halving_fraction',
+            valid_type=orm.Float,
+            default=lambda: orm.Float(0.5),
+            help='Fraction of windows which are promoted to the next stride '
+            'in successive halving.'
+        )
+        spec.input(
+            'gauge_restart',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether Wannier90 is restarted from the '
+            'converged gauge of the nearest previously evaluated window, '
+            'which is used as initial projections. The restarted '
+            'calculations upload a copy of the complete input folder with '
+            'the new ``.amn`` file, also if the input folder is staged. This '
+            'is supported only by engines which evaluate windows in batches.'
+        )
+        spec.input(
+            'stage_input_folder',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help="Determines whether the 'wannier.local_input_folder' is "
+            'uploaded to the remote computer only once, before the window '
+            'optimization. The Wannier90 calculations for the individual '
+            'windows then use the uploaded folder as remote input folder, '
+            'instead of uploading the input files again. The uploaded '
+            'folder must not be cleaned before the window search is '
+            'finished. The upload is done by a job without commands, which '
+            "is submitted with the 'wannier.code'. The window cache treats "
+            'the uploaded folder like the original input folder.'
+        )
+        spec.input(
+            'deferred_plot',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the window evaluations skip the plot '
+            'of the bandstructures, which is then created only for the '
+            'optimal window. The model evaluation workflow must support '
+            "the 'skip_plot' input and the 'calculated_bands' output (e.g. "
+            '``BandDifferenceModelEvaluation``).'
+        )
 
         spec.output('window', valid_type=orm.List)
+        spec.output(
+            TELEMETRY_KEY,
+            valid_type=orm.List,
+            help='Telemetry records of all evaluated windows, in the order '
+            'in which the evaluations were launched. Each record is the '
+            "'telemetry' output of the corresponding ``RunWindow`` process. "
+            'This output is added when the window optimization is finished, '
+            'also if it fails. While the search is running, the records of '
+            'the finished evaluations can be obtained with '
+            '``get_called_telemetry`` from '
+            '``aiida_tbextraction.energy_windows.run_window``.'
+        )
         spec.outputs.dynamic = True
-        spec.outline(cls.create_optimization, cls.finalize)
+
+        spec.exit_code(
+            300,
+            'ERROR_STAGING_FAILED',
+            message='The upload of the Wannier90 input folder failed.'
+        )
+        spec.exit_code(
+            301,
+            'ERROR_OPTIMIZATION_FAILED',
+            message='The window optimization failed.'
+        )
+
+        spec.outline(
+            if_(cls.should_stage_input_folder)(cls.stage_input_folder),
+            cls.create_optimization, cls.finalize
+        )
+
+    def should_stage_input_folder(self):
+        return self.inputs.stage_input_folder.value
+
+    @check_workchain_step
+    def stage_input_folder(self):
+        """
+        Upload the Wannier90 input folder to the remote computer.
+        """
+        wannier_inputs = self.inputs.wannier
+        if 'local_input_folder' not in wannier_inputs:
+            self.report(
+                "No 'wannier.local_input_folder' given, skipping the staging."
+            )
+            return None
+        options = wannier_inputs.get('metadata', {}).get('options', {})
+        self.report('Staging the Wannier90 input folder.')
+        return ToContext(
+            staged_input=self.submit(
+                StageFolderCalculation,
+                folder=wannier_inputs['local_input_folder'],
+                code=wannier_inputs['code'],
+                metadata={
+                    'options': {
+                        key: options[key]
+                        for key in _STAGING_OPTIONS if key in options
+                    }
+                }
+            )
+        )
 
     @check_workchain_step
     def create_optimization(self):
@@ -60,39 +252,130 @@ class WindowSearch(WorkChain):
         Run the optimization workchain.
         """
         self.report('Launching Window optimization.')
-        initial_window_list = self.inputs.initial_window.get_list()
-        window_simplex = [initial_window_list]
-        simplex_dist = 0.5
-        for i in range(len(initial_window_list)):
-            window = copy.deepcopy(initial_window_list)
-            window[i] += simplex_dist
-            window_simplex.append(window)
-
         runwindow_inputs = self.exposed_inputs(RunWindow)
-        runwindow_inputs['wannier']['kpoints'] = self.inputs.wannier_bands
+        wannier_inputs = runwindow_inputs['wannier']
+        wannier_inputs['kpoints'] = self.inputs.wannier_bands
+        staged_input = self.ctx.get('staged_input', None)
+        if staged_input is not None:
+            if not staged_input.is_finished_ok:
+                return self.exit_codes.ERROR_STAGING_FAILED
+            wannier_inputs.pop('local_input_folder')
+            wannier_inputs['remote_input_folder'
+                           ] = staged_input.outputs.remote_folder
+        if self.inputs.deferred_plot.value:
+            runwindow_inputs['model_evaluation'] = dict(
+                runwindow_inputs['model_evaluation'], skip_plot=orm.Bool(True)
+            )
+        # The band index is created only once, and shared between all
+        # RunWindow evaluations.
+        if 'band_index' not in runwindow_inputs:
+            runwindow_inputs['band_index'] = get_band_index_inline(
+                wannier_bands=self.inputs.wannier_bands
+            )
+        # The symmetries are pre-processed only once, and shared between all
+        # RunWindow evaluations.
+        if self.inputs.preprocess_symmetries.value and (
+            'symmetries' in runwindow_inputs
+        ):
+            runwindow_inputs['symmetries'] = get_preprocessed_symmetries(
+                runwindow_inputs['symmetries']
+            )
+        window_constraints = dict(
+            band_index=runwindow_inputs['band_index'].uuid,
+            num_wann=int(
+                self.inputs.wannier.parameters.get_attribute('num_wann')
+            )
+        )
+
+        engine_kwargs = dict(
+            result_key='cost_value',
+            xtol=self.inputs.window_tol.value,
+            ftol=None,
+            input_key='window',
+            simplex=self._create_simplex(
+                band_index=BandCountIndex.from_node(
+                    runwindow_inputs['band_index']
+                ),
+                num_wann=window_constraints['num_wann']
+            )
+        )
+        engine_class = load_object(self.inputs.engine.value)
+        supports_projection = issubclass(
+            engine_class, _ProjectingEngineWrapper
+        )
+        if supports_projection and self.inputs.project_windows.value:
+            engine_kwargs['window_constraints'] = window_constraints
+        if issubclass(engine_class, _BatchEngineWrapper):
+            engine_kwargs.update(
+                surrogate_screening=self.inputs.surrogate_screening.value
+            )
+            if 'halving_strides' in self.inputs:
+                engine_kwargs.update(
+                    halving_strides=self.inputs.halving_strides.get_list(),
+                    halving_fraction=self.inputs.halving_fraction.value
+                )
+            if self.inputs.gauge_restart.value:
+                engine_kwargs.update(gauge_restart=True)
+                runwindow_inputs['retrieve_checkpoint'] = orm.Bool(True)
+        elif any([
+            self.inputs.surrogate_screening.value,
+            self.inputs.gauge_restart.value, 'halving_strides' in self.inputs
+        ]):
+            self.report(
+                'Surrogate screening, successive halving and gauge restarts '
+                'are not supported by the engine, ignoring them.'
+            )
+        engine_kwargs.update(self.inputs.engine_kwargs.get_dict())
         return ToContext(
             optimization=self.submit(
                 OptimizationWorkChain,
-                engine=NelderMead,
-                engine_kwargs=orm.Dict(
-                    dict=dict(
-                        result_key='cost_value',
-                        xtol=self.inputs.window_tol.value,
-                        ftol=None,
-                        input_key='window',
-                        simplex=window_simplex
-                    )
-                ),
+                engine=self.inputs.engine,
+                engine_kwargs=orm.Dict(dict=engine_kwargs),
                 evaluate_process=RunWindow,
                 evaluate=runwindow_inputs
             )
         )
 
+    def _create_simplex(self, band_index, num_wann):
+        """
+        Create the initial simplex around the initial window. If
+        'project_windows' is set, the windows are projected onto the region
+        of valid windows (see :func:`_create_displaced_simplex`). If
+        'adapt_initial_simplex' is set, the simplex size and orientation are
+        determined from the Wannier bands.
+        """
+        if self.inputs.project_windows.value:
+            project = functools.partial(
+                _project_window, band_index=band_index, num_wann=num_wann
+            )
+        else:
+            project = list
+        initial_window_list = project(self.inputs.initial_window.get_list())
+        simplex_dist = self.inputs.initial_simplex_size.value
+        if self.inputs.adapt_initial_simplex.value:
+            self.report('Creating initial simplex from the band structure.')
+            return band_index.create_simplex(
+                initial_window_list, num_wann=num_wann, size=simplex_dist
+            )
+        return _create_displaced_simplex(
+            initial_window_list, simplex_dist=simplex_dist, project=project
+        )
+
     @check_workchain_step
     def finalize(self):
         """
-        Add the optimization results to the outputs.
+        Add the optimization results to the outputs. The telemetry is
+        added even if the optimization failed, such that the evaluated
+        windows can be inspected.
         """
+        self.report('Adding telemetry to outputs.')
+        self.out(
+            TELEMETRY_KEY,
+            orm.List(list=get_called_telemetry(self.ctx.optimization)).store()
+        )
+        if not self.ctx.optimization.is_finished_ok:
+            self.report('The window optimization failed.')
+            return self.exit_codes.ERROR_OPTIMIZATION_FAILED
         self.report('Add optimization results to outputs.')
         optimal_calc = orm.load_node(
             self.ctx.optimization.outputs.optimal_process_uuid.value
@@ -100,5 +383,72 @@ class WindowSearch(WorkChain):
         self.report('Adding optimal window to outputs.')
         self.out('window', optimal_calc.inputs.window)
         self.report("Adding outputs of the optimal calculation.")
-        self.out_many(get_outputs_dict(optimal_calc))
+        outputs = get_evaluation_outputs(optimal_calc)
+        self.out_many(outputs)
+        if self.inputs.deferred_plot.value and 'plot' not in outputs:
+            self.report('Plotting bandstructure of the optimal model.')
+            self.out(
+                'plot',
+                plot_bands_inline(
+                    bands1=optimal_calc.inputs.reference_bands,
+                    bands2=outputs['calculated_bands']
+                )
+            )
         self.report('Finished!')
+        return None
+
+
+def _project_window(window, band_index, num_wann):
+    """
+    Project the window onto the region of valid windows, or return it
+    unchanged if this is not possible.
+    """
+    projected_window = band_index.project_window(window, num_wann=num_wann)
+    if projected_window is None:
+        return list(window)
+    return projected_window
+
+
+def _create_displaced_simplex(window, simplex_dist, project):
+    """
+    Create a simplex where each vertex except the first displaces one of
+    the window values by ``simplex_dist``, and is then projected. If the
+    projected vertex does not span a new direction of the simplex, the
+    displacement is flipped or halved. If none of the projected vertices
+    is affinely independent of the existing vertices, an unprojected vertex
+    is used instead, which is evaluated with the large cost value of
+    invalid windows.
+    """
+    num_dims = len(window)
+    simplex = [[float(x) for x in window]]
+    for dim in range(num_dims):
+        candidates = [
+            project(_displace(window, dim, factor * simplex_dist))
+            for factor in [1., -1., 0.5, -0.5]
+        ]
+        candidates.extend(
+            _displace(window, other_dim, factor * simplex_dist)
+            for other_dim in [dim] + list(range(num_dims))
+            for factor in [1., -1.]
+        )
+        vertex = next(
+            vertex for vertex in candidates
+            if _is_affinely_independent(simplex, vertex)
+        )
+        simplex.append([float(x) for x in vertex])
+    return simplex
+
+
+def _displace(window, dim, displacement):
+    window = list(window)
+    window[dim] += displacement
+    return window
+
+
+def _is_affinely_independent(simplex, vertex):
+    """
+    Check if the vertex is affinely independent of the (non-degenerate)
+    vertices of the simplex.
+    """
+    edges = np.array(simplex[1:] + [vertex]) - simplex[0]
+    return np.linalg.matrix_rank(edges) == len(edges)
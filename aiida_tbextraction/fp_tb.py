@@ -21,6 +21,7 @@ from .calculate_tb import TightBindingCalculation
 from .fp_run import FirstPrinciplesRunBase
 from .energy_windows.auto_guess import add_initial_window_inline
 from ._calcfunctions import merge_nested_dict, slice_bands_inline
+from .model_evaluation._band_difference import plot_bands_inline
 
 __all__ = ('FirstPrinciplesTightBinding', )
 
@@ -96,6 +97,16 @@ class FirstPrinciplesTightBinding(WorkChain):
             'AiiDA workflow that will be used to evaluate the tight-binding model.',
             **PROCESS_INPUT_KWARGS
         )
+        spec.input(
+            'deferred_plot',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the model evaluation skips the plot of '
+            'the bandstructures, which is then created in-process when the '
+            'workflow finishes. The model evaluation workflow must support '
+            "the 'skip_plot' input and the 'calculated_bands' output (e.g. "
+            '``BandDifferenceModelEvaluation``).'
+        )
 
         spec.expose_outputs(TightBindingCalculation)
         spec.expose_outputs(ModelEvaluationBase)
@@ -206,6 +217,14 @@ class FirstPrinciplesTightBinding(WorkChain):
             reference_bands = slice_bands_inline(
                 bands=reference_bands, slice_idx=slice_reference_bands
             )
+        evaluation_inputs = ChainMap(
+            self.inputs.model_evaluation,
+            self.exposed_inputs(ModelEvaluationBase),
+        )
+        if self.inputs.deferred_plot.value:
+            evaluation_inputs = evaluation_inputs.new_child(
+                dict(skip_plot=orm.Bool(True))
+            )
         self.report('Starting model evaluation workflow.')
         return ToContext(
             model_evaluation_wf=self.submit(
@@ -213,10 +232,7 @@ class FirstPrinciplesTightBinding(WorkChain):
                 tb_model=tb_model,
                 reference_bands=reference_bands,
                 reference_structure=self.inputs.structure,
-                **ChainMap(
-                    self.inputs.model_evaluation,
-                    self.exposed_inputs(ModelEvaluationBase),
-                )
+                **evaluation_inputs
             )
         )
 
@@ -226,4 +242,14 @@ class FirstPrinciplesTightBinding(WorkChain):
         Add the outputs from the evaluation workflow.
         """
         self.report("Adding outputs from model evaluation workflow.")
-        self.out_many(get_outputs_dict(self.ctx.model_evaluation_wf))
+        outputs = get_outputs_dict(self.ctx.model_evaluation_wf)
+        self.out_many(outputs)
+        if self.inputs.deferred_plot.value and 'plot' not in outputs:
+            self.report('Plotting bandstructure of the tight-binding model.')
+            self.out(
+                'plot',
+                plot_bands_inline(
+                    bands1=self.ctx.model_evaluation_wf.inputs.reference_bands,
+                    bands2=outputs['calculated_bands']
+                )
+            )
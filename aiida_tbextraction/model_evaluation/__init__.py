@@ -10,8 +10,10 @@ from ._base import ModelEvaluationBase
 from ._band_difference import BandDifferenceModelEvaluation
 from ._combined_evaluation import CombinedEvaluation
 from ._pos_distance import MaximumOrbitalDistanceEvaluation
+from ._vectorized_band_difference import VectorizedBandDifferenceEvaluation
 
 __all__ = (
     "ModelEvaluationBase", "BandDifferenceModelEvaluation",
-    "CombinedEvaluation", "MaximumOrbitalDistanceEvaluation"
+    "CombinedEvaluation", "MaximumOrbitalDistanceEvaluation",
+    "VectorizedBandDifferenceEvaluation"
 )
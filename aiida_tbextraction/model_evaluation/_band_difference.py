@@ -6,13 +6,24 @@
 Defines a workflow which evaluates a tight-binding model by comparing its bandstructure to a reference bandstructure.
 """
 
+import os
+import tempfile
+
+import numpy as np
+import tbmodels
+from bands_inspect.eigenvals import EigenvalsData
+from bands_inspect.compare import difference as bi_difference
+from bands_inspect import plot as bi_plot
+
 from aiida import orm
-from aiida.engine import ToContext
+from aiida.engine import ToContext, calcfunction
 from aiida.plugins import CalculationFactory
 
 from aiida_tools import check_workchain_step
+from aiida_bands_inspect.convert import from_bands_inspect, to_bands_inspect
 
 from ._base import ModelEvaluationBase
+from ._eigenvals import calculate_eigenvals, calculate_eigenvals_streaming
 
 __all__ = ('BandDifferenceModelEvaluation', )
 
@@ -27,19 +38,93 @@ class BandDifferenceModelEvaluation(ModelEvaluationBase):
         spec.input(
             'code_bands_inspect',
             valid_type=orm.Code,
-            help='Code that runs the bands_inspect CLI.'
+            required=False,
+            help='Code that runs the bands_inspect CLI. This input is '
+            "required unless 'local_execution' is set."
+        )
+        spec.input(
+            'local_execution',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the bandstructure, difference and plot '
+            'are calculated in-process by calcfunctions, using the TBmodels '
+            'and bands_inspect Python interfaces, instead of submitting '
+            'calculations.'
+        )
+        spec.input(
+            'skip_plot',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether plotting the bandstructures is skipped. '
+            "The plot can be created later from the 'calculated_bands' "
+            'output.'
+        )
+        spec.input(
+            'num_processes',
+            valid_type=orm.Int,
+            required=False,
+            help='Number of worker processes among which the reference '
+            'k-points are distributed for calculating the bandstructure. '
+            "It cannot be given together with 'memory_budget'. This is used "
+            "only if 'local_execution' is set."
+        )
+        spec.input(
+            'memory_budget',
+            valid_type=orm.Int,
+            required=False,
+            help='Memory (in MB) available for constructing and diagonalizing '
+            'the Hamiltonians. If given, the tight-binding model is read '
+            'from its HDF5 file one hopping matrix at a time, and the '
+            'k-points are processed in chunks that fit into this budget. '
+            'If more than one chunk is needed, the hopping matrices are '
+            'kept in memory if they fit into half of the budget. Otherwise, '
+            'they are read from the file again for each chunk. '
+            "It cannot be given together with 'num_processes'. This is used "
+            "only if 'local_execution' is set."
+        )
+        spec.input(
+            'precomputed_bands',
+            valid_type=orm.BandsData,
+            required=False,
+            help='Bandstructure of the tight-binding model, at the k-points '
+            'of the reference bandstructure. If given, it is used instead of '
+            'calculating the bandstructure.'
         )
         spec.output(
             'plot',
             valid_type=orm.SinglefileData,
+            required=False,
             help='Plot comparing the reference and evaluated bandstructure.'
         )
+        spec.output(
+            'calculated_bands',
+            valid_type=orm.BandsData,
+            help='Bandstructure of the tight-binding model, at the k-points '
+            'of the reference bandstructure.'
+        )
 
         spec.outline(
             cls.calculate_bands, cls.calculate_difference_and_plot,
             cls.finalize
         )
 
+        spec.exit_code(
+            300,
+            'ERROR_MISSING_CODE',
+            message="The 'code_bands_inspect' input is required unless "
+            "'local_execution' is set."
+        )
+        spec.inputs.validator = cls._validate_inputs
+
+    @staticmethod
+    def _validate_inputs(inputs, ctx=None):  # pylint: disable=unused-argument,inconsistent-return-statements
+        """
+        Checks that 'num_processes' and 'memory_budget' are not given
+        together.
+        """
+        if 'num_processes' in inputs and 'memory_budget' in inputs:
+            return "The 'num_processes' and 'memory_budget' inputs cannot be given together."
+
     def setup_calc(self, calc_string, code_param):
         """
         Helper function to set up a calculation of a specified type.
@@ -56,28 +141,72 @@ class BandDifferenceModelEvaluation(ModelEvaluationBase):
         """
         Calculate the bandstructure of the given tight-binding model.
         """
+        if not self.inputs.local_execution.value and (
+            'code_bands_inspect' not in self.inputs
+        ):
+            return self.exit_codes.ERROR_MISSING_CODE
+        if 'precomputed_bands' in self.inputs:
+            self.report('Using the precomputed bandstructure.')
+            return None
+        if self.inputs.local_execution.value:
+            self.report("Calculating bandstructure in-process.")
+            inputs = {}
+            for key in ['num_processes', 'memory_budget']:
+                if key in self.inputs:
+                    inputs[key] = self.inputs[key]
+            self.ctx.local_bands = calculate_bands_inline(
+                tb_model=self.inputs.tb_model,
+                kpoints=self.inputs.reference_bands,
+                **inputs
+            )
+            return None
         builder = self.setup_calc('tbmodels.eigenvals', 'code_tbmodels')
         builder.tb_model = self.inputs.tb_model
         builder.kpoints = self.inputs.reference_bands
         self.report("Running TBmodels eigenvals calculation.")
         return ToContext(calculated_bands=self.submit(builder))
 
+    def _get_tb_bands(self):
+        """
+        Returns the bandstructure of the tight-binding model.
+        """
+        if 'precomputed_bands' in self.inputs:
+            return self.inputs.precomputed_bands
+        if self.inputs.local_execution.value:
+            return self.ctx.local_bands
+        return self.ctx.calculated_bands.outputs.bands
+
     @check_workchain_step
     def calculate_difference_and_plot(self):
         """
         Calculate the difference between the tight-binding and reference bandstructures, and plot them.
         """
+        tb_bands = self._get_tb_bands()
+        if self.inputs.local_execution.value:
+            self.report('Calculating difference and plot in-process.')
+            self.ctx.local_difference = difference_inline(
+                bands1=self.inputs.reference_bands, bands2=tb_bands
+            )
+            if not self.inputs.skip_plot.value:
+                self.ctx.local_plot = plot_bands_inline(
+                    bands1=self.inputs.reference_bands, bands2=tb_bands
+                )
+            return None
         diff_builder = self.setup_calc(
             'bands_inspect.difference', 'code_bands_inspect'
         )
+        diff_builder.bands1 = self.inputs.reference_bands
+        diff_builder.bands2 = tb_bands
+        if self.inputs.skip_plot.value:
+            self.report('Running difference calculation.')
+            return ToContext(difference=self.submit(diff_builder))
+
         plot_builder = self.setup_calc(
             'bands_inspect.plot', 'code_bands_inspect'
         )
         # Inputs for the plot and difference calculations are the same
-        diff_builder.bands1 = self.inputs.reference_bands
-        diff_builder.bands2 = self.ctx.calculated_bands.outputs.bands
         plot_builder.bands1 = self.inputs.reference_bands
-        plot_builder.bands2 = self.ctx.calculated_bands.outputs.bands
+        plot_builder.bands2 = tb_bands
 
         self.report('Running difference and plot calculations.')
         self.report('Running plot calculation.')
@@ -91,5 +220,106 @@ class BandDifferenceModelEvaluation(ModelEvaluationBase):
         """
         Return outputs of the difference and plot calculations.
         """
-        self.out('cost_value', self.ctx.difference.outputs.difference)
-        self.out('plot', self.ctx.plot.outputs.plot)
+        self.out('calculated_bands', self._get_tb_bands())
+        if self.inputs.local_execution.value:
+            self.out('cost_value', self.ctx.local_difference)
+            if not self.inputs.skip_plot.value:
+                self.out('plot', self.ctx.local_plot)
+        else:
+            self.out('cost_value', self.ctx.difference.outputs.difference)
+            if not self.inputs.skip_plot.value:
+                self.out('plot', self.ctx.plot.outputs.plot)
+
+
+@calcfunction
+def calculate_bands_inline(
+    tb_model, kpoints, num_processes=None, memory_budget=None
+):
+    """
+    Calculates the bandstructure of a tight-binding model at the given
+    k-points, equivalent to the ``tbmodels.eigenvals`` calculation. If
+    'num_processes' is given, the k-points are distributed among that many
+    worker processes. If 'memory_budget' (in MB) is given, the model is
+    not loaded, and the Hamiltonians are constructed in chunks of k-points.
+    """
+    kpoints_bi = to_bands_inspect(kpoints)
+    if isinstance(kpoints_bi, EigenvalsData):
+        kpoints_bi = kpoints_bi.kpoints
+    if memory_budget is not None:
+        with tb_model.open(mode='rb') as input_file:
+            eigenvals = calculate_eigenvals_streaming(
+                input_file,
+                kpoints_bi.kpoints_explicit,
+                memory_budget=memory_budget.value * 10**6
+            )
+        return from_bands_inspect(
+            EigenvalsData(kpoints=kpoints_bi, eigenvals=eigenvals)
+        )
+    with tb_model.open(mode='rb') as input_file:
+        model = tbmodels.io.load(input_file)
+    if num_processes is None:
+        return from_bands_inspect(
+            EigenvalsData.from_eigenval_function(
+                kpoints=kpoints_bi,
+                eigenval_function=model.eigenval,
+                listable=True
+            )
+        )
+    return from_bands_inspect(
+        EigenvalsData(
+            kpoints=kpoints_bi,
+            eigenvals=calculate_eigenvals(
+                model,
+                kpoints_bi.kpoints_explicit,
+                num_processes=num_processes.value
+            )
+        )
+    )
+
+
+@calcfunction
+def difference_inline(bands1, bands2):
+    """
+    Calculates the average difference between two bandstructures,
+    equivalent to the ``bands_inspect.difference`` calculation.
+    """
+    return orm.Float(
+        bi_difference.calculate(
+            to_bands_inspect(bands1), to_bands_inspect(bands2)
+        )
+    )
+
+
+@calcfunction
+def plot_bands_inline(bands1, bands2):
+    """
+    Plots two bandstructures which share the same k-points, equivalent to
+    the ``bands_inspect.plot`` calculation.
+    """
+    # The pyplot interface is not used, to avoid changing the global
+    # matplotlib state of the running process.
+    from matplotlib.figure import Figure  # pylint: disable=import-outside-toplevel
+    from matplotlib.backends.backend_agg import FigureCanvasAgg  # pylint: disable=import-outside-toplevel
+
+    eigenvals_list = [to_bands_inspect(bands1), to_bands_inspect(bands2)]
+    kpoints = eigenvals_list[0].kpoints.kpoints_explicit
+    for eigenvals in eigenvals_list:
+        if not np.allclose(kpoints, eigenvals.kpoints.kpoints_explicit):
+            raise ValueError('K-points do not match!')
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    axis = fig.add_subplot(111)
+    for i, eigenvals in enumerate(eigenvals_list):
+        bi_plot.eigenvals(
+            eigenvals,
+            ax=axis,
+            plot_options={
+                'color': 'C{}'.format(i),
+                'lw': 0.8
+            }
+        )
+    with tempfile.TemporaryDirectory() as folder:
+        output_path = os.path.join(folder, 'plot.pdf')
+        fig.savefig(output_path, bbox_inches='tight')
+        return orm.SinglefileData(file=output_path)
@@ -18,6 +18,11 @@ class ModelEvaluationBase(WorkChain):
     returns a cost measure, which should be minimized to get an optimal
     model.
     """
+    #: Relative computational cost of the evaluation, used to order the
+    #: evaluations in a staged ``CombinedEvaluation``. Cheaper evaluations
+    #: have a lower cost class.
+    COST_CLASS = 1
+
     @classmethod
     def define(cls, spec):
         super().define(spec)
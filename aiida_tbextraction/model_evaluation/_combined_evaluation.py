@@ -6,15 +6,29 @@ Implements a workchain to combine multiple evaluation processes.
 import numbers
 
 from aiida import orm
-from aiida.engine import Process, ToContext
+from aiida.engine import Process, ToContext, while_
+from aiida.plugins import CalculationFactory
 from aiida_tools import get_outputs_dict
 from aiida_tools.process_inputs import get_fullname, load_object
 
 from ._base import ModelEvaluationBase
+from ._band_difference import calculate_bands_inline
+from ._vectorized_band_difference import VectorizedBandDifferenceEvaluation
 
 
 class CombinedEvaluation(ModelEvaluationBase):
     """WorkChain to combine multiple model evaluation methods.
+
+    If a 'rejection_threshold' is given, the evaluations are run in
+    stages of increasing cost class, and the remaining (more expensive)
+    evaluations are skipped as soon as the partial weighted cost exceeds
+    the threshold. The model is then marked as rejected, and its cost value
+    is at least the 'rejection_cost'.
+
+    If 'share_bands' is set, the bandstructure of the tight-binding model
+    is calculated only once, and passed to all evaluations which accept a
+    'precomputed_bands' input. If all of these evaluations run in-process,
+    the shared bandstructure is also calculated in-process.
     """
     @classmethod
     def define(cls, spec):
@@ -43,19 +57,83 @@ class CombinedEvaluation(ModelEvaluationBase):
             valid_type=orm.List,
             help='A list of weights for combining the cost values.'
         )
+        spec.input(
+            'cost_classes',
+            valid_type=orm.List,
+            required=False,
+            help="A list of cost classes for each of the process classes, "
+            "used to order the evaluations if a 'rejection_threshold' is "
+            "given. By default, the 'COST_CLASS' attribute of the process "
+            "classes is used."
+        )
+        spec.input(
+            'rejection_threshold',
+            valid_type=orm.Float,
+            required=False,
+            help='If given, the evaluations are run in stages of increasing '
+            'cost class. Once the partial weighted cost exceeds this value, '
+            'the remaining evaluations are skipped, and the model is '
+            "rejected. The 'cost_value' of a rejected model is the maximum "
+            "of the partial cost and the 'rejection_cost'. The partial cost "
+            'is only a lower bound for the full cost, since the weights must '
+            'be non-negative in this case.'
+        )
+        spec.input(
+            'rejection_cost',
+            valid_type=orm.Float,
+            required=False,
+            help="Minimum 'cost_value' of rejected models. It should be "
+            'larger than the cost of any acceptable model, such that a '
+            'rejected model is never preferred over a model whose full cost '
+            "was evaluated. Defaults to the 'rejection_threshold'."
+        )
+        spec.input(
+            'share_bands',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the bandstructure of the tight-binding '
+            'model is calculated once and shared among the evaluations '
+            "which accept a 'precomputed_bands' input. It is calculated "
+            'in-process if all of these evaluations run in-process.'
+        )
         spec.inputs.validator = cls._validate_inputs
 
         spec.exit_code(
             300, 'SUBPROCESS_FAILED', message="An evaluation process failed."
         )
+        spec.exit_code(
+            301,
+            'SHARED_BANDS_FAILED',
+            message="The calculation of the shared bandstructure failed."
+        )
 
         spec.output_namespace(
             'extra_outputs',
             dynamic=True,
             help="Outputs generated by the individual evaluation processes."
         )
+        spec.output(
+            'skipped_evaluations',
+            valid_type=orm.List,
+            required=False,
+            help='Labels of the evaluations which were skipped because the '
+            "'rejection_threshold' was exceeded."
+        )
+        spec.output(
+            'rejected',
+            valid_type=orm.Bool,
+            help="Determines whether the model was rejected because the "
+            "partial cost exceeded the 'rejection_threshold'. The "
+            "'cost_value' of a rejected model is not its full cost."
+        )
 
-        spec.outline(cls.launch_evaluations, cls.retrieve_evaluations)
+        spec.outline(
+            cls.create_stages,
+            while_(cls.has_next_stage)(
+                cls.calculate_shared_bands, cls.launch_evaluations,
+                cls.check_evaluations
+            ), cls.retrieve_evaluations
+        )
 
     @staticmethod
     def _validate_inputs(inputs, ctx=None):  # pylint: disable=unused-argument,inconsistent-return-statements,too-many-return-statements
@@ -85,6 +163,19 @@ class CombinedEvaluation(ModelEvaluationBase):
         for label in inputs['extra_inputs']:
             if label not in inputs['labels']:
                 return f"Extra inputs with label '{label}' have no corresponding entry in the 'labels' input."
+        if 'cost_classes' in inputs:
+            if len(inputs['cost_classes']) != len(inputs['labels']):
+                return "The 'cost_classes' input must have the same length as the 'labels' input."
+            if not all(
+                isinstance(val, numbers.Integral)
+                for val in inputs['cost_classes']
+            ):
+                return "The 'cost_classes' inputs must be integers."
+        if 'rejection_threshold' in inputs:
+            if any(val < 0 for val in inputs['weights']):
+                return "The 'weights' must be non-negative if a 'rejection_threshold' is given."
+        elif 'rejection_cost' in inputs:
+            return "The 'rejection_cost' input requires a 'rejection_threshold'."
 
     @staticmethod
     def _serialize_process_classes(input_list):
@@ -95,35 +186,190 @@ class CombinedEvaluation(ModelEvaluationBase):
             ]
         )
 
-    def launch_evaluations(self):
-        """Launch the individual model evaluation processes."""
-        processes = {}
+    def create_stages(self):
+        """
+        Group the evaluations into stages. Without a 'rejection_threshold',
+        all evaluations are run in a single stage.
+        """
+        labels = list(self.inputs.labels)
+        self.ctx.finished_labels = []
+        self.ctx.partial_cost_value = 0.
+        self.ctx.rejected = False
+        if 'rejection_threshold' not in self.inputs:
+            self.ctx.stages = [labels]
+            return
+        if 'cost_classes' in self.inputs:
+            cost_classes = list(self.inputs.cost_classes)
+        else:
+            cost_classes = [
+                load_object(process_class_string).COST_CLASS
+                for process_class_string in self.inputs.process_classes
+            ]
+        stages = {}
+        for label, cost_class in zip(labels, cost_classes):
+            stages.setdefault(cost_class, []).append(label)
+        self.ctx.stages = [stages[key] for key in sorted(stages)]
+
+    def has_next_stage(self):
+        return bool(self.ctx.stages)
+
+    def _get_stage_processes(self):
+        """
+        Returns the labels and process classes of the evaluations in the
+        next stage.
+        """
+        return [(label, load_object(process_class_string))
+                for label, process_class_string in
+                zip(self.inputs.labels, self.inputs.process_classes)
+                if label in self.ctx.stages[0]]
+
+    def _accepts_shared_bands(self, label, process_class):
+        """
+        Check whether the evaluation with the given label receives the
+        shared bandstructure.
+        """
+        return (
+            self.inputs.share_bands.value
+            and 'precomputed_bands' in process_class.spec().inputs and
+            'precomputed_bands' not in self.inputs.extra_inputs.get(label, {})
+        )
+
+    def _shared_bands_in_process(self):
+        """
+        Check whether all evaluations receiving the shared bandstructure run
+        in-process, such that it can also be calculated in-process.
+        """
         for label, process_class_string in zip(
             self.inputs.labels, self.inputs.process_classes
         ):
             process_class = load_object(process_class_string)
+            if not self._accepts_shared_bands(label, process_class):
+                continue
+            if issubclass(process_class, VectorizedBandDifferenceEvaluation):
+                continue
+            local_execution = self.inputs.extra_inputs.get(label, {}).get(
+                'local_execution', None
+            )
+            if local_execution is None or not local_execution.value:
+                return False
+        return True
+
+    def _get_shared_bands(self):
+        """
+        Returns the shared bandstructure, which is the output of either the
+        in-process calculation or the TBmodels eigenvals calculation.
+        """
+        shared_bands = self.ctx.shared_bands
+        if 'bands' in shared_bands.outputs:
+            return shared_bands.outputs.bands
+        return shared_bands.outputs.result
+
+    def calculate_shared_bands(self):
+        """
+        Calculate the bandstructure of the tight-binding model if it is
+        needed by the next stage, and has not been calculated yet.
+        """
+        if 'shared_bands' in self.ctx:
+            return None
+        if not any(
+            self._accepts_shared_bands(label, process_class)
+            for label, process_class in self._get_stage_processes()
+        ):
+            return None
+        if self._shared_bands_in_process():
+            self.report('Calculating shared bandstructure in-process.')
+            _, self.ctx.shared_bands = calculate_bands_inline.run_get_node(
+                tb_model=self.inputs.tb_model,
+                kpoints=self.inputs.reference_bands
+            )
+            return None
+        builder = CalculationFactory('tbmodels.eigenvals').get_builder()
+        builder.code = self.inputs.code_tbmodels
+        builder.tb_model = self.inputs.tb_model
+        builder.kpoints = self.inputs.reference_bands
+        builder.metadata.options = dict(
+            resources={'num_machines': 1}, withmpi=False
+        )
+        self.report('Running shared TBmodels eigenvals calculation.')
+        return ToContext(shared_bands=self.submit(builder))
+
+    def launch_evaluations(self):  # pylint: disable=inconsistent-return-statements
+        """Launch the model evaluation processes of the next stage."""
+        shared_bands = self.ctx.get('shared_bands', None)
+        if shared_bands is not None and not shared_bands.is_finished_ok:
+            return self.exit_codes.SHARED_BANDS_FAILED  # pylint: disable=no-member
+        stage_processes = self._get_stage_processes()
+        self.ctx.stages.pop(0)
+        if 'rejection_threshold' in self.inputs:
+            self.report(
+                'Running evaluation stage: {}'.format(
+                    ', '.join(label for label, _ in stage_processes)
+                )
+            )
+        processes = {}
+        for label, process_class in stage_processes:
+            inputs = dict(self.inputs.extra_inputs.get(label, {}))
+            if self._accepts_shared_bands(label, process_class):
+                inputs['precomputed_bands'] = self._get_shared_bands()
             processes[label] = self.submit(
                 process_class,
                 reference_structure=self.inputs.reference_structure,
                 reference_bands=self.inputs.reference_bands,
                 tb_model=self.inputs.tb_model,
                 code_tbmodels=self.inputs.code_tbmodels,
-                **self.inputs.extra_inputs.get(label, {})
+                **inputs
             )
 
+        self.ctx.current_labels = list(processes)
         return ToContext(**processes)
 
-    def retrieve_evaluations(self):  # pylint: disable=inconsistent-return-statements
-        """Retrieve the results of the individual model evaluations."""
-
-        cost_value_result = 0.
-        extra_outputs = {}
+    def check_evaluations(self):  # pylint: disable=inconsistent-return-statements
+        """
+        Check the evaluations of the current stage, and skip the remaining
+        stages if the partial cost exceeds the 'rejection_threshold'.
+        """
         for label, weight in zip(self.inputs.labels, self.inputs.weights):
+            if label not in self.ctx.current_labels:
+                continue
             node = self.ctx[label]
             if not node.is_finished_ok:
                 return self.exit_codes.SUBPROCESS_FAILED  # pylint: disable=no-member
-            cost_value_result += weight * node.outputs.cost_value.value
-            extra_outputs[label] = get_outputs_dict(node)
+            self.ctx.partial_cost_value += weight * node.outputs.cost_value.value
+            self.ctx.finished_labels.append(label)
+        if self.ctx.stages and (
+            self.ctx.partial_cost_value > self.inputs.rejection_threshold.value
+        ):
+            self.report(
+                'Partial cost value {} exceeds the rejection threshold, '
+                'skipping the remaining evaluations.'.format(
+                    self.ctx.partial_cost_value
+                )
+            )
+            self.ctx.stages = []
+            self.ctx.rejected = True
+
+    def retrieve_evaluations(self):
+        """Retrieve the results of the individual model evaluations."""
+        extra_outputs = {
+            label: get_outputs_dict(self.ctx[label])
+            for label in self.ctx.finished_labels
+        }
+        skipped_labels = [
+            label for label in self.inputs.labels
+            if label not in self.ctx.finished_labels
+        ]
+        cost_value = self.ctx.partial_cost_value
+        if self.ctx.rejected:
+            rejection_cost = self.inputs.get(
+                'rejection_cost', self.inputs.rejection_threshold
+            )
+            cost_value = max(cost_value, rejection_cost.value)
         # Note: breaking provenance of 'cost_value' here.
-        self.out('cost_value', orm.Float(cost_value_result).store())
+        self.out('cost_value', orm.Float(cost_value).store())
+        self.out('rejected', orm.Bool(self.ctx.rejected).store())
         self.out_many({'extra_outputs': extra_outputs})
+        if skipped_labels:
+            self.out(
+                'skipped_evaluations',
+                orm.List(list=skipped_labels).store()
+            )
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines helper functions to calculate the eigenvalues of a tight-binding
+model, which are shared by the in-process model evaluations.
+"""
+
+import multiprocessing
+
+import h5py
+import numpy as np
+import scipy.sparse
+
+__all__ = (
+    'get_hamiltonians', 'calculate_eigenvals', 'calculate_eigenvals_streaming',
+    'iter_eigenvals_chunks', 'get_chunk_size'
+)
+
+#: Number of complex (num_orbitals x num_orbitals) arrays held in memory
+#: per k-point by the streaming calculation: the Hamiltonian, a temporary
+#: array used to accumulate it, and the copy made by the eigensolver.
+ARRAYS_PER_KPOINT = 3
+
+# Lattice vectors and hopping matrices of the model, which are set once in
+# each worker process of the parallel eigenvalue calculation.
+_WORKER_HOP_ARRAYS = {}
+
+
+def calculate_eigenvals(model, kpoints, num_processes=1):
+    """
+    Calculates the eigenvalues of a tight-binding model at the given list
+    of k-points.
+
+    Parameters
+    ----------
+    model : tbmodels.Model
+        The tight-binding model.
+    kpoints : array
+        List of k-points, in reduced coordinates.
+    num_processes : int
+        Number of worker processes. If larger than one, the k-points are
+        split into contiguous shards which are diagonalized in parallel,
+        and the results are merged in the original order. The model is
+        sent to each worker process only once, when it is started.
+    """
+    r_vectors, hop_matrices = _get_hop_arrays(model)
+    kpoints = np.array(kpoints)
+    if num_processes <= 1 or len(kpoints) < 2:
+        return _calculate_eigenvals(r_vectors, hop_matrices, kpoints)
+    shards = np.array_split(kpoints, min(num_processes, len(kpoints)))
+    # The workers are started with 'spawn', because forking the (possibly
+    # multi-threaded) AiiDA daemon process is not safe.
+    with multiprocessing.get_context('spawn').Pool(
+        processes=len(shards),
+        initializer=_init_worker,
+        initargs=(r_vectors, hop_matrices)
+    ) as pool:
+        return np.concatenate(pool.map(_calculate_eigenvals_worker, shards))
+
+
+def _init_worker(r_vectors, hop_matrices):
+    _WORKER_HOP_ARRAYS['r_vectors'] = r_vectors
+    _WORKER_HOP_ARRAYS['hop_matrices'] = hop_matrices
+
+
+def _calculate_eigenvals_worker(kpoints):
+    return _calculate_eigenvals(
+        _WORKER_HOP_ARRAYS['r_vectors'], _WORKER_HOP_ARRAYS['hop_matrices'],
+        kpoints
+    )
+
+
+def get_hamiltonians(model, kpoints):
+    """
+    Constructs the Hamiltonians of a tight-binding model at the given
+    list of k-points, as a single Fourier sum over all hopping matrices.
+    The result is equivalent to ``model.hamilton(kpoints)``.
+    """
+    return _get_hamiltonians(*_get_hop_arrays(model), np.array(kpoints))
+
+
+def _get_hop_arrays(model):
+    """
+    Returns the lattice vectors and the stacked (dense) hopping matrices
+    of the model.
+    """
+    r_vectors = np.array(list(model.hop.keys()))
+    hop_matrices = np.array([
+        hop.toarray() if hasattr(hop, 'toarray') else np.asarray(hop)
+        for hop in model.hop.values()
+    ])
+    return r_vectors, hop_matrices
+
+
+def _get_hamiltonians(r_vectors, hop_matrices, kpoints):
+    phases = np.exp(2j * np.pi * np.dot(kpoints, r_vectors.T))
+    hamiltonians = np.tensordot(phases, hop_matrices, axes=1)
+    return hamiltonians + hamiltonians.conj().transpose((0, 2, 1))
+
+
+def _calculate_eigenvals(r_vectors, hop_matrices, kpoints):
+    return np.linalg.eigvalsh(
+        _get_hamiltonians(r_vectors, hop_matrices, kpoints)
+    )
+
+
+def calculate_eigenvals_streaming(handle, kpoints, memory_budget):
+    """
+    Calculates the eigenvalues of a tight-binding model stored in TBmodels
+    HDF5 format, without loading the full model into memory.
+
+    Parameters
+    ----------
+    handle : str or file
+        Path or binary file handle of the HDF5 file.
+    kpoints : array
+        List of k-points, in reduced coordinates.
+    memory_budget : int
+        Memory (in bytes) available for constructing and diagonalizing the
+        Hamiltonians, and for caching the hopping matrices. The peak memory
+        usage is this budget, plus a single hopping matrix and the
+        resulting eigenvalues.
+    """
+    kpoints = np.array(kpoints)
+    with h5py.File(handle, 'r') as hdf5_file:
+        if 'hop' not in hdf5_file:
+            raise ValueError(
+                'The HDF5 file does not contain a tight-binding model in the '
+                'current TBmodels format.'
+            )
+        eigenvals = np.empty((len(kpoints), int(hdf5_file['size'][()])))
+        for kpoint_slice, eigenvals_chunk in iter_eigenvals_chunks(
+            hdf5_file, kpoints, memory_budget
+        ):
+            eigenvals[kpoint_slice] = eigenvals_chunk
+    return eigenvals
+
+
+def iter_eigenvals_chunks(hdf5_file, kpoints, memory_budget):
+    """
+    Iterates over the eigenvalues of a tight-binding model in chunks of
+    k-points, where the chunk size is determined by the memory budget.
+
+    If the k-points need more than one chunk, and the (dense) hopping
+    matrices fit into half of the memory budget, they are read from the
+    HDF5 file once and kept in memory. The remaining budget is then used
+    for the chunks. Otherwise, the hopping matrices are read from the file
+    one at a time, for each chunk. The model is then read as many times as
+    there are chunks.
+
+    Yields
+    ------
+    kpoint_slice : slice
+        Indices of the k-points in the current chunk.
+    eigenvals : array
+        Eigenvalues of the current chunk.
+    """
+    size = int(hdf5_file['size'][()])
+    chunk_size = get_chunk_size(size, memory_budget)
+    hop_bytes = len(hdf5_file['hop']) * _get_matrix_bytes(size)
+    cached_hop = None
+    if chunk_size < len(kpoints) and 2 * hop_bytes <= memory_budget:
+        cached_hop = list(_iter_hop(hdf5_file))
+        chunk_size = get_chunk_size(size, memory_budget - hop_bytes)
+    for start in range(0, len(kpoints), chunk_size):
+        kpoint_slice = slice(start, start + chunk_size)
+        kpoints_chunk = kpoints[kpoint_slice]
+        shape = (len(kpoints_chunk), size, size)
+        hamiltonians = np.zeros(shape, dtype=complex)
+        tmp = np.empty_like(hamiltonians)
+        if cached_hop is None:
+            hop_terms = _iter_hop(hdf5_file)
+        else:
+            hop_terms = cached_hop
+        for r_vector, hop_matrix in hop_terms:
+            phases = np.exp(2j * np.pi * np.dot(kpoints_chunk, r_vector))
+            np.multiply(phases[:, np.newaxis, np.newaxis], hop_matrix, out=tmp)
+            hamiltonians += tmp
+        np.conjugate(hamiltonians.transpose((0, 2, 1)), out=tmp)
+        hamiltonians += tmp
+        del tmp
+        yield kpoint_slice, np.linalg.eigvalsh(hamiltonians)
+
+
+def get_chunk_size(num_orbitals, memory_budget):
+    """
+    Returns the number of k-points for which the Hamiltonians of a model
+    with the given number of orbitals fit into the memory budget (in
+    bytes). At least one k-point is used per chunk.
+    """
+    kpoint_bytes = ARRAYS_PER_KPOINT * _get_matrix_bytes(num_orbitals)
+    return max(1, int(memory_budget) // kpoint_bytes)
+
+
+def _get_matrix_bytes(num_orbitals):
+    return np.dtype(complex).itemsize * num_orbitals**2
+
+
+def _iter_hop(hdf5_file):
+    """
+    Iterates over the lattice vectors and (dense) hopping matrices stored
+    in the HDF5 file of a tight-binding model.
+    """
+    sparse = bool(hdf5_file['sparse'][()])
+    for hop_group in hdf5_file['hop'].values():
+        r_vector = hop_group['R'][()]
+        if sparse:
+            csr_data = (
+                hop_group['data'][()], hop_group['indices'][()],
+                hop_group['indptr'][()]
+            )
+            shape = tuple(hop_group['shape'][()])
+            sparse_matrix = scipy.sparse.csr_matrix(csr_data, shape=shape)
+            hop_matrix = sparse_matrix.toarray()
+        else:
+            hop_matrix = hop_group['mat'][()]
+        yield r_vector, hop_matrix
@@ -4,8 +4,11 @@ Implements evaluating the tight-binding model by checking the distance
 between its orbitals and the atomic positions.
 """
 
+import itertools
+
 import tbmodels
 import numpy as np
+from scipy.spatial import cKDTree
 
 from aiida import orm
 from aiida.engine import calcfunction, run_get_node
@@ -24,30 +27,78 @@ def get_max_distance(tb_model, structure):
     with tb_model.open(mode='rb') as input_file:
         model = tbmodels.io.load(input_file)
 
-    reference_structure_pmg = structure.get_pymatgen()
-
-    if not np.allclose(model.uc, reference_structure_pmg.lattice.matrix):
+    unit_cell = np.array(structure.cell)
+    if not np.allclose(model.uc, unit_cell):
         return ExitCode(
             300,
             "The model and reference structure unit cells do not match.",
             invalidates_cache=False
         )
 
-    dist_per_orbital = np.min(
-        reference_structure_pmg.lattice.get_all_distances(
-            model.pos, reference_structure_pmg.frac_coords
-        ),
-        axis=-1
+    atom_frac_coords = np.linalg.solve(
+        unit_cell.T,
+        np.array([site.position for site in structure.sites]).T
+    ).T
+    dist_per_orbital = get_nearest_distances(
+        unit_cell, model.pos, atom_frac_coords
     )
     max_dist = np.max(dist_per_orbital)
     return orm.Float(max_dist)
 
 
+def get_nearest_distances(unit_cell, frac_coords, reference_frac_coords):
+    """
+    Get the cartesian distance from each of the given positions to the
+    nearest periodic image of the reference positions.
+
+    The periodic images of the reference positions are stored in a KD-tree,
+    such that only the nearest neighbor of each position is searched
+    instead of calculating the full distance matrix. The positions are
+    first mapped into the unit cell. The images are generated in shells
+    of unit cells, until no closer image can be outside the included
+    shells.
+
+    Parameters
+    ----------
+    unit_cell : array
+        Unit cell, with the lattice vectors as rows.
+    frac_coords : array
+        Positions for which the nearest distance is calculated, in
+        reduced coordinates.
+    reference_frac_coords : array
+        Reference positions (e.g. atoms), in reduced coordinates.
+    """
+    unit_cell = np.array(unit_cell, dtype=float)
+    cart_coords = np.dot(np.mod(frac_coords, 1), unit_cell)
+    reference_frac_coords = np.mod(reference_frac_coords, 1)
+    # Length of the reciprocal lattice vectors (without factor 2 pi),
+    # which is the inverse of the distance between lattice planes.
+    reciprocal_lengths = np.linalg.norm(np.linalg.inv(unit_cell), axis=0)
+    num_shells = np.ones(3, dtype=int)
+    while True:
+        shifts = np.array(
+            list(itertools.product(*[range(-n, n + 1) for n in num_shells]))
+        )
+        images = reference_frac_coords + shifts[:, np.newaxis, :]
+        reference_cart_coords = np.dot(images.reshape(-1, 3), unit_cell)
+        distances, _ = cKDTree(reference_cart_coords).query(cart_coords)
+        # Since both sets of positions are in the unit cell, images
+        # closer than the maximum distance have a shift of at most
+        # 1 + max_dist / (plane distance) in each direction.
+        max_shifts = np.max(distances) * reciprocal_lengths
+        required_shells = 1 + np.floor(max_shifts).astype(int)
+        if np.all(required_shells <= num_shells):
+            return distances
+        num_shells = required_shells
+
+
 class MaximumOrbitalDistanceEvaluation(ModelEvaluationBase):
     """
     Evaluate the maximum distance between model orbitals and crystal
     atoms.
     """
+    COST_CLASS = 0
+
     @classmethod
     def define(cls, spec):
         super().define(spec)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Defines a workflow which evaluates a tight-binding model by comparing its
+bandstructure to a reference bandstructure, without running any
+calculation jobs.
+"""
+
+import tbmodels
+from bands_inspect.eigenvals import EigenvalsData
+from bands_inspect.compare import difference as bi_difference
+
+from aiida import orm
+from aiida.engine import calcfunction, if_
+
+from aiida_tools import check_workchain_step
+from aiida_bands_inspect.convert import from_bands_inspect, to_bands_inspect
+
+from ._base import ModelEvaluationBase
+from ._band_difference import difference_inline, plot_bands_inline
+from ._eigenvals import calculate_eigenvals, calculate_eigenvals_streaming
+
+__all__ = ('VectorizedBandDifferenceEvaluation', )
+
+
+class VectorizedBandDifferenceEvaluation(ModelEvaluationBase):
+    """
+    Evaluates a tight-binding model by comparing its bandstructure to the
+    reference bandstructure. The result is equivalent to the
+    ``BandDifferenceModelEvaluation``, but the bandstructure and difference
+    are calculated in a single calcfunction, where the Hamiltonians at all
+    k-points are constructed at once.
+    """
+    @classmethod
+    def define(cls, spec):
+        super().define(spec)
+        spec.inputs['code_tbmodels'].required = False
+        spec.input(
+            'skip_plot',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether plotting the bandstructures is skipped. '
+            "The plot can be created later from the 'calculated_bands' "
+            'output.'
+        )
+        spec.input(
+            'num_processes',
+            valid_type=orm.Int,
+            required=False,
+            help='Number of worker processes among which the reference '
+            'k-points are distributed for calculating the eigenvalues. It '
+            "cannot be given together with 'memory_budget'."
+        )
+        spec.input(
+            'memory_budget',
+            valid_type=orm.Int,
+            required=False,
+            help='Memory (in MB) available for constructing and diagonalizing '
+            'the Hamiltonians. If given, the tight-binding model is read '
+            'from its HDF5 file one hopping matrix at a time, and the '
+            'k-points are processed in chunks that fit into this budget. '
+            'If more than one chunk is needed, the hopping matrices are '
+            'kept in memory if they fit into half of the budget. Otherwise, '
+            'they are read from the file again for each chunk. '
+            "It cannot be given together with 'num_processes'."
+        )
+        spec.input(
+            'precomputed_bands',
+            valid_type=orm.BandsData,
+            required=False,
+            help='Bandstructure of the tight-binding model, at the k-points '
+            'of the reference bandstructure. If given, it is used instead of '
+            'calculating the bandstructure.'
+        )
+
+        spec.output(
+            'plot',
+            valid_type=orm.SinglefileData,
+            required=False,
+            help='Plot comparing the reference and evaluated bandstructure.'
+        )
+        spec.output(
+            'calculated_bands',
+            valid_type=orm.BandsData,
+            help='Bandstructure of the tight-binding model, at the k-points '
+            'of the reference bandstructure.'
+        )
+
+        spec.outline(
+            cls.calculate_difference,
+            if_(cls.should_plot)(cls.plot_bands)
+        )
+        spec.inputs.validator = cls._validate_inputs
+
+    @staticmethod
+    def _validate_inputs(inputs, ctx=None):  # pylint: disable=unused-argument,inconsistent-return-statements
+        """
+        Checks that 'num_processes' and 'memory_budget' are not given
+        together.
+        """
+        if 'num_processes' in inputs and 'memory_budget' in inputs:
+            return "The 'num_processes' and 'memory_budget' inputs cannot be given together."
+
+    def should_plot(self):
+        return not self.inputs.skip_plot.value
+
+    @check_workchain_step
+    def calculate_difference(self):
+        """
+        Calculate the bandstructure of the tight-binding model, and its
+        difference to the reference bandstructure.
+        """
+        if 'precomputed_bands' in self.inputs:
+            self.report('Calculating difference to the precomputed bands.')
+            self.ctx.calculated_bands = self.inputs.precomputed_bands
+            self.out(
+                'cost_value',
+                difference_inline(
+                    bands1=self.inputs.reference_bands,
+                    bands2=self.inputs.precomputed_bands
+                )
+            )
+            self.out('calculated_bands', self.inputs.precomputed_bands)
+            return
+        self.report('Calculating bandstructure and difference.')
+        inputs = {}
+        for key in ['num_processes', 'memory_budget']:
+            if key in self.inputs:
+                inputs[key] = self.inputs[key]
+        result = band_difference_inline(
+            tb_model=self.inputs.tb_model,
+            reference_bands=self.inputs.reference_bands,
+            **inputs
+        )
+        self.ctx.calculated_bands = result['bands']
+        self.out('cost_value', result['difference'])
+        self.out('calculated_bands', result['bands'])
+
+    @check_workchain_step
+    def plot_bands(self):
+        """
+        Plot the tight-binding and reference bandstructures.
+        """
+        self.report('Plotting bandstructures.')
+        self.out(
+            'plot',
+            plot_bands_inline(
+                bands1=self.inputs.reference_bands,
+                bands2=self.ctx.calculated_bands
+            )
+        )
+
+
+@calcfunction
+def band_difference_inline(
+    tb_model, reference_bands, num_processes=None, memory_budget=None
+):
+    """
+    Calculates the bandstructure of a tight-binding model at the k-points
+    of the reference bands, and its difference to the reference bands as
+    calculated by ``bands_inspect``. This is equivalent to running the
+    ``tbmodels.eigenvals`` and ``bands_inspect.difference`` calculations.
+    If 'num_processes' is given, the k-points are distributed among that
+    many worker processes. If 'memory_budget' (in MB) is given, the model
+    is not loaded, and the Hamiltonians are constructed in chunks of
+    k-points.
+    """
+    reference = to_bands_inspect(reference_bands)
+    kpoints = reference.kpoints.kpoints_explicit
+    if memory_budget is not None:
+        with tb_model.open(mode='rb') as input_file:
+            eigenvals = calculate_eigenvals_streaming(
+                input_file, kpoints, memory_budget=memory_budget.value * 10**6
+            )
+    else:
+        with tb_model.open(mode='rb') as input_file:
+            model = tbmodels.io.load(input_file)
+        eigenvals = calculate_eigenvals(
+            model,
+            kpoints,
+            num_processes=1 if num_processes is None else num_processes.value
+        )
+    calculated = EigenvalsData(kpoints=reference.kpoints, eigenvals=eigenvals)
+    difference = bi_difference.calculate(reference, calculated)
+    return {
+        'difference': orm.Float(difference),
+        'bands': from_bands_inspect(calculated)
+    }
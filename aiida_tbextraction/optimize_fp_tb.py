@@ -19,7 +19,8 @@ from aiida_tools.process_inputs import PROCESS_INPUT_KWARGS, load_object
 from .energy_windows.window_search import WindowSearch
 from .fp_run import FirstPrinciplesRunBase
 from ._calcfunctions import merge_nested_dict, slice_bands_inline
-from .energy_windows.auto_guess import get_initial_window_inline
+from .energy_windows.auto_guess import get_initial_window_inline, shift_window_inline
+from .energy_windows.band_index import get_band_index_inline
 
 __all__ = ('OptimizeFirstPrinciplesTightBinding', )
 
@@ -49,6 +50,7 @@ class OptimizeFirstPrinciplesTightBinding(WorkChain):
                 'reference_structure',
                 'reference_bands',
                 'wannier_bands',
+                'band_index',
                 'wannier.parameters',
                 'wannier.local_input_folder',
                 'wannier.remote_input_folder',
@@ -67,6 +69,26 @@ class OptimizeFirstPrinciplesTightBinding(WorkChain):
             required=False
         )
 
+        spec.input(
+            'warm_start_window',
+            valid_type=orm.List,
+            required=False,
+            help='Optimal window of a related calculation (e.g. for a '
+            'different strain), which is used to create the initial window. '
+            "The window is shifted by the change in band edges between the "
+            "'warm_start_wannier_bands' and the Wannier bands of this "
+            "calculation. If the 'warm_start_wannier_bands' are not given, "
+            "the window is used without shift. Is ignored if the "
+            "'initial_window' is given."
+        )
+        spec.input(
+            'warm_start_wannier_bands',
+            valid_type=orm.BandsData,
+            required=False,
+            help="Wannier bands of the calculation from which the "
+            "'warm_start_window' was obtained."
+        )
+
         spec.input(
             'fp_run_workflow',
             help='Workflow which executes the first-principles calculations',
@@ -87,6 +109,12 @@ class OptimizeFirstPrinciplesTightBinding(WorkChain):
         )
 
         spec.expose_outputs(WindowSearch)
+        spec.output(
+            'wannier_bands',
+            valid_type=orm.BandsData,
+            required=False,
+            help='Bands calculated for the Wannier run.'
+        )
         spec.outputs.dynamic = True
 
         spec.outline(cls.fp_run, cls.run_window_search, cls.finalize)
@@ -154,17 +182,29 @@ class OptimizeFirstPrinciplesTightBinding(WorkChain):
 
         self.report('Get or guess initial window.')
         wannier_bands = fp_run_outputs.wannier_bands
+        band_index = get_band_index_inline(wannier_bands=wannier_bands)
+        slice_reference_bands = self.inputs.get(
+            'slice_reference_bands',
+            orm.List(list=list(range(wannier_bands.get_bands().shape[1])))
+        )
         initial_window = self.inputs.get('initial_window', None)
         if initial_window is None:
-            initial_window = get_initial_window_inline(
-                wannier_bands=wannier_bands,
-                slice_reference_bands=self.inputs.get(
-                    'slice_reference_bands',
-                    orm.List(
-                        list=list(range(wannier_bands.get_bands().shape[1]))
-                    )
+            if 'warm_start_window' not in self.inputs:
+                initial_window = get_initial_window_inline(
+                    wannier_bands=wannier_bands,
+                    slice_reference_bands=slice_reference_bands
+                )
+            elif 'warm_start_wannier_bands' not in self.inputs:
+                initial_window = self.inputs.warm_start_window
+            else:
+                self.report('Shifting window from warm start.')
+                initial_window = shift_window_inline(
+                    window=self.inputs.warm_start_window,
+                    previous_wannier_bands=self.inputs.
+                    warm_start_wannier_bands,
+                    wannier_bands=wannier_bands,
+                    slice_reference_bands=slice_reference_bands
                 )
-            )
 
         self.report("Starting WindowSearch workflow.")
         return ToContext(
@@ -174,6 +214,7 @@ class OptimizeFirstPrinciplesTightBinding(WorkChain):
                 reference_structure=self.inputs.structure,
                 wannier=wannier_namespace_inputs,
                 wannier_bands=wannier_bands,
+                band_index=band_index,
                 initial_window=initial_window,
                 **inputs
             )
@@ -186,3 +227,4 @@ class OptimizeFirstPrinciplesTightBinding(WorkChain):
         """
         self.report("Adding outputs from WindowSearch workflow.")
         self.out_many(get_outputs_dict(self.ctx.window_search))
+        self.out('wannier_bands', self.ctx.window_search.inputs.wannier_bands)
@@ -6,7 +6,10 @@
 Defines the workflow to optimize tight-binding models from DFT inputs with different strain values.
 """
 
-from aiida.engine import WorkChain, ToContext
+import itertools
+
+from aiida import orm
+from aiida.engine import WorkChain, ToContext, if_, while_
 
 from aiida_tools import check_workchain_step, get_outputs_dict
 
@@ -29,15 +32,44 @@ class OptimizeStrainedFirstPrinciplesTightBinding(WorkChain):
         spec.expose_inputs(ApplyStrainsWithSymmetry)
         spec.expose_inputs(
             OptimizeFirstPrinciplesTightBinding,
-            exclude=('structure', 'symmetries')
+            exclude=(
+                'structure', 'symmetries', 'warm_start_window',
+                'warm_start_wannier_bands'
+            )
         )
         # Workaround for plumpy issue #135 (https://github.com/aiidateam/plumpy/issues/135)
         spec.inputs['fp_run'].dynamic = True
         spec.inputs['model_evaluation'].dynamic = True
 
+        spec.input(
+            'warm_start',
+            valid_type=orm.Bool,
+            default=lambda: orm.Bool(False),
+            help='Determines whether the window search for each strain is '
+            'started from the optimal window of a neighbouring strain. The '
+            'strains are then run starting from the strain closest to zero, '
+            "outward in both directions. The 'initial_window' is used only "
+            'for the first strain.'
+        )
+        spec.input(
+            'warm_start_simplex_size',
+            valid_type=orm.Float,
+            required=False,
+            help="Value of the 'initial_simplex_size' for the warm-started "
+            "window searches. If not given, the same value as for the first "
+            "strain is used."
+        )
+
         spec.outputs.dynamic = True
 
-        spec.outline(cls.run_strain, cls.run_optimize_dft_tb, cls.finalize)
+        spec.outline(
+            cls.run_strain,
+            if_(cls.warm_start)(
+                cls.create_strain_order,
+                while_(cls.has_remaining_strains
+                       )(cls.run_optimize_dft_tb_warm_start)
+            ).else_(cls.run_optimize_dft_tb), cls.finalize
+        )
 
     @check_workchain_step
     def run_strain(self):
@@ -70,6 +102,102 @@ class OptimizeStrainedFirstPrinciplesTightBinding(WorkChain):
             )
         return ToContext(**tocontext_kwargs)
 
+    @check_workchain_step
+    def warm_start(self):
+        """
+        Check if the strains are run with warm starts.
+        """
+        return self.inputs.warm_start.value
+
+    @check_workchain_step
+    def create_strain_order(self):
+        """
+        Determine the order in which the strains are run. Starting from the
+        strain closest to zero, the strains are grouped into steps which
+        contain the next strain in the positive and in the negative
+        direction.
+        """
+        strains = sorted(self.inputs.strain_strengths, key=abs)
+        first_strain = strains[0]
+        positive = sorted(s for s in strains[1:] if s >= first_strain)
+        negative = sorted((s for s in strains[1:] if s < first_strain),
+                          reverse=True)
+        self.ctx.strain_steps = [[first_strain]] + [[
+            s for s in step if s is not None
+        ] for step in itertools.zip_longest(positive, negative)]
+        self.ctx.finished_strains = []
+        self.ctx.running_strains = []
+
+    @check_workchain_step
+    def has_remaining_strains(self):
+        """
+        Check if there are strains which have not been run yet.
+        """
+        return bool(self.ctx.strain_steps)
+
+    @check_workchain_step
+    def run_optimize_dft_tb_warm_start(self):
+        """
+        Run the tight-binding optimization for the next step of strains,
+        starting from the optimal window of the closest successfully
+        finished strain.
+        """
+        # Only successful calculations are used for warm starts. If no
+        # strain has succeeded yet, the optimization is started cold.
+        for strain in self.ctx.running_strains:
+            if self.ctx['tbextraction' + get_suffix(strain)].is_finished_ok:
+                self.ctx.finished_strains.append(strain)
+            else:
+                self.report(
+                    'Calculation for strain {} failed, it is not used as '
+                    'warm start.'.format(strain)
+                )
+        self.ctx.running_strains = self.ctx.strain_steps.pop(0)
+        apply_strains_outputs = get_outputs_dict(self.ctx.apply_strains)
+        tocontext_kwargs = {}
+        for strain in self.ctx.running_strains:
+            key = 'tbextraction' + get_suffix(strain)
+            structure_key = get_structure_key(strain)
+            symmetries_key = get_symmetries_key(strain)
+            inputs = self.exposed_inputs(OptimizeFirstPrinciplesTightBinding)
+            if self.ctx.finished_strains:
+                previous_strain = _get_closest(
+                    self.ctx.finished_strains, strain
+                )
+                self.report(
+                    'Starting strain {} from the result of strain {}.'.format(
+                        strain, previous_strain
+                    )
+                )
+                inputs.pop('initial_window', None)
+                inputs.update(
+                    self._get_warm_start_inputs(
+                        self.ctx['tbextraction' + get_suffix(previous_strain)]
+                    )
+                )
+            tocontext_kwargs[key] = self.submit(
+                OptimizeFirstPrinciplesTightBinding,
+                structure=apply_strains_outputs[structure_key],
+                symmetries=apply_strains_outputs[symmetries_key],
+                **inputs
+            )
+        return ToContext(**tocontext_kwargs)
+
+    def _get_warm_start_inputs(self, previous_calc):
+        """
+        Get the inputs for starting the optimization from the result of the
+        given calculation.
+        """
+        inputs = dict(
+            warm_start_window=previous_calc.outputs.window,
+            warm_start_wannier_bands=previous_calc.outputs.wannier_bands
+        )
+        if 'warm_start_simplex_size' in self.inputs:
+            inputs['initial_simplex_size'] = (
+                self.inputs.warm_start_simplex_size
+            )
+        return inputs
+
     @check_workchain_step
     def finalize(self):
         """
@@ -80,3 +208,7 @@ class OptimizeStrainedFirstPrinciplesTightBinding(WorkChain):
             calc = self.ctx['tbextraction' + suffix]
             for label, node in get_outputs_dict(calc).items():
                 self.out(label + suffix, node)
+
+
+def _get_closest(values, target):
+    return min(values, key=lambda value: abs(value - target))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Tests for the band count index used to check the validity of energy windows.
+"""
+
+import pytest
+import numpy as np
+
+from aiida import orm
+
+from aiida_tbextraction.energy_windows.band_index import BandCountIndex, get_band_index_inline
+
+
+@pytest.fixture
+def sample_bands():
+    """
+    Returns random band energies, with degenerate values.
+    """
+    rng = np.random.RandomState(42)
+    return np.sort(np.round(5 * rng.randn(30, 12), 1), axis=-1)
+
+
+@pytest.mark.parametrize(
+    'limits', [(-3, 3), (3, -3), (-0.5, -0.5), (-100, 100), (20, 30),
+               (0.1, 2.3)]
+)
+def test_count_bands(sample_bands, limits):  # pylint: disable=redefined-outer-name
+    """
+    Check that the band count matches the direct count.
+    """
+    lower, upper = sorted(limits)
+    expected = np.sum(
+        np.logical_and(lower <= sample_bands, sample_bands <= upper), axis=-1
+    )
+    assert np.all(
+        BandCountIndex(sample_bands).count_bands(*limits) == expected
+    )
+
+
+def test_count_bands_at_band_energies(sample_bands):  # pylint: disable=redefined-outer-name
+    """
+    Check that the band count is exact when the limits coincide with
+    band energies.
+    """
+    index = BandCountIndex(sample_bands)
+    for lower, upper in zip(sample_bands[0], sample_bands[-1]):
+        lower, upper = sorted([lower, upper])
+        expected = np.sum(
+            np.logical_and(lower <= sample_bands, sample_bands <= upper),
+            axis=-1
+        )
+        assert np.all(index.count_bands(lower, upper) == expected)
+
+
+def test_index_node(configure, sample_bands):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Create the index node from a BandsData, and load it again.
+    """
+    bands = orm.BandsData()
+    bands.set_kpoints(np.zeros((len(sample_bands), 3)))
+    bands.set_bands(sample_bands[:, ::-1])
+    index_node = get_band_index_inline(wannier_bands=bands)
+    index = BandCountIndex.from_node(index_node)
+    assert np.allclose(index.sorted_bands, sample_bands)
+
+
+def test_index_spin_polarized(configure, sample_bands):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Check that creating the index from spin-polarized bands raises an
+    error.
+    """
+    bands = orm.BandsData()
+    bands.set_kpoints(np.zeros((len(sample_bands), 3)))
+    bands.set_bands(np.array([sample_bands, sample_bands]))
+    with pytest.raises(ValueError):
+        BandCountIndex.from_bands(bands)
+
+
+@pytest.mark.parametrize(
+    'window', [[-4, -2, 2, 4], [4, 2, -2, -4], [-20, -8, 8, 20],
+               [-0.5, -0.1, 0.1, 0.5], [-1, -1, -1, -1]]
+)
+@pytest.mark.parametrize('num_wann', [2, 4, 6])
+def test_project_window(sample_bands, window, num_wann):  # pylint: disable=redefined-outer-name
+    """
+    Check that projected windows are valid, and that valid windows are not
+    changed by the projection.
+    """
+    index = BandCountIndex(sample_bands)
+    projected_window = index.project_window(window, num_wann=num_wann)
+    assert projected_window is not None
+    assert index.is_valid_window(projected_window, num_wann=num_wann)
+    if index.is_valid_window(window, num_wann=num_wann):
+        assert np.allclose(projected_window, window)
+
+
+@pytest.mark.parametrize('window', [[-4, -2, 2, 4], [-20, -8, 8, 20]])
+@pytest.mark.parametrize('num_wann', [2, 4, 6])
+def test_create_simplex(sample_bands, window, num_wann):  # pylint: disable=redefined-outer-name
+    """
+    Check that the vertices of the adapted simplex are valid windows, and
+    that the simplex is not degenerate.
+    """
+    index = BandCountIndex(sample_bands)
+    window = index.project_window(window, num_wann=num_wann)
+    simplex = index.create_simplex(window, num_wann=num_wann, size=0.5)
+    assert len(simplex) == 5
+    for vertex in simplex:
+        assert index.is_valid_window(vertex, num_wann=num_wann)
+    assert abs(np.linalg.det(np.array(simplex[1:]) - simplex[0])) > 0
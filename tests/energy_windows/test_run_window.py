@@ -19,6 +19,10 @@ from aiida_bands_inspect.io import read
 
 from aiida_tbextraction.model_evaluation import BandDifferenceModelEvaluation
 from aiida_tbextraction.energy_windows.run_window import RunWindow
+from aiida_tbextraction.energy_windows.stage_folder import StageFolderCalculation
+from aiida_tbextraction.energy_windows.window_cache import (
+    STATUS_EXTRA, evict_window_cache, get_window_cache_statistics
+)
 
 
 @pytest.fixture
@@ -127,6 +131,17 @@ def test_run_window(
     )
     assert node.is_finished_ok
     assert all(key in result for key in ['cost_value', 'tb_model', 'plot'])
+    telemetry = result['telemetry'].get_dict()
+    assert telemetry['valid']
+    assert telemetry['cost_value'] == result['cost_value'].value
+    expected_stages = ['wannier90', 'parse', 'evaluation', 'total']
+    if slice_:
+        expected_stages.append('slice')
+    if symmetries:
+        expected_stages.append('symmetrize')
+    assert sorted(telemetry['durations']) == sorted(expected_stages)
+    assert all(duration >= 0 for duration in telemetry['durations'].values())
+    assert telemetry['pks']['run_window'] == node.pk
 
 
 @pytest.mark.parametrize(
@@ -148,3 +163,88 @@ def test_run_window_invalid(
     )
     assert node.is_finished_ok
     assert result['cost_value'] > 1e10
+    assert not result['telemetry'].get_dict()['valid']
+
+
+def test_run_window_cached(configure_with_daemon, run_window_builder):  # pylint:disable=unused-argument,redefined-outer-name
+    """
+    Runs the workflow twice with the window cache enabled, and checks that
+    the second run re-uses the result of the first.
+    """
+    evict_window_cache(max_entries=0)
+    builder = run_window_builder([-4.5, -4, 6.5, 16],
+                                 slice_=True,
+                                 symmetries=True)
+    builder.use_window_cache = orm.Bool(True)
+    result_first, node_first = run_get_node(builder)
+    assert node_first.is_finished_ok
+    assert node_first.get_extra(STATUS_EXTRA) == 'miss'
+
+    builder.window = orm.List(list=[-4.5, -4, 6.5, 16.0001])
+    result_second, node_second = run_get_node(builder)
+    assert node_second.is_finished_ok
+    assert node_second.get_extra(STATUS_EXTRA) == 'hit'
+    assert result_second['tb_model'].uuid == result_first['tb_model'].uuid
+    assert result_second['cost_value'].uuid == result_first['cost_value'].uuid
+
+    assert get_window_cache_statistics()['hit_rate'] > 0
+    assert evict_window_cache(max_entries=0) == 2
+
+
+def test_run_window_cached_staged(configure_with_daemon, run_window_builder):  # pylint:disable=unused-argument,redefined-outer-name
+    """
+    Checks that a run with a staged input folder re-uses the cached result
+    of a run with the original input folder.
+    """
+    evict_window_cache(max_entries=0)
+    builder = run_window_builder([-4.5, -4, 6.5, 16],
+                                 slice_=True,
+                                 symmetries=True)
+    builder.use_window_cache = orm.Bool(True)
+    result_first, node_first = run_get_node(builder)
+    assert node_first.is_finished_ok
+
+    staged_result, staged_node = run_get_node(
+        StageFolderCalculation,
+        folder=builder.wannier.local_input_folder,
+        code=builder.wannier.code,
+        metadata={
+            'options': {
+                'resources': {
+                    'num_machines': 1,
+                    'tot_num_mpiprocs': 1
+                },
+                'withmpi': False
+            }
+        }
+    )
+    assert staged_node.is_finished_ok
+    builder.wannier.pop('local_input_folder')
+    builder.wannier.remote_input_folder = staged_result['remote_folder']
+    result_second, node_second = run_get_node(builder)
+    assert node_second.is_finished_ok
+    assert node_second.get_extra(STATUS_EXTRA) == 'hit'
+    assert result_second['tb_model'].uuid == result_first['tb_model'].uuid
+    evict_window_cache(max_entries=0)
+
+
+def test_run_window_halving(configure_with_daemon, run_window_builder):  # pylint:disable=unused-argument,redefined-outer-name
+    """
+    Runs the workflow on a subset of the reference k-points, and then
+    re-evaluates the resulting tight-binding model on all k-points.
+    """
+    builder = run_window_builder([-4.5, -4, 6.5, 16],
+                                 slice_=True,
+                                 symmetries=True)
+    builder.reference_kpoint_stride = orm.Int(2)
+    result_partial, node_partial = run_get_node(builder)
+    assert node_partial.is_finished_ok
+
+    builder = run_window_builder([-4.5, -4, 6.5, 16],
+                                 slice_=True,
+                                 symmetries=True)
+    builder.tb_model = result_partial['tb_model']
+    result_full, node_full = run_get_node(builder)
+    assert node_full.is_finished_ok
+    assert result_full['tb_model'].uuid == result_partial['tb_model'].uuid
+    assert 'cost_value' in result_full
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Tests for the surrogate model used to screen energy windows.
+"""
+
+import numpy as np
+
+from aiida_tbextraction.energy_windows.surrogate import GaussianProcessSurrogate
+
+
+def test_surrogate_interpolation():
+    """
+    Check that the surrogate reproduces the training data, and that the
+    uncertainty grows away from it.
+    """
+    rng = np.random.RandomState(42)
+    windows = rng.uniform(-5, 5, size=(20, 4))
+    values = np.sum(windows**2, axis=-1)
+    surrogate = GaussianProcessSurrogate(windows, values)
+
+    mean, std = surrogate.predict(windows)
+    assert np.allclose(mean, values, atol=0.5)
+    assert np.all(std < 1)
+
+    _, std_far = surrogate.predict([[100., 100., 100., 100.]])
+    assert std_far[0] > np.max(std)
@@ -8,6 +8,7 @@ Test the workflow which searches for the optimal energy window.
 
 import os
 import itertools
+import functools
 
 import pytest
 import pymatgen
@@ -15,10 +16,13 @@ import numpy as np
 
 from aiida import orm
 from aiida.orm import load_node
-from aiida.engine import run, submit
+from aiida.engine import run, run_get_node, submit
 from aiida_bands_inspect.io import read
 
-from aiida_tbextraction.energy_windows.window_search import WindowSearch
+from aiida_tbextraction.energy_windows.window_search import WindowSearch, _create_displaced_simplex, _project_window
+from aiida_tbextraction.energy_windows.band_index import BandCountIndex
+from aiida_tbextraction.energy_windows.engines import MultiDirectionalSearch
+from aiida_tbextraction.energy_windows.run_window import get_called_telemetry
 from aiida_tbextraction.model_evaluation import BandDifferenceModelEvaluation
 
 
@@ -114,6 +118,202 @@ def test_window_search(configure_with_daemon, window_search_builder):  # pylint:
     assert all(
         key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
     )
+    telemetry = result['telemetry'].get_list()
+    assert telemetry
+    assert result['window'].get_list() in [
+        record['window'] for record in telemetry
+    ]
+    assert min(record['cost_value']
+               for record in telemetry) == result['cost_value'].value
+
+
+def test_window_search_called_telemetry(
+    configure_with_daemon, window_search_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Check that the telemetry records of the evaluations can be collected
+    from the window search node.
+    """
+    result, node = run_get_node(window_search_builder)
+    assert node.is_finished_ok
+    assert get_called_telemetry(node) == result['telemetry'].get_list()
+
+
+def test_window_search_parallel_engine(
+    configure_with_daemon, window_search_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search with the multi-directional search engine, which
+    evaluates multiple windows in parallel.
+    """
+    window_search_builder.engine = MultiDirectionalSearch
+    window_search_builder.engine_kwargs = orm.Dict(dict={'max_iter': 2})
+    result = run(window_search_builder)
+    assert all(
+        key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
+    )
+
+
+def test_window_search_halving(configure_with_daemon, window_search_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search with successive halving of the window evaluations.
+    """
+    window_search_builder.engine = MultiDirectionalSearch
+    window_search_builder.engine_kwargs = orm.Dict(dict={'max_iter': 2})
+    window_search_builder.halving_strides = orm.List(list=[2])
+    result = run(window_search_builder)
+    assert all(
+        key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
+    )
+
+
+def test_window_search_projected(configure_with_daemon, window_search_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search with an invalid initial window, which is projected
+    onto the region of valid windows.
+    """
+    window_search_builder.initial_window = orm.List(list=[6.5, -4, 16, -4.5])
+    window_search_builder.project_windows = orm.Bool(True)
+    window_search_builder.engine = MultiDirectionalSearch
+    window_search_builder.engine_kwargs = orm.Dict(dict={'max_iter': 2})
+    result = run(window_search_builder)
+    window = result['window'].get_list()
+    assert window == sorted(window)
+    assert result['cost_value'] < 1e10
+
+
+def test_window_search_projected_nelder_mead(
+    configure_with_daemon, window_search_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search with the default (Nelder-Mead) engine and an
+    invalid initial window, and check that only valid windows are
+    evaluated.
+    """
+    window_search_builder.initial_window = orm.List(list=[6.5, -4, 16, -4.5])
+    result = run(window_search_builder)
+    assert result['cost_value'] < 1e10
+    for record in result['telemetry'].get_list():
+        assert record['window'] == sorted(record['window'])
+
+
+def test_create_displaced_simplex():
+    """
+    Check that the initial simplex is not degenerate if the projection maps
+    a displaced vertex onto the direction of another vertex.
+    """
+    band_index = BandCountIndex(np.array([[0.8, 1.3]]))
+    project = functools.partial(
+        _project_window, band_index=band_index, num_wann=1
+    )
+    window = project([-1.2, 0.3, 1.4, 1.5])
+    simplex = _create_displaced_simplex(
+        window, simplex_dist=0.5, project=project
+    )
+    assert np.linalg.matrix_rank(np.array(simplex[1:]) - simplex[0]) == 4
+    assert all(
+        band_index.is_valid_window(vertex, num_wann=1) for vertex in simplex
+    )
+
+
+def test_window_search_preprocessed_symmetries(
+    configure_with_daemon, window_search_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search where the symmetries are pre-processed once, and
+    shared between all window evaluations.
+    """
+    window_search_builder.preprocess_symmetries = orm.Bool(True)
+    window_search_builder.fuse_tbmodels = orm.Bool(True)
+    window_search_builder.engine = MultiDirectionalSearch
+    window_search_builder.engine_kwargs = orm.Dict(dict={'max_iter': 2})
+    result = run(window_search_builder)
+    assert all(
+        key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
+    )
+    symmetries_uuids = {
+        load_node(record['pks']['run_window']).inputs.symmetries.uuid
+        for record in result['telemetry'].get_list()
+    }
+    assert len(symmetries_uuids) == 1
+    assert window_search_builder.symmetries.uuid not in symmetries_uuids
+
+
+@pytest.mark.parametrize('stage_input_folder', [False, True])
+def test_window_search_gauge_restart(
+    configure_with_daemon, window_search_builder, stage_input_folder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search where Wannier90 is restarted from the gauge of the
+    nearest evaluated window, and check that the restarted calculations
+    use a complete local input folder instead of a remote input folder.
+    """
+    input_folder = window_search_builder.wannier.local_input_folder
+    window_search_builder.gauge_restart = orm.Bool(True)
+    window_search_builder.stage_input_folder = orm.Bool(stage_input_folder)
+    window_search_builder.engine = MultiDirectionalSearch
+    window_search_builder.engine_kwargs = orm.Dict(dict={'max_iter': 2})
+    result = run(window_search_builder)
+    assert all(
+        key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
+    )
+    run_window_nodes = [
+        load_node(record['pks']['run_window'])
+        for record in result['telemetry'].get_list()
+    ]
+    restarted_nodes = [
+        node for node in run_window_nodes
+        if 'restart_checkpoint_folder' in node.inputs
+    ]
+    assert restarted_nodes
+    for node in restarted_nodes:
+        wannier_calc, = [
+            child for child in node.called_descendants
+            if child.process_label == 'Wannier90Calculation'
+        ]
+        assert 'remote_input_folder' not in wannier_calc.inputs
+        restart_input_folder = wannier_calc.inputs.local_input_folder
+        assert sorted(restart_input_folder.list_object_names()
+                      ) == sorted(input_folder.list_object_names())
+        assert restart_input_folder.get_object_content(
+            'aiida.amn'
+        ) != input_folder.get_object_content('aiida.amn')
+
+
+def test_window_search_staged(configure_with_daemon, window_search_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search where the Wannier90 input folder is uploaded only
+    once, and shared between all window evaluations.
+    """
+    window_search_builder.stage_input_folder = orm.Bool(True)
+    result = run(window_search_builder)
+    assert all(
+        key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
+    )
+    remote_folder_uuids = {
+        load_node(record['pks']['run_window']
+                  ).inputs.wannier__remote_input_folder.uuid
+        for record in result['telemetry'].get_list()
+    }
+    assert len(remote_folder_uuids) == 1
+
+
+def test_window_search_deferred_plot(
+    configure_with_daemon, window_search_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run a window_search where only the optimal model is plotted.
+    """
+    window_search_builder.deferred_plot = orm.Bool(True)
+    result = run(window_search_builder)
+    assert all(
+        key in result for key in ['cost_value', 'tb_model', 'window', 'plot']
+    )
+    assert all(
+        'plot' not in load_node(record['pks']['run_window']
+                                ).get_outgoing().all_link_labels()
+        for record in result['telemetry'].get_list()
+    )
 
 
 def test_window_search_submit(
@@ -40,3 +40,59 @@ def test_bandevaluation(configure_with_daemon, band_difference_builder):  # pyli
     builder = band_difference_builder
     output = run(builder)
     assert np.isclose(output['cost_value'].value, 0.)
+
+
+def test_bandevaluation_local(configure_with_daemon, band_difference_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the band evaluation workflow with in-process calculations.
+    """
+    builder = band_difference_builder
+    del builder.code_bands_inspect
+    builder.local_execution = orm.Bool(True)
+    output = run(builder)
+    assert np.isclose(output['cost_value'].value, 0.)
+    assert 'plot' in output
+
+
+def test_bandevaluation_local_sharded(
+    configure_with_daemon, band_difference_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the band evaluation workflow with in-process calculations, where
+    the eigenvalues are calculated by multiple worker processes.
+    """
+    builder = band_difference_builder
+    del builder.code_bands_inspect
+    builder.local_execution = orm.Bool(True)
+    builder.num_processes = orm.Int(2)
+    output = run(builder)
+    assert np.isclose(output['cost_value'].value, 0.)
+
+
+def test_bandevaluation_local_sharded_streaming(
+    configure_with_daemon, band_difference_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Check that giving both 'num_processes' and 'memory_budget' is rejected.
+    """
+    builder = band_difference_builder
+    del builder.code_bands_inspect
+    builder.local_execution = orm.Bool(True)
+    builder.num_processes = orm.Int(2)
+    builder.memory_budget = orm.Int(1)
+    with pytest.raises(ValueError):
+        run(builder)
+
+
+def test_bandevaluation_skip_plot(
+    configure_with_daemon, band_difference_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the band evaluation workflow without creating the plot.
+    """
+    builder = band_difference_builder
+    builder.skip_plot = orm.Bool(True)
+    output = run(builder)
+    assert np.isclose(output['cost_value'].value, 0.)
+    assert 'calculated_bands' in output
+    assert 'plot' not in output
@@ -8,11 +8,13 @@ Tests for the band difference model evaluation workflow.
 
 import pytest
 import numpy as np
+import tbmodels
 
 from aiida import orm
 from aiida.engine.launch import run_get_node, submit
 
-from aiida_tbextraction.model_evaluation import CombinedEvaluation, BandDifferenceModelEvaluation
+from aiida_tbextraction.model_evaluation import CombinedEvaluation, BandDifferenceModelEvaluation, MaximumOrbitalDistanceEvaluation, VectorizedBandDifferenceEvaluation
+from aiida_tbextraction.model_evaluation._vectorized_band_difference import band_difference_inline
 from aiida_bands_inspect.io import read
 
 
@@ -90,3 +92,157 @@ def test_combined_evaluation_submit(
     assert 'extra_outputs__eval2__cost_value' in res
     assert 'extra_outputs__eval1__plot' in res
     assert 'extra_outputs__eval2__plot' in res
+
+
+@pytest.mark.parametrize(
+    'rejection_threshold, skipped', [(-1., ['eval2']), (1e3, [])]
+)
+def test_combined_evaluation_staged(
+    configure_with_daemon,  # pylint: disable=unused-argument
+    get_combined_evaluation_builder,  # pylint: disable=redefined-outer-name
+    rejection_threshold,
+    skipped
+):
+    """
+    Run the combined evaluation workflow in staged mode, where the band
+    difference evaluation is skipped if the cheaper orbital distance
+    evaluation exceeds the rejection threshold.
+    """
+    builder = get_combined_evaluation_builder()
+    builder.process_classes = [
+        BandDifferenceModelEvaluation, MaximumOrbitalDistanceEvaluation
+    ]
+    builder.labels = orm.List(list=['eval2', 'eval1'])
+    builder.extra_inputs = {
+        'eval2': {
+            'code_bands_inspect': orm.Code.get_from_string('bands_inspect')
+        }
+    }
+    builder.rejection_threshold = orm.Float(rejection_threshold)
+    res, node = run_get_node(builder)
+    assert node.is_finished_ok
+    assert 'cost_value' in res['extra_outputs']['eval1']
+    assert res['rejected'].value == bool(skipped)
+    if skipped:
+        assert res['skipped_evaluations'].get_list() == skipped
+        assert 'eval2' not in res['extra_outputs']
+    else:
+        assert 'skipped_evaluations' not in res
+        assert 'cost_value' in res['extra_outputs']['eval2']
+
+
+def test_combined_evaluation_rejection_cost(
+    configure_with_daemon,  # pylint: disable=unused-argument
+    get_combined_evaluation_builder,  # pylint: disable=redefined-outer-name
+    shared_datadir,
+    tmp_path
+):
+    """
+    Check that a rejected model, whose partial cost is below the full cost
+    of an accepted model, is not preferred over the accepted model.
+    """
+    reference_bands = read(shared_datadir / 'silicon' / 'bands.hdf5')
+    source_path = str(shared_datadir / 'silicon' / 'model.hdf5')
+    rng = np.random.RandomState(42)
+    on_site_shift = rng.uniform(-1, 1, size=tbmodels.io.load(source_path).size)
+    tb_models = {}
+    differences = {}
+    for name, scale in [('small', 0.1), ('large', 0.3)]:
+        model = tbmodels.io.load(source_path)
+        model.add_on_site(scale * on_site_shift)
+        model_path = str(tmp_path / 'model_{}.hdf5'.format(name))
+        model.to_hdf5_file(model_path)
+        tb_models[name] = orm.SinglefileData(file=model_path)
+        differences[name] = band_difference_inline(
+            tb_model=tb_models[name], reference_bands=reference_bands
+        )['difference'].value
+    assert differences['small'] < differences['large']
+
+    # The expensive evaluation has a large weight, such that the full cost
+    # of the 'small' model exceeds the partial cost of the 'large' model.
+    weights = [1., 100.]
+    assert sum(weights) * differences['small'] > differences['large']
+
+    results = {}
+    for name, tb_model in tb_models.items():
+        builder = get_combined_evaluation_builder()
+        builder.tb_model = tb_model
+        builder.process_classes = [
+            VectorizedBandDifferenceEvaluation,
+            VectorizedBandDifferenceEvaluation
+        ]
+        builder.extra_inputs = {'eval1': {}, 'eval2': {}}
+        builder.weights = orm.List(list=weights)
+        builder.cost_classes = orm.List(list=[0, 1])
+        builder.rejection_threshold = orm.Float(
+            (differences['small'] + differences['large']) / 2
+        )
+        builder.rejection_cost = orm.Float(1e3)
+        res, node = run_get_node(builder)
+        assert node.is_finished_ok
+        results[name] = res
+
+    assert not results['small']['rejected'].value
+    assert 'skipped_evaluations' not in results['small']
+    assert np.isclose(
+        results['small']['cost_value'].value,
+        sum(weights) * differences['small']
+    )
+    assert results['large']['rejected'].value
+    assert results['large']['skipped_evaluations'].get_list() == ['eval2']
+    assert np.isclose(results['large']['cost_value'].value, 1e3)
+    best = min(results, key=lambda name: results[name]['cost_value'].value)
+    assert best == 'small'
+
+
+def test_combined_evaluation_shared_bands(
+    configure_with_daemon,  # pylint: disable=unused-argument
+    get_combined_evaluation_builder  # pylint: disable=redefined-outer-name
+):
+    """
+    Run the combined evaluation workflow where the bandstructure of the
+    tight-binding model is shared among the band difference evaluations.
+    """
+    builder = get_combined_evaluation_builder()
+    builder.share_bands = orm.Bool(True)
+    res, node = run_get_node(builder)
+    assert np.isclose(res['cost_value'].value, 0.)
+    assert node.is_finished_ok
+    assert res['extra_outputs']['eval1']['calculated_bands'].uuid == res[
+        'extra_outputs']['eval2']['calculated_bands'].uuid
+    eigenvals_calcs = [
+        desc for desc in node.called_descendants
+        if desc.process_type == 'aiida.calculations:tbmodels.eigenvals'
+    ]
+    assert len(eigenvals_calcs) == 1
+
+
+def test_combined_evaluation_shared_bands_in_process(
+    configure_with_daemon,  # pylint: disable=unused-argument
+    get_combined_evaluation_builder  # pylint: disable=redefined-outer-name
+):
+    """
+    Run the combined evaluation workflow with shared bandstructure, where
+    all evaluations run in-process, and check that no eigenvals calculation
+    is submitted.
+    """
+    builder = get_combined_evaluation_builder()
+    builder.share_bands = orm.Bool(True)
+    builder.process_classes = [
+        BandDifferenceModelEvaluation, VectorizedBandDifferenceEvaluation
+    ]
+    builder.extra_inputs = {
+        'eval1': {
+            'local_execution': orm.Bool(True)
+        },
+        'eval2': {}
+    }
+    res, node = run_get_node(builder)
+    assert np.isclose(res['cost_value'].value, 0.)
+    assert node.is_finished_ok
+    assert res['extra_outputs']['eval1']['calculated_bands'].uuid == res[
+        'extra_outputs']['eval2']['calculated_bands'].uuid
+    assert not any(
+        desc.process_type == 'aiida.calculations:tbmodels.eigenvals'
+        for desc in node.called_descendants
+    )
@@ -13,6 +13,7 @@ from aiida import orm
 from aiida.engine.launch import run_get_node
 
 from aiida_tbextraction.model_evaluation import MaximumOrbitalDistanceEvaluation
+from aiida_tbextraction.model_evaluation._pos_distance import get_nearest_distances
 from aiida_bands_inspect.io import read
 
 
@@ -67,3 +68,23 @@ def test_pos_distance_uc_not_matching(
     assert node.is_finished
     assert node.exit_status == 300
     assert "unit cell" in node.exit_message
+
+
+def test_nearest_distances():
+    """
+    Check that the KD-tree based nearest distances match the minimum of
+    the full periodic distance matrix calculated by pymatgen.
+    """
+    unit_cell = np.array([[3., 0.2, 0.], [1.5, 2.5, 0.3], [0.4, -0.8, 4.]])
+    rng = np.random.RandomState(42)
+    frac_coords = rng.uniform(-1, 2, size=(30, 3))
+    reference_frac_coords = rng.uniform(size=(8, 3))
+    assert np.allclose(
+        get_nearest_distances(unit_cell, frac_coords, reference_frac_coords),
+        np.min(
+            pymatgen.Lattice(unit_cell).get_all_distances(
+                frac_coords, reference_frac_coords
+            ),
+            axis=-1
+        )
+    )
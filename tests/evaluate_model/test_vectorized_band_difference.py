@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Tests for the vectorized band difference model evaluation workflow.
+"""
+
+import pytest
+import numpy as np
+import tbmodels
+
+from aiida import orm
+from aiida.engine import run
+
+from aiida_tbextraction.model_evaluation import VectorizedBandDifferenceEvaluation
+from aiida_tbextraction.model_evaluation._band_difference import difference_inline
+from aiida_tbextraction.model_evaluation._vectorized_band_difference import band_difference_inline
+from aiida_tbextraction.model_evaluation import _eigenvals
+from aiida_tbextraction.model_evaluation._eigenvals import calculate_eigenvals, calculate_eigenvals_streaming
+from aiida_bands_inspect.io import read
+
+
+def test_vectorized_bandevaluation(
+    configure_with_daemon, shared_datadir, silicon_structure
+):  # pylint: disable=unused-argument
+    """
+    Run the vectorized band evaluation workflow.
+    """
+    builder = VectorizedBandDifferenceEvaluation.get_builder()
+    with (shared_datadir / 'silicon' / 'model.hdf5').open('rb') as model_file:
+        builder.tb_model = orm.SinglefileData(file=model_file)
+    builder.reference_bands = read(shared_datadir / 'silicon/bands.hdf5')
+    builder.reference_structure = silicon_structure
+    output = run(builder)
+    assert np.isclose(output['cost_value'].value, 0.)
+    assert 'plot' in output
+
+
+def test_vectorized_bandevaluation_streaming(
+    configure_with_daemon, shared_datadir, silicon_structure
+):  # pylint: disable=unused-argument
+    """
+    Run the vectorized band evaluation workflow, where the Hamiltonians
+    are constructed in chunks of k-points.
+    """
+    builder = VectorizedBandDifferenceEvaluation.get_builder()
+    with (shared_datadir / 'silicon' / 'model.hdf5').open('rb') as model_file:
+        builder.tb_model = orm.SinglefileData(file=model_file)
+    builder.reference_bands = read(shared_datadir / 'silicon/bands.hdf5')
+    builder.reference_structure = silicon_structure
+    builder.memory_budget = orm.Int(1)
+    output = run(builder)
+    assert np.isclose(output['cost_value'].value, 0.)
+
+
+def test_vectorized_bandevaluation_sharded_streaming(
+    configure_with_daemon, shared_datadir, silicon_structure
+):  # pylint: disable=unused-argument
+    """
+    Check that giving both 'num_processes' and 'memory_budget' is rejected.
+    """
+    builder = VectorizedBandDifferenceEvaluation.get_builder()
+    with (shared_datadir / 'silicon' / 'model.hdf5').open('rb') as model_file:
+        builder.tb_model = orm.SinglefileData(file=model_file)
+    builder.reference_bands = read(shared_datadir / 'silicon/bands.hdf5')
+    builder.reference_structure = silicon_structure
+    builder.num_processes = orm.Int(2)
+    builder.memory_budget = orm.Int(1)
+    with pytest.raises(ValueError):
+        run(builder)
+
+
+@pytest.mark.parametrize('memory_budget', [None, 1])
+def test_band_difference_matches_bands_inspect(
+    configure, shared_datadir, tmp_path, memory_budget
+):  # pylint: disable=unused-argument
+    """
+    Check that the cost value of the vectorized band difference matches
+    the difference calculated by ``difference_inline``, for a model which
+    does not reproduce the reference bands.
+    """
+    model = tbmodels.io.load(str(shared_datadir / 'silicon' / 'model.hdf5'))
+    rng = np.random.RandomState(42)
+    model.add_on_site(rng.uniform(-0.5, 0.5, size=model.size))
+    model_path = str(tmp_path / 'model_shifted.hdf5')
+    model.to_hdf5_file(model_path)
+    reference_bands = read(shared_datadir / 'silicon/bands.hdf5')
+
+    inputs = {}
+    if memory_budget is not None:
+        inputs['memory_budget'] = orm.Int(memory_budget)
+    result = band_difference_inline(
+        tb_model=orm.SinglefileData(file=model_path),
+        reference_bands=reference_bands,
+        **inputs
+    )
+    expected = difference_inline(
+        bands1=reference_bands, bands2=result['bands']
+    )
+    assert result['difference'].value > 0
+    assert np.isclose(result['difference'].value, expected.value)
+
+
+def test_calculate_eigenvals(shared_datadir):
+    """
+    Check that the vectorized eigenvalues match those calculated by
+    TBmodels.
+    """
+    model = tbmodels.io.load(str(shared_datadir / 'silicon' / 'model.hdf5'))
+    rng = np.random.RandomState(42)
+    kpoints = rng.uniform(size=(20, 3))
+    assert np.allclose(
+        calculate_eigenvals(model, kpoints), model.eigenval(kpoints)
+    )
+
+
+def test_calculate_eigenvals_sharded(shared_datadir):
+    """
+    Check that the eigenvalues calculated by multiple worker processes
+    match the serial result, in the same order.
+    """
+    model = tbmodels.io.load(str(shared_datadir / 'silicon' / 'model.hdf5'))
+    rng = np.random.RandomState(42)
+    kpoints = rng.uniform(size=(21, 3))
+    assert np.allclose(
+        calculate_eigenvals(model, kpoints, num_processes=3),
+        calculate_eigenvals(model, kpoints)
+    )
+
+
+@pytest.mark.parametrize('memory_budget', [1, 10**4, 10**9])
+def test_calculate_eigenvals_streaming(shared_datadir, memory_budget):
+    """
+    Check that the eigenvalues calculated in chunks from the HDF5 file
+    match those calculated by TBmodels.
+    """
+    model_path = str(shared_datadir / 'silicon' / 'model.hdf5')
+    model = tbmodels.io.load(model_path)
+    rng = np.random.RandomState(42)
+    kpoints = rng.uniform(size=(20, 3))
+    assert np.allclose(
+        calculate_eigenvals_streaming(
+            model_path, kpoints, memory_budget=memory_budget
+        ), model.eigenval(kpoints)
+    )
+
+
+@pytest.mark.parametrize(
+    'memory_budget, num_reads', [(10**4, 67), (2 * 10**5, 1)]
+)
+def test_calculate_eigenvals_streaming_cached(
+    shared_datadir, monkeypatch, memory_budget, num_reads
+):
+    """
+    Check that the hopping matrices are read only once if they fit into
+    half of the memory budget, and once per chunk of k-points otherwise.
+    """
+    model_path = str(shared_datadir / 'silicon' / 'model.hdf5')
+    model = tbmodels.io.load(model_path)
+    rng = np.random.RandomState(42)
+    kpoints = rng.uniform(size=(200, 3))
+
+    reads = []
+    iter_hop = _eigenvals._iter_hop  # pylint: disable=protected-access
+
+    def _counting_iter_hop(hdf5_file):
+        reads.append(hdf5_file)
+        return iter_hop(hdf5_file)
+
+    monkeypatch.setattr(_eigenvals, '_iter_hop', _counting_iter_hop)
+    assert np.allclose(
+        calculate_eigenvals_streaming(
+            model_path, kpoints, memory_budget=memory_budget
+        ), model.eigenval(kpoints)
+    )
+    assert len(reads) == num_reads
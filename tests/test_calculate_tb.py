@@ -17,6 +17,7 @@ from aiida import orm
 from aiida.engine import run_get_node
 
 from aiida_tbextraction.calculate_tb import TightBindingCalculation
+from aiida_tbextraction._model_storage import get_model_hash
 
 
 @pytest.mark.parametrize('slice_', [True, False])
@@ -100,3 +101,231 @@ def test_tbextraction(
     result, node = run_get_node(builder)
     assert node.is_finished_ok
     assert 'tb_model' in result
+
+
+@pytest.fixture
+def tb_builder(test_data_dir, code_wannier90):
+    """
+    Returns a function that creates the input for TightBindingCalculation tests.
+    """
+    def inner(slice_, symmetries):
+        builder = TightBindingCalculation.get_builder()
+
+        wannier_input_folder = orm.FolderData()
+        wannier_input_folder_path = test_data_dir / 'wannier_input_folder'
+        for filename in os.listdir(wannier_input_folder_path):
+            wannier_input_folder.put_object_from_file(
+                str((wannier_input_folder_path / filename).resolve()), filename
+            )
+        builder.wannier.local_input_folder = wannier_input_folder
+
+        builder.wannier.code = code_wannier90
+
+        builder.code_tbmodels = orm.Code.get_from_string('tbmodels')
+
+        k_values = [
+            x if x <= 0.5 else -1 + x
+            for x in np.linspace(0, 1, 6, endpoint=False)
+        ]
+        k_points = [
+            list(reversed(k)) for k in itertools.product(k_values, repeat=3)
+        ]
+        wannier_kpoints = orm.KpointsData()
+        wannier_kpoints.set_kpoints(k_points)
+        builder.wannier.kpoints = wannier_kpoints
+
+        a = 3.2395  # pylint: disable=invalid-name
+        structure = orm.StructureData()
+        structure.set_pymatgen_structure(
+            pymatgen.Structure(
+                lattice=[[0, a, a], [a, 0, a], [a, a, 0]],
+                species=['In', 'Sb'],
+                coords=[[0] * 3, [0.25] * 3]
+            )
+        )
+        builder.structure = structure
+
+        builder.wannier.parameters = orm.Dict(
+            dict=dict(
+                num_wann=14,
+                num_bands=36,
+                dis_num_iter=1000,
+                num_iter=0,
+                dis_win_min=-4.5,
+                dis_win_max=16.,
+                dis_froz_min=-4,
+                dis_froz_max=6.5,
+                spinors=True,
+                mp_grid=[6, 6, 6]
+            )
+        )
+        builder.wannier.metadata.options = {
+            'resources': {
+                'num_machines': 1,
+                'tot_num_mpiprocs': 1
+            },
+            'withmpi': False
+        }
+        if symmetries:
+            # This is needed because otherwise the symmetrization doesn't work
+            builder.parse.calc.distance_ratio_threshold = orm.Float(2.)
+
+            builder.symmetries = orm.SinglefileData(
+                file=str(test_data_dir / 'symmetries.hdf5')
+            )
+        if slice_:
+            slice_idx = orm.List()
+            slice_idx.extend([0, 2, 3, 1, 5, 6, 4, 7, 9, 10, 8, 12, 13, 11])
+            builder.slice_idx = slice_idx
+        return builder
+
+    return inner
+
+
+@pytest.mark.parametrize('slice_', [True, False])
+@pytest.mark.parametrize('symmetries', [True, False])
+def test_tbextraction_fused(
+    configure_with_daemon, tb_builder, slice_, symmetries
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the tight-binding calculation workflow with the fused TBmodels
+    step, optionally including symmetrization and slicing of orbitals.
+    """
+    builder = tb_builder(slice_=slice_, symmetries=symmetries)
+    builder.fuse_tbmodels = orm.Bool(True)
+
+    result, node = run_get_node(builder)
+    assert node.is_finished_ok
+    assert 'tb_model' in result
+    assert 'tb_model_truncated' not in result
+
+
+def test_tbextraction_truncated(configure_with_daemon, tb_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the tight-binding calculation workflow with truncation of small
+    and long-range hopping terms.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.truncation_hopping_threshold = orm.Float(1e-3)
+    builder.truncation_distance_cutoff = orm.Float(10.)
+
+    result, node = run_get_node(builder)
+    assert node.is_finished_ok
+    assert 'tb_model' in result
+    assert 'tb_model_truncated' in result
+    truncation_info = result['truncation_info'].get_dict()
+    assert truncation_info['num_hoppings_truncated'] < truncation_info[
+        'num_hoppings']
+    assert truncation_info['max_eigenvalue_difference'] >= 0
+
+
+def test_tbextraction_compressed(configure_with_daemon, tb_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the tight-binding calculation workflow where the Wannier90 output
+    files are compressed before they are retrieved.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.fuse_tbmodels = orm.Bool(True)
+    builder.compress_output = orm.Bool(True)
+
+    result, node = run_get_node(builder)
+    assert node.is_finished_ok
+    assert 'tb_model' in result
+    wannier_calc, = [
+        child for child in node.called
+        if child.process_label == 'Wannier90Calculation'
+    ]
+    retrieved_files = wannier_calc.outputs.retrieved.list_object_names()
+    assert 'aiida_hr.dat.gz' in retrieved_files
+    assert 'aiida_hr.dat' not in retrieved_files
+    assert 'aiida.win.gz' in retrieved_files
+    assert 'aiida.win' not in retrieved_files
+
+
+def test_tbextraction_compressed_requires_fused(
+    configure_with_daemon, tb_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Check that compressing the Wannier90 output is rejected if the TBmodels
+    steps are not fused.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.compress_output = orm.Bool(True)
+
+    with pytest.raises(ValueError):
+        run_get_node(builder)
+
+
+def test_tbextraction_compact(configure_with_daemon, tb_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the tight-binding calculation workflow with and without compact
+    model storage, and check that the models have the same content.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.fuse_tbmodels = orm.Bool(True)
+
+    result_plain, node_plain = run_get_node(builder)
+    assert node_plain.is_finished_ok
+    builder.compact_model_storage = orm.Bool(True)
+    result_compact, node_compact = run_get_node(builder)
+    assert node_compact.is_finished_ok
+
+    with result_plain['tb_model'].open(mode='rb') as handle:
+        plain_hash = get_model_hash(handle)
+    with result_compact['tb_model'].open(mode='rb') as handle:
+        compact_hash = get_model_hash(handle)
+    assert plain_hash == compact_hash
+
+
+def test_tbextraction_compact_deduplicated(configure_with_daemon, tb_builder):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Run the tight-binding calculation workflow twice with compact model
+    storage, and check that the identical models are deduplicated through
+    a workfunction which links the new and the existing model.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.fuse_tbmodels = orm.Bool(True)
+    builder.compact_model_storage = orm.Bool(True)
+
+    result_first, node_first = run_get_node(builder)
+    assert node_first.is_finished_ok
+    result_second, node_second = run_get_node(builder)
+    assert node_second.is_finished_ok
+    first_model = result_first['tb_model']
+    assert result_second['tb_model'].uuid == first_model.uuid
+
+    dedup_call, = [
+        child for child in node_second.called
+        if child.process_label == 'deduplicate_model_inline'
+    ]
+    assert dedup_call.inputs.existing_model.uuid == first_model.uuid
+    assert dedup_call.inputs.tb_model.uuid != first_model.uuid
+    assert dedup_call.inputs.tb_model.creator.caller.uuid == node_second.uuid
+
+
+def test_tbextraction_compact_requires_fused(
+    configure_with_daemon, tb_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Check that compact model storage is rejected if the TBmodels steps are
+    not fused.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.compact_model_storage = orm.Bool(True)
+
+    with pytest.raises(ValueError):
+        run_get_node(builder)
+
+
+def test_tbextraction_preprocess_requires_fused(
+    configure_with_daemon, tb_builder
+):  # pylint: disable=unused-argument,redefined-outer-name
+    """
+    Check that pre-processing the symmetries is rejected if the TBmodels
+    steps are not fused.
+    """
+    builder = tb_builder(slice_=True, symmetries=True)
+    builder.preprocess_symmetries = orm.Bool(True)
+
+    with pytest.raises(ValueError):
+        run_get_node(builder)
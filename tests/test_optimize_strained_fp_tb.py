@@ -15,14 +15,17 @@ from aiida_tbextraction.optimize_strained_fp_tb import OptimizeStrainedFirstPrin
 
 
 @pytest.mark.qe
+@pytest.mark.parametrize('warm_start', [False, True])
 def test_strained_fp_tb(
     configure_with_daemon,  # pylint: disable=unused-argument
     get_optimize_fp_tb_input,
+    warm_start,
 ):
     """
     Run the DFT tight-binding optimization workflow with strain on an InSb sample for three strain values.
     """
     inputs = get_optimize_fp_tb_input()
+    inputs['warm_start'] = orm.Bool(warm_start)
 
     inputs['strain_kind'] = orm.Str('three_five.Biaxial001')
     inputs['strain_parameters'] = orm.Str('InSb')
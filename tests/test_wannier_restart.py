@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# © 2017-2019, ETH Zurich, Institut für Theoretische Physik
+# Author: Dominik Gresch <greschd@gmx.ch>
+"""
+Tests for creating the Wannier90 initial projections from a checkpoint.
+"""
+
+import io
+import struct
+
+import numpy as np
+
+from aiida_tbextraction._wannier_restart import read_checkpoint_gauge, write_amn
+
+
+def _record(data):
+    marker = struct.pack('<i', len(data))
+    return marker + data + marker
+
+
+def _write_checkpoint(u_matrix_opt, u_matrix, lwindow):
+    """
+    Create the content of an unformatted Wannier90 checkpoint file.
+    """
+    num_kpts, num_bands, num_wann = u_matrix_opt.shape
+    records = [
+        b'header'.ljust(33),
+        struct.pack('<i', num_bands),
+        struct.pack('<i', 0),
+        b'',
+        np.eye(3).tobytes(order='F'),
+        np.eye(3).tobytes(order='F'),
+        struct.pack('<i', num_kpts),
+        struct.pack('<3i', num_kpts, 1, 1),
+        np.zeros((3, num_kpts)).tobytes(order='F'),
+        struct.pack('<i', 2),
+        struct.pack('<i', num_wann),
+        b'postwann'.ljust(20),
+        struct.pack('<i', 1),
+        struct.pack('<d', 1.),
+        lwindow.T.astype('<i4').tobytes(order='F'),
+        np.sum(lwindow, axis=-1).astype('<i4').tobytes(),
+        u_matrix_opt.transpose(1, 2, 0).astype('<c16').tobytes(order='F'),
+        u_matrix.transpose(1, 2, 0).astype('<c16').tobytes(order='F'),
+    ]
+    return b''.join(_record(data) for data in records)
+
+
+def test_checkpoint_gauge():
+    """
+    Check that the gauge read from a checkpoint file is U_opt U, with the
+    rows of U_opt mapped to the bands inside the outer window.
+    """
+    rng = np.random.RandomState(42)
+    num_bands, num_wann = 6, 2
+    lwindow = np.array([[1, 1, 1, 1, 0, 0], [0, 1, 1, 1, 1, 0],
+                        [1, 1, 1, 1, 1, 1]],
+                       dtype=bool)
+    num_kpts = len(lwindow)
+    u_matrix = rng.normal(
+        size=(num_kpts, num_wann, num_wann)
+    ) + 1j * rng.normal(size=(num_kpts, num_wann, num_wann))
+    u_matrix_opt = np.zeros((num_kpts, num_bands, num_wann), dtype=complex)
+    for k_idx, num_win in enumerate(np.sum(lwindow, axis=-1)):
+        u_matrix_opt[k_idx, :num_win] = rng.normal(size=(num_win, num_wann))
+
+    gauge = read_checkpoint_gauge(
+        io.BytesIO(_write_checkpoint(u_matrix_opt, u_matrix, lwindow))
+    )
+    assert gauge.shape == (num_kpts, num_bands, num_wann)
+    for k_idx, num_win in enumerate(np.sum(lwindow, axis=-1)):
+        assert np.allclose(gauge[k_idx, ~lwindow[k_idx]], 0)
+        assert np.allclose(
+            gauge[k_idx, lwindow[k_idx]],
+            u_matrix_opt[k_idx, :num_win] @ u_matrix[k_idx]
+        )
+
+    amn_file = io.StringIO()
+    write_amn(amn_file, gauge)
+    lines = amn_file.getvalue().splitlines()
+    assert lines[1].split() == [str(num_bands), str(num_kpts), str(num_wann)]
+    assert len(lines) == 2 + num_kpts * num_bands * num_wann
+    m_idx, n_idx, k_idx, real, imag = lines[-1].split()
+    assert np.isclose(
+        float(real) + 1j * float(imag), gauge[int(k_idx) - 1,
+                                              int(m_idx) - 1,
+                                              int(n_idx) - 1]
+    )